@@ -1,27 +1,42 @@
+import argparse
+import csv
+import io
 import json
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-import requests
+from functools import lru_cache
 import configparser
 
+import numpy as np
+
+from depreciation_schedule import DepreciationSchedules
+from fred_cache import FredCache, FredClient
+from inflation_projection import DEFAULT_BLOCK_YEARS, DEFAULT_PATHS, inflation_factor_bands, project_costs
+from report_store import ReportStore, ReportStoreError
+
 # Constants
 DEFAULT_YIELD_PER_PLANT = 0.5  # Default yield per plant in pounds
 SERIES_ID = "FPCPITOTLZGUSA"   # FRED API series ID for inflation data
+FRED_CACHE_FILE = "fred_cache.json"  # Local cache of FRED observations, next to the script
+DEFAULT_FRED_CACHE_TTL_HOURS = 24
+REPORT_DB_FILE = "virginia_hobby_gardening_report_data.db"  # Investments, variable costs and last run inputs
+LEGACY_REPORT_JSON_FILE = "virginia_hobby_gardening_report_data.json"  # Imported into REPORT_DB_FILE once
 
 # Initialize configuration
 config = configparser.ConfigParser()
 script_dir = os.path.dirname(os.path.abspath(__file__))
 config.read(os.path.join(script_dir, 'config.ini'))
 
-# Retrieve or prompt for FRED API key
-def get_api_key():
+# Retrieve or prompt for FRED API key, without a prompt (batch mode) a missing key means cached data only
+def get_api_key(prompt=True):
     if 'Config' in config and 'FRED_API_KEY' in config['Config']:
         return config['Config']['FRED_API_KEY']
-    else:
-        print("Config file not found or missing FRED_API_KEY. Please enter your API key:")
-        return input().strip()
-
-FRED_API_KEY = get_api_key()
+    if not prompt:
+        return None
+    print("Config file not found or missing FRED_API_KEY. Please enter your API key:")
+    return input().strip()
 
 ### Helper Functions ###
 def get_date_input(prompt, default=None):
@@ -57,48 +72,20 @@ def get_int_input(prompt, default=None):
         except ValueError:
             print("Please enter a non-negative integer.")
 
-### Depreciation Calculation Functions ###
-def calculate_straight_line_depreciation(amount, amortization_years, start_date, report_date):
-    """Calculate annual depreciation using straight-line method."""
-    start_year = start_date.year
-    end_date = start_date.replace(year=start_year + amortization_years)
-    if report_date < start_date or report_date >= end_date:
-        return 0.0
-    return amount / amortization_years
-
-def calculate_double_declining_balance(amount, amortization_years, start_date, report_date):
-    """Calculate annual depreciation using double-declining balance method."""
-    start_year = start_date.year
-    end_date = start_date.replace(year=start_year + amortization_years)
-    if report_date < start_date or report_date >= end_date:
-        return 0.0
-    years_elapsed = (report_date - start_date).days / 365.25
-    rate = 2 / amortization_years
-    if years_elapsed < 1:
-        return amount * rate
-    elif years_elapsed < amortization_years:
-        remaining = amount
-        for year in range(int(years_elapsed) + 1):
-            annual_dep = remaining * rate
-            remaining -= annual_dep
-            if year == int(years_elapsed):
-                return annual_dep if remaining > 0 else remaining + annual_dep
-    return 0.0
-
 ### Data Fetching and Processing Functions ###
-def fetch_inflation_data(api_key, series_id, start_date="1960-01-01"):
-    """Fetch inflation data from FRED API."""
-    url = f"https://api.stlouisfed.org/fred/series/observations?series_id={series_id}&api_key={api_key}&file_type=json&observation_start={start_date}"
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        observations = data['observations']
-        inflation_data = [(obs['date'][:4], float(obs['value'])) for obs in observations if obs['value'] != '.']
-        return inflation_data
-    except (requests.RequestException, KeyError, ValueError) as e:
-        print(f"Error fetching inflation data: {e}")
-        return []
+def get_fred_cache(api_key, offline=False):
+    """Build the FRED observation cache from config.ini ([Config] fred_cache_ttl_hours, fred_offline)."""
+    settings = config['Config'] if 'Config' in config else {}
+    ttl_hours = float(settings.get('fred_cache_ttl_hours', DEFAULT_FRED_CACHE_TTL_HOURS))
+    offline = offline or str(settings.get('fred_offline', 'false')).strip().lower() in ('1', 'true', 'yes')
+    return FredCache(os.path.join(script_dir, FRED_CACHE_FILE), client=FredClient(api_key) if api_key else None,
+                     ttl=timedelta(hours=ttl_hours), offline=offline)
+
+def fetch_inflation_data(api_key, series_id, start_date="1960-01-01", cache=None, refresh=False):
+    """Fetch inflation data from FRED API, through the on-disk cache."""
+    if cache is None:
+        cache = get_fred_cache(api_key)
+    return [(date[:4], value) for date, value in cache.observations(series_id, start_date, refresh=refresh)]
 
 def calculate_average_variable_costs(historical_data, current_year):
     """Calculate average variable costs from the past 5 years."""
@@ -112,19 +99,16 @@ def calculate_average_variable_costs(historical_data, current_year):
         avg_costs[category] = total / len(past_years)
     return avg_costs
 
-def get_user_inputs():
-    """Collect user inputs and load historical data."""
-    json_path = os.path.join(script_dir, "virginia_hobby_gardening_report_data.json")
-    previous_data = {}
-    if os.path.exists(json_path):
-        try:
-            with open(json_path, "r") as f:
-                previous_data = json.load(f)
-        except json.JSONDecodeError:
-            print("Corrupted JSON file. Starting fresh.")
-    
-    historical_variable_costs = previous_data.get("historical_variable_costs", [])
-    investments = previous_data.get("investments", [])
+def get_report_store():
+    """Open the report data store next to the script, importing the old JSON data file on first use."""
+    return ReportStore(os.path.join(script_dir, REPORT_DB_FILE),
+                       legacy_json_path=os.path.join(script_dir, LEGACY_REPORT_JSON_FILE))
+
+def get_user_inputs(store):
+    """Collect user inputs and load the stored data the report needs."""
+    previous_data = store.settings()
+    investments = store.investments()
+    new_investments = []
     last_report_date = previous_data.get("last_report_date", "2024-12-31")
     last_num_plants = previous_data.get("last_num_plants", 300)
     last_yield_per_plant = previous_data.get("last_yield_per_plant", DEFAULT_YIELD_PER_PLANT)
@@ -134,7 +118,7 @@ def get_user_inputs():
     end_date = get_date_input("End date", start_date.strftime("%Y-%m-%d"))
     if end_date < start_date:
         print("End date must be after start date.")
-        return get_user_inputs()
+        return get_user_inputs(store)
     
     # Collect new investments
     num_new_investments = get_int_input("Number of new investments (default 0)", "0")
@@ -146,12 +130,13 @@ def get_user_inputs():
         while method not in ['s', 'd', 'straight-line', 'double-declining']:
             method = input("Please choose 's' for straight-line or 'd' for double-declining: ").lower()
         method = 'straight-line' if method in ['s', 'straight-line'] else 'double-declining'
-        investments.append({
+        new_investments.append({
             "amount": amount,
             "start_date": inv_start_date.strftime("%Y-%m-%d"),
             "amortization_years": amortization_years,
             "method": method
         })
+    investments += new_investments
     
     # Define variable cost categories
     if 'Config' in config and 'variable_cost_categories' in config['Config']:
@@ -170,20 +155,44 @@ def get_user_inputs():
     num_plants = get_int_input(f"Number of plants (default {last_num_plants})", str(last_num_plants))
     yield_per_plant = get_float_input(f"Yield per plant in pounds (default {last_yield_per_plant})", str(last_yield_per_plant))
     
-    return investments, start_date, end_date, variable_costs, num_plants, yield_per_plant, historical_variable_costs
+    # Only the years calculate_average_variable_costs averages over are loaded
+    historical_variable_costs = store.recent_variable_costs(start_date.year)
+    
+    return investments, new_investments, start_date, end_date, variable_costs, num_plants, yield_per_plant, historical_variable_costs
+
+def summarize_inflation(inflation_data):
+    """Average inflation rate (decimal) and latest year of the FRED data, or the 3.77% default and None."""
+    if inflation_data:
+        inflation_rates = [rate for _, rate in inflation_data]
+        average_inflation_rate = sum(inflation_rates) / len(inflation_rates) / 100  # Convert percentage to decimal
+        latest_year = max([int(year) for year, _ in inflation_data])
+        return average_inflation_rate, latest_year
+    print("Failed to fetch inflation data. Using default 3.77% inflation rate.")
+    return 0.0377, None
+
+def simulate_inflation_bands(inflation_data, paths=DEFAULT_PATHS, block_years=DEFAULT_BLOCK_YEARS, seed=None):
+    """P10/P50/P90 inflation factors for the 20-year projection, block-bootstrapped from the FRED rates (None without data)."""
+    if not inflation_data or paths <= 0:
+        return None
+    return inflation_factor_bands([rate for _, rate in inflation_data], years=20, paths=paths,
+                                  block_years=block_years, seed=seed)
 
 ### Cost Calculation Functions ###
-def calculate_amortized_fixed_costs(investments, report_date):
-    """Calculate total amortized fixed costs for a given report date."""
-    total_amortized = 0.0
-    for inv in investments:
-        start_date = datetime.strptime(inv["start_date"], "%Y-%m-%d")
-        if inv["method"] == "straight-line":
-            depreciation = calculate_straight_line_depreciation(inv["amount"], inv["amortization_years"], start_date, report_date)
-        else:
-            depreciation = calculate_double_declining_balance(inv["amount"], inv["amortization_years"], start_date, report_date)
-        total_amortized += depreciation
-    return total_amortized
+@lru_cache(maxsize=None)
+def parse_date(date_str):
+    """Parse a YYYY-MM-DD date once, investments share their start dates across reports and scenarios."""
+    return datetime.strptime(date_str, "%Y-%m-%d")
+
+def compile_depreciation_schedules(investments):
+    """Compile the investments once into depreciation schedules (straight-line or double-declining balance)."""
+    return DepreciationSchedules(investments, parse_date)
+
+def calculate_amortized_fixed_costs(investments, report_dates, schedules=None):
+    """Calculate total amortized fixed costs for a report date, or an array of them for a list of dates."""
+    if schedules is None:
+        schedules = compile_depreciation_schedules(investments)
+    totals = schedules.total(report_dates)
+    return float(totals[0]) if hasattr(report_dates, 'toordinal') else totals
 
 def calculate_total_annual_costs(amortized_fixed, variable_costs):
     """Calculate total annual costs combining fixed and variable costs."""
@@ -199,10 +208,13 @@ def calculate_cost_per_pound(total_annual_costs, num_plants, yield_per_plant):
     return total_annual_costs / total_pounds if total_pounds > 0 else 0
 
 ### Report Generation ###
-def generate_html_report(investments, report_date, variable_costs, num_plants, yield_per_plant, 
-                        amortized_fixed, total_annual_costs, cost_per_plant, cost_per_pound, 
-                        average_inflation_rate, latest_year, avg_variable_costs):
-    """Generate an HTML report with current costs and 20-year projection."""
+def render_html_report(investments, report_date, variable_costs, num_plants, yield_per_plant,
+                       amortized_fixed, total_annual_costs, cost_per_plant, cost_per_pound,
+                       average_inflation_rate, latest_year, avg_variable_costs, schedules=None,
+                       inflation_bands=None):
+    """Render the HTML report with current costs and 20-year projection."""
+    if schedules is None:
+        schedules = compile_depreciation_schedules(investments)
     html_content = f"""
     <!DOCTYPE html>
     <html>
@@ -222,11 +234,7 @@ def generate_html_report(investments, report_date, variable_costs, num_plants, y
         <table>
             <tr><th>Start Date</th><th>Amount</th><th>Years</th><th>Method</th><th>Annual Depreciation</th></tr>
     """
-    for inv in investments:
-        start_date = datetime.strptime(inv["start_date"], "%Y-%m-%d")
-        depreciation = (calculate_straight_line_depreciation if inv["method"] == "straight-line" 
-                       else calculate_double_declining_balance)(inv["amount"], inv["amortization_years"], 
-                                                                start_date, report_date)
+    for inv, depreciation in zip(investments, schedules.depreciation(report_date)[:, 0]):
         html_content += f"""
             <tr>
                 <td>{inv['start_date']}</td>
@@ -265,6 +273,10 @@ def generate_html_report(investments, report_date, variable_costs, num_plants, y
     inflation_note = (f"Projections use an average inflation rate of {average_inflation_rate*100:.2f}% "
                      f"based on data from 1960 to {latest_year}.") if latest_year else \
                      "Projections use a default inflation rate of 3%."
+    if inflation_bands is not None:
+        inflation_note += (f" Total annual cost percentiles ({'/'.join(f'P{p}' for p in inflation_bands.percentiles)}) "
+                           f"come from {inflation_bands.paths:,} inflation paths resampled from the historical rates "
+                           f"in {inflation_bands.block_years}-year blocks.")
     html_content += f"""
         <h2>20-Year Cost Projection (Based on Average of Past 5 Years' Variable Costs)</h2>
         <p>{inflation_note}</p>
@@ -274,24 +286,33 @@ def generate_html_report(investments, report_date, variable_costs, num_plants, y
     categories = list(avg_variable_costs.keys())
     for cat in categories:
         html_content += f"<th>{cat.capitalize()}</th>"
-    html_content += "<th>Total Variable Costs</th><th>Total Annual Costs</th></tr>"
+    html_content += "<th>Total Variable Costs</th><th>Total Annual Costs</th>"
+    if inflation_bands is not None:
+        for p in inflation_bands.percentiles:
+            html_content += f"<th>Total Annual Costs P{p}</th>"
+    html_content += "</tr>"
     
-    for i in range(1, 21):
-        future_date = report_date + timedelta(days=365.25 * i)
-        amortized_fixed_future = calculate_amortized_fixed_costs(investments, future_date)
-        projected_vars = {cat: avg_variable_costs[cat] * (1 + average_inflation_rate)**i for cat in categories}
-        total_vars_future = sum(projected_vars.values())
-        total_annual_future = amortized_fixed_future + total_vars_future
+    years = np.arange(1, 21)
+    future_dates = [report_date + timedelta(days=365.25 * i) for i in years]
+    fixed_projection = calculate_amortized_fixed_costs(investments, future_dates, schedules)
+    projected_vars = project_costs([avg_variable_costs[cat] for cat in categories], (1 + average_inflation_rate)**years)
+    total_vars_projection = projected_vars.sum(axis=0)
+    total_annual_projection = fixed_projection + total_vars_projection
+    if inflation_bands is not None:
+        # Costs grow with the inflation factor, so each percentile of the total is the total at that factor
+        band_projection = fixed_projection + project_costs([sum(avg_variable_costs.values())], inflation_bands.factors)[0]
+    for index, future_date in enumerate(future_dates):
         html_content += f"""
             <tr>
                 <td>{future_date.year}</td>
-                <td>${amortized_fixed_future:,.2f}</td>
+                <td>${fixed_projection[index]:,.2f}</td>
         """
-        for cat in categories:
-            html_content += f"<td>${projected_vars[cat]:,.2f}</td>"
+        for cat_index in range(len(categories)):
+            html_content += f"<td>${projected_vars[cat_index, index]:,.2f}</td>"
+        band_cells = "".join(f"<td>${band:,.2f}</td>" for band in band_projection[:, index]) if inflation_bands is not None else ""
         html_content += f"""
-                <td>${total_vars_future:,.2f}</td>
-                <td>${total_annual_future:,.2f}</td>
+                <td>${total_vars_projection[index]:,.2f}</td>
+                <td>${total_annual_projection[index]:,.2f}</td>{band_cells}
             </tr>
         """
     
@@ -300,7 +321,17 @@ def generate_html_report(investments, report_date, variable_costs, num_plants, y
     </body>
     </html>
     """
-    
+    return html_content
+
+def generate_html_report(investments, report_date, variable_costs, num_plants, yield_per_plant,
+                         amortized_fixed, total_annual_costs, cost_per_plant, cost_per_pound,
+                         average_inflation_rate, latest_year, avg_variable_costs, schedules=None,
+                         inflation_bands=None):
+    """Generate an HTML report with current costs and 20-year projection."""
+    html_content = render_html_report(investments, report_date, variable_costs, num_plants, yield_per_plant,
+                                      amortized_fixed, total_annual_costs, cost_per_plant, cost_per_pound,
+                                      average_inflation_rate, latest_year, avg_variable_costs, schedules,
+                                      inflation_bands)
     # Save the report
     filename = f"virginia_hobby_gardening_report_{report_date.strftime('%Y%m%d')}.html"
     report_path = os.path.join(script_dir, filename)
@@ -308,11 +339,189 @@ def generate_html_report(investments, report_date, variable_costs, num_plants, y
         f.write(html_content)
     print(f"Report generated: {filename}")
 
+def report_dates(start_date, end_date):
+    """One report date per year from start_date through end_date."""
+    dates = []
+    current_date = start_date
+    while current_date <= end_date:
+        dates.append(current_date)
+        current_date += timedelta(days=365.25)
+    return dates
+
+def calculate_report_figures(amortized_fixed, variable_costs, num_plants, yield_per_plant):
+    """Amortized fixed costs, total annual costs, cost per plant and cost per pound for one report date."""
+    amortized_fixed = float(amortized_fixed)
+    total_annual_costs = calculate_total_annual_costs(amortized_fixed, variable_costs)
+    cost_per_plant = calculate_cost_per_plant(total_annual_costs, num_plants)
+    cost_per_pound = calculate_cost_per_pound(total_annual_costs, num_plants, yield_per_plant)
+    return amortized_fixed, total_annual_costs, cost_per_plant, cost_per_pound
+
+### Batch Mode ###
+def read_scenarios(path):
+    """
+    Read report scenarios from a JSON file (a list of objects or one object) or a CSV file ('-' is stdin).
+
+    JSON scenarios use the fields name, start_date, end_date, investments, variable_costs, num_plants,
+    yield_per_plant and historical_variable_costs. CSV rows use name, start_date, end_date, num_plants,
+    yield_per_plant, an investments column holding a JSON list and one cost:<category> column per
+    variable cost category.
+    """
+    if path == '-':
+        text = sys.stdin.read()
+    else:
+        with open(path, newline='') as f:
+            text = f.read()
+    if text.lstrip().startswith(('[', '{')):
+        rows = json.loads(text)
+        return [rows] if isinstance(rows, dict) else rows
+    scenarios = []
+    for row in csv.DictReader(io.StringIO(text)):
+        scenario = {key: value for key, value in row.items() if value not in (None, '') and not key.startswith('cost:')}
+        scenario['variable_costs'] = {key[len('cost:'):]: float(value) for key, value in row.items()
+                                      if key.startswith('cost:') and value not in (None, '')}
+        if 'investments' in scenario:
+            scenario['investments'] = json.loads(scenario['investments'])
+        scenarios.append(scenario)
+    return scenarios
+
+def validate_scenario(raw, number):
+    """Check one scenario and fill in the defaults, raises ValueError naming the scenario."""
+    if not isinstance(raw, dict):
+        raise ValueError(f"scenario_{number}: expected an object with the scenario fields, got {raw!r}")
+    name = str(raw.get('name') or f"scenario_{number}")
+    try:
+        start_date = parse_date(raw['start_date'])
+        end_date = parse_date(raw.get('end_date', raw['start_date']))
+        if end_date < start_date:
+            raise ValueError("end_date is before start_date")
+        investments = []
+        for inv in raw.get('investments', []):
+            method = inv.get('method', 'straight-line')
+            if method not in ('s', 'd', 'straight-line', 'double-declining'):
+                raise ValueError(f"unknown depreciation method {method!r}")
+            method = 'straight-line' if method in ('s', 'straight-line') else 'double-declining'
+            parse_date(inv['start_date'])
+            investments.append({"amount": float(inv['amount']), "start_date": inv['start_date'],
+                                "amortization_years": int(inv['amortization_years']), "method": method})
+        num_plants = int(raw.get('num_plants', 0))
+        yield_per_plant = float(raw.get('yield_per_plant', DEFAULT_YIELD_PER_PLANT))
+        variable_costs = {category: float(cost) for category, cost in raw.get('variable_costs', {}).items()}
+    except KeyError as e:
+        raise ValueError(f"{name}: missing field {e}")
+    except (AttributeError, TypeError, ValueError) as e:
+        raise ValueError(f"{name}: {e}")
+    if any(value < 0 for value in [num_plants, yield_per_plant] + list(variable_costs.values())):
+        raise ValueError(f"{name}: plants, yield and costs must not be negative")
+    return {
+        "name": name,
+        "start_date": start_date,
+        "end_date": end_date,
+        "investments": investments,
+        "variable_costs": variable_costs,
+        "num_plants": num_plants,
+        "yield_per_plant": yield_per_plant,
+        "historical_variable_costs": list(raw.get('historical_variable_costs', [])),
+    }
+
+def safe_file_name(name):
+    """Scenario name as used in report file names, anything but letters, digits, - and _ becomes _."""
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+
+def run_scenario(scenario, average_inflation_rate, latest_year, output_dir, inflation_bands=None):
+    """Write the reports of one validated scenario, returns the file names written."""
+    historical_variable_costs = scenario["historical_variable_costs"] + [
+        {"year": scenario["start_date"].year, "costs": scenario["variable_costs"]}]
+    avg_variable_costs = calculate_average_variable_costs(historical_variable_costs, scenario["start_date"].year)
+    if avg_variable_costs is None:
+        avg_variable_costs = scenario["variable_costs"].copy()
+    safe_name = safe_file_name(scenario["name"])
+    schedules = compile_depreciation_schedules(scenario["investments"])
+    dates = report_dates(scenario["start_date"], scenario["end_date"])
+    written = []
+    for report_date, amortized_fixed in zip(dates, calculate_amortized_fixed_costs(scenario["investments"], dates, schedules)):
+        figures = calculate_report_figures(amortized_fixed, scenario["variable_costs"],
+                                           scenario["num_plants"], scenario["yield_per_plant"])
+        html_content = render_html_report(scenario["investments"], report_date, scenario["variable_costs"],
+                                          scenario["num_plants"], scenario["yield_per_plant"], *figures,
+                                          average_inflation_rate, latest_year, avg_variable_costs, schedules,
+                                          inflation_bands)
+        filename = f"{safe_name}_{report_date.strftime('%Y%m%d')}.html"
+        with open(os.path.join(output_dir, filename), "w") as f:
+            f.write(html_content)
+        written.append(filename)
+    return written
+
+def run_scenario_job(job):
+    """ProcessPoolExecutor entry point, job is (scenario, average_inflation_rate, latest_year, output_dir, inflation_bands)."""
+    return run_scenario(*job)
+
+def run_batch(paths, output_dir, workers, average_inflation_rate, latest_year, inflation_bands=None):
+    """Validate every scenario first, then write all reports, in worker processes when workers > 1."""
+    raw_scenarios = [raw for path in paths for raw in read_scenarios(path)]
+    scenarios = [validate_scenario(raw, number) for number, raw in enumerate(raw_scenarios, 1)]
+    # Scenarios whose names map to the same file name would overwrite each other's reports
+    names = {}
+    for scenario in scenarios:
+        safe_name = safe_file_name(scenario["name"])
+        if safe_name in names:
+            raise ValueError(f"{scenario['name']}: writes the same {safe_name}_<date>.html reports as {names[safe_name]}, "
+                             f"scenario names must be unique")
+        names[safe_name] = scenario["name"]
+    os.makedirs(output_dir, exist_ok=True)
+    # The inflation bands are simulated once and shared by every scenario
+    jobs = [(scenario, average_inflation_rate, latest_year, output_dir, inflation_bands) for scenario in scenarios]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_scenario_job, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        results = [run_scenario_job(job) for job in jobs]
+    return len(scenarios), sum(len(files) for files in results)
+
 ### Main Function ###
 def main():
     """Orchestrate the aquaponics cost reporting process."""
+    parser = argparse.ArgumentParser(description='Generate the Virginia hobby gardening at-cost report.')
+    parser.add_argument('--offline', action='store_true', help='Use only the cached FRED inflation data, never the network.')
+    parser.add_argument('--refresh-inflation', action='store_true', help='Download the full FRED inflation history again.')
+    parser.add_argument('--batch', nargs='+', metavar='FILE',
+                        help='Generate the reports of every scenario in these JSON/CSV files ("-" for stdin) without prompting.')
+    parser.add_argument('--output-dir', default=os.path.join(script_dir, 'batch_reports'),
+                        help='Directory for batch reports (default batch_reports next to the script).')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Processes writing batch reports (default one per CPU).')
+    parser.add_argument('--inflation-paths', type=int, default=DEFAULT_PATHS,
+                        help=f'Monte Carlo inflation paths for the P10/P50/P90 projection columns, 0 to leave them out (default {DEFAULT_PATHS}).')
+    parser.add_argument('--block-years', type=int, default=DEFAULT_BLOCK_YEARS,
+                        help=f'Consecutive historical years per bootstrap block (default {DEFAULT_BLOCK_YEARS}).')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for repeatable inflation paths.')
+    args = parser.parse_args()
+
+    if args.batch:
+        # Batch mode never prompts: without an API key only the cached inflation data is used
+        api_key = get_api_key(prompt=False)
+        inflation_data = fetch_inflation_data(api_key, SERIES_ID, cache=get_fred_cache(api_key, args.offline),
+                                              refresh=args.refresh_inflation)
+        average_inflation_rate, latest_year = summarize_inflation(inflation_data)
+        inflation_bands = simulate_inflation_bands(inflation_data, args.inflation_paths, args.block_years, args.seed)
+        started = datetime.now()
+        try:
+            num_scenarios, num_reports = run_batch(args.batch, args.output_dir, args.workers, average_inflation_rate,
+                                                   latest_year, inflation_bands)
+        except (OSError, ValueError) as e:
+            print(f"Batch failed: {e}")
+            return 1
+        elapsed = (datetime.now() - started).total_seconds()
+        print(f"Generated {num_reports} reports for {num_scenarios} scenarios in {elapsed:.2f}s, in {args.output_dir}")
+        return 0
+
     # Collect user inputs
-    investments, start_date, end_date, variable_costs, num_plants, yield_per_plant, historical_variable_costs = get_user_inputs()
+    store = get_report_store()
+    try:
+        (investments, new_investments, start_date, end_date, variable_costs, num_plants, yield_per_plant,
+         historical_variable_costs) = get_user_inputs(store)
+    except ReportStoreError as e:
+        print(e)
+        return 1
     
     # Append current year's variable costs to historical data
     current_year = start_date.year
@@ -324,41 +533,33 @@ def main():
         print("No historical data available. Using current year's variable costs for projections.")
         avg_variable_costs = variable_costs.copy()
     
-    # Fetch inflation data
-    inflation_data = fetch_inflation_data(FRED_API_KEY, SERIES_ID)
-    if inflation_data:
-        inflation_rates = [rate for _, rate in inflation_data]
-        average_inflation_rate = sum(inflation_rates) / len(inflation_rates) / 100  # Convert percentage to decimal
-        latest_year = max([int(year) for year, _ in inflation_data])
-    else:
-        print("Failed to fetch inflation data. Using default 3.77% inflation rate.")
-        average_inflation_rate = 0.0377
-        latest_year = None
+    # Fetch inflation data, offline only the cache is read so there is no need to ask for a key
+    api_key = get_api_key(prompt=not args.offline)
+    inflation_data = fetch_inflation_data(api_key, SERIES_ID, cache=get_fred_cache(api_key, args.offline),
+                                          refresh=args.refresh_inflation)
+    average_inflation_rate, latest_year = summarize_inflation(inflation_data)
+    inflation_bands = simulate_inflation_bands(inflation_data, args.inflation_paths, args.block_years, args.seed)
     
-    # Generate reports for each year in the date range
-    current_date = start_date
-    while current_date <= end_date:
-        amortized_fixed = calculate_amortized_fixed_costs(investments, current_date)
-        total_annual_costs = calculate_total_annual_costs(amortized_fixed, variable_costs)
-        cost_per_plant = calculate_cost_per_plant(total_annual_costs, num_plants)
-        cost_per_pound = calculate_cost_per_pound(total_annual_costs, num_plants, yield_per_plant)
+    # Generate reports for each year in the date range, the investments are compiled into schedules once
+    schedules = compile_depreciation_schedules(investments)
+    dates = report_dates(start_date, end_date)
+    for current_date, amortized in zip(dates, calculate_amortized_fixed_costs(investments, dates, schedules)):
+        amortized_fixed, total_annual_costs, cost_per_plant, cost_per_pound = calculate_report_figures(
+            amortized, variable_costs, num_plants, yield_per_plant)
         generate_html_report(
             investments, current_date, variable_costs, num_plants, yield_per_plant,
             amortized_fixed, total_annual_costs, cost_per_plant, cost_per_pound,
-            average_inflation_rate, latest_year, avg_variable_costs
+            average_inflation_rate, latest_year, avg_variable_costs, schedules, inflation_bands
         )
-        current_date += timedelta(days=365.25)
     
-    # Save updated data to JSON
-    report_data = {
-        "historical_variable_costs": historical_variable_costs,
-        "investments": investments,
+    # Save only this run's new records
+    store.save_run(new_investments, current_year, variable_costs, {
         "last_num_plants": num_plants,
         "last_yield_per_plant": yield_per_plant,
         "last_report_date": end_date.strftime("%Y-%m-%d")
-    }
-    with open(os.path.join(script_dir, "virginia_hobby_gardening_report_data.json"), "w") as f:
-        json.dump(report_data, f, indent=4)
+    })
+    store.close()
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,113 @@
+"""
+On-disk cache of FRED series observations for the cost report.
+
+Observations are kept in a JSON file keyed by series_id, with the time they were last refreshed.
+Within the TTL the cache is used as is; after it, only observations from the last cached date on
+are requested and merged in (the last date is fetched again so a revised value replaces the old
+one). Offline, or when FRED can't be reached, the cached observations are used however old they
+are. The file is replaced atomically, so an interrupted write never leaves a corrupt cache.
+
+FredClient talks to the API through one pooled requests.Session with timeouts and retries. Anything
+with an observations(series_id, observation_start) method can stand in for it, for example in tests.
+"""
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+FRED_OBSERVATIONS_URL = "https://api.stlouisfed.org/fred/series/observations"
+DEFAULT_TTL = timedelta(days=1)
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (3.05, 10)
+
+class FredClient:
+    """Minimal FRED observations client over a pooled session."""
+
+    def __init__(self, api_key, base_url=FRED_OBSERVATIONS_URL, timeout=DEFAULT_TIMEOUT, session=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            retries = Retry(total=2, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'])
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retries)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self.session = session
+
+    def observations(self, series_id, observation_start):
+        """Return [(date, value)] for the series from observation_start (YYYY-MM-DD), skipping missing values."""
+        response = self.session.get(self.base_url, timeout=self.timeout, params={
+            'series_id': series_id,
+            'api_key': self.api_key,
+            'file_type': 'json',
+            'observation_start': observation_start,
+        })
+        response.raise_for_status()
+        return [(obs['date'], float(obs['value'])) for obs in response.json()['observations'] if obs['value'] != '.']
+
+class FredCache:
+    """JSON file cache of FRED observations with TTL, incremental refresh and offline use."""
+
+    def __init__(self, path, client=None, ttl=DEFAULT_TTL, offline=False):
+        self.path = path
+        self.client = client
+        self.ttl = ttl
+        self.offline = offline
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            print(f"Ignoring corrupted FRED cache {self.path}.")
+            return {}
+
+    def save(self, data):
+        """Write the cache through a temporary file in the same directory and swap it in."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.fred_cache_', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def observations(self, series_id, start_date="1960-01-01", refresh=False):
+        """
+        Return [(date, value)] from start_date on, refreshing from FRED when the entry is older than the TTL.
+
+        refresh forces a full download (within the TTL as well); offline never touches the network.
+        """
+        data = self.load()
+        entry = data.get(series_id)
+        # An entry that starts later than start_date has to be downloaded again from start_date
+        covers = entry is not None and entry['observation_start'] <= start_date
+        fresh = covers and datetime.now() - datetime.fromisoformat(entry['fetched_at']) < self.ttl
+        if not self.offline and self.client is not None and (refresh or not fresh):
+            cached = {date: value for date, value in entry['observations']} if covers and not refresh else {}
+            since = max(cached) if cached else start_date
+            try:
+                cached.update(self.client.observations(series_id, since))
+            except (requests.RequestException, KeyError, ValueError) as e:
+                # Request errors carry the URL, which holds the API key
+                reason = f"HTTP {e.response.status_code}" if getattr(e, 'response', None) is not None else type(e).__name__
+                print(f"Error refreshing {series_id} from FRED, using cached data: {reason}")
+            else:
+                observation_start = entry['observation_start'] if covers and not refresh else start_date
+                entry = {'fetched_at': datetime.now().isoformat(timespec='seconds'),
+                         'observation_start': observation_start,
+                         'observations': sorted(cached.items())}
+                data[series_id] = entry
+                self.save(data)
+        if entry is None:
+            return []
+        return [(date, value) for date, value in entry['observations'] if date >= start_date]
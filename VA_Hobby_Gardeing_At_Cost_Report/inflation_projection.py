@@ -0,0 +1,50 @@
+"""
+Monte Carlo inflation scenarios for the cost report's 20-year projection.
+
+Future inflation paths are resampled from the historical annual FRED rates with a circular block
+bootstrap: each path is built from randomly placed runs of block_years consecutive historical
+years, which keeps the runs of high and low inflation the series actually had instead of drawing
+every year independently. Every path is compounded into a cumulative price factor per projection
+year, and the P10/P50/P90 of those factors are taken across all paths.
+
+Projected costs are the base costs times the factor, so one set of percentile factors serves every
+cost category, total and report: a cost grows with the factor, so the percentile of the cost is the
+base cost times the percentile of the factor (and a fixed cost added on top does not change that).
+"""
+from collections import namedtuple
+
+import numpy as np
+
+PERCENTILES = (10, 50, 90)
+DEFAULT_PATHS = 100_000
+DEFAULT_BLOCK_YEARS = 5
+
+# factors has shape (len(percentiles), years), the percentile factors after 1..years years
+InflationBands = namedtuple("InflationBands", ["factors", "percentiles", "paths", "block_years"])
+
+def bootstrap_inflation_paths(rates, years=20, paths=DEFAULT_PATHS, block_years=DEFAULT_BLOCK_YEARS, seed=None):
+    """Resampled annual inflation paths, shape (paths, years), from historical rates in percent, as decimals."""
+    rates = np.asarray(rates, dtype=np.float64) / 100
+    if rates.size == 0:
+        raise ValueError("no historical inflation rates to resample")
+    block_years = max(1, min(block_years, rates.size))
+    rng = np.random.default_rng(seed)
+    blocks = -(-years // block_years)
+    starts = rng.integers(0, rates.size, size=(paths, blocks, 1), dtype=np.int64)
+    # Blocks wrap around the end of the series, so every historical year is drawn equally often
+    index = (starts + np.arange(block_years)) % rates.size
+    return rates[index.reshape(paths, blocks * block_years)[:, :years]]
+
+def inflation_factor_bands(rates, years=20, paths=DEFAULT_PATHS, block_years=DEFAULT_BLOCK_YEARS, seed=None,
+                           percentiles=PERCENTILES):
+    """InflationBands with the percentiles of the cumulative price factor after 1..years years."""
+    growth = 1 + bootstrap_inflation_paths(rates, years, paths, block_years, seed)
+    np.cumprod(growth, axis=1, out=growth)
+    return InflationBands(np.percentile(growth, percentiles, axis=0), tuple(percentiles), paths,
+                          max(1, min(block_years, len(rates))))
+
+def project_costs(base_costs, factors):
+    """Base costs (categories,) grown by factors (..., years), shape (categories, ..., years)."""
+    base_costs = np.asarray(base_costs, dtype=np.float64)
+    factors = np.asarray(factors, dtype=np.float64)
+    return base_costs.reshape((-1,) + (1,) * factors.ndim) * factors
@@ -0,0 +1,124 @@
+"""
+SQLite storage of the cost report data (investments, yearly variable costs and the last run's inputs).
+
+Each run only inserts its new investments, replaces the variable costs of its year and updates the
+last run settings, all in one transaction, so a crash mid-write leaves the previous data intact
+instead of a half written file. Reads are just as narrow: the report loads the variable costs of
+the last few years it averages over, not the whole history, so startup cost does not grow with it.
+
+The first time the store is opened next to an existing virginia_hobby_gardening_report_data.json,
+that file is imported once and left in place. A JSON file that can't be parsed stops the import
+with an error rather than starting fresh and dropping its history.
+"""
+import json
+import os
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS investment (
+    id INTEGER PRIMARY KEY,
+    amount REAL NOT NULL,
+    start_date TEXT NOT NULL,
+    amortization_years INTEGER NOT NULL,
+    method TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS variable_costs (
+    year INTEGER PRIMARY KEY,
+    costs TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS setting (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+class ReportStoreError(Exception):
+    """The report data can't be read or imported."""
+
+class ReportStore:
+    """Incremental SQLite store of the cost report data, importing the legacy JSON file on first use."""
+
+    def __init__(self, path, legacy_json_path=None):
+        self.path = path
+        self.legacy_json_path = legacy_json_path
+        self._conn = None
+
+    def connect(self):
+        if self._conn is None:
+            is_new = not os.path.exists(self.path)
+            try:
+                conn = sqlite3.connect(self.path)
+                with conn:
+                    conn.executescript(SCHEMA)
+            except sqlite3.DatabaseError as e:
+                raise ReportStoreError(f"Can't open report data {self.path}: {e}")
+            self._conn = conn
+            if is_new and self.legacy_json_path and os.path.exists(self.legacy_json_path):
+                try:
+                    self.import_json(self.legacy_json_path)
+                except ReportStoreError:
+                    # Leave no empty store behind, so the import runs again once the file is fixed
+                    self.close()
+                    os.unlink(self.path)
+                    raise
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def import_json(self, json_path):
+        """Import a virginia_hobby_gardening_report_data.json file in one transaction."""
+        try:
+            with open(json_path, "r") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise ReportStoreError(f"Can't import {json_path} ({e}), fix or move the file and run again.")
+        try:
+            # A year entered more than once keeps the costs saved last, as the JSON list was appended in order
+            costs_by_year = {int(entry["year"]): entry["costs"] for entry in data.get("historical_variable_costs", [])}
+            settings = {key: data[key] for key in ("last_num_plants", "last_yield_per_plant", "last_report_date") if key in data}
+            with self._conn:
+                self._insert_investments(data.get("investments", []))
+                self._conn.executemany("INSERT OR REPLACE INTO variable_costs (year, costs) VALUES (?, ?)",
+                                       [(year, json.dumps(costs)) for year, costs in costs_by_year.items()])
+                self._update_settings(settings)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            raise ReportStoreError(f"Can't import {json_path} (unexpected {type(e).__name__}: {e}), fix or move the file and run again.")
+        print(f"Imported report data from {os.path.basename(json_path)} into {os.path.basename(self.path)}.")
+
+    def investments(self):
+        """All investments, in the order they were entered."""
+        rows = self.connect().execute(
+            "SELECT amount, start_date, amortization_years, method FROM investment ORDER BY id")
+        return [{"amount": amount, "start_date": start_date, "amortization_years": amortization_years, "method": method}
+                for amount, start_date, amortization_years, method in rows]
+
+    def recent_variable_costs(self, before_year, limit=5):
+        """The variable costs of the last `limit` years before before_year, as [{"year", "costs"}], newest first."""
+        rows = self.connect().execute(
+            "SELECT year, costs FROM variable_costs WHERE year < ? ORDER BY year DESC LIMIT ?", (before_year, limit))
+        return [{"year": year, "costs": json.loads(costs)} for year, costs in rows]
+
+    def settings(self):
+        """The inputs of the last run: last_num_plants, last_yield_per_plant and last_report_date."""
+        return {key: json.loads(value) for key, value in self.connect().execute("SELECT key, value FROM setting")}
+
+    def save_run(self, new_investments, year, variable_costs, settings):
+        """Record one run: its new investments, the variable costs of its year and the last run settings."""
+        conn = self.connect()
+        with conn:
+            self._insert_investments(new_investments)
+            conn.execute("INSERT OR REPLACE INTO variable_costs (year, costs) VALUES (?, ?)",
+                         (year, json.dumps(variable_costs)))
+            self._update_settings(settings)
+
+    def _insert_investments(self, investments):
+        self._conn.executemany(
+            "INSERT INTO investment (amount, start_date, amortization_years, method) VALUES (?, ?, ?, ?)",
+            [(inv["amount"], inv["start_date"], inv["amortization_years"], inv["method"]) for inv in investments])
+
+    def _update_settings(self, settings):
+        self._conn.executemany("INSERT OR REPLACE INTO setting (key, value) VALUES (?, ?)",
+                               [(key, json.dumps(value)) for key, value in settings.items()])
@@ -1,19 +1,44 @@
 import psycopg2
 from psycopg2 import sql
 from faker import Faker
+import argparse
 import os
 import random
-from datetime import datetime, timedelta
+import sys
+from datetime import datetime, timedelta, timezone
+from db_connection import connect
+from sensor_reading_generator import load_sensors, generate_reading_batches, iter_readings
+from deadband_compressor import DeadbandCompressor, load_thresholds
+from sensor_data_loader import copy_sensor_data, get_chunk_interval, load_sensor_data_parallel, SensorLoadError
 
 # Initialize Faker
 fake = Faker()
 
-# Database connection details
-db_name = "aquaponics_db"
-db_user = "aquaponics"
-# Password is kept in a file for security, format: "*:*:*:*:{password}"
-with open(os.path.expanduser('~/.pgpass'), 'r') as file:
-    _, _, _, _, db_password = file.read().strip().split(':')
+# Materialized views refreshed after loading (this is PostgreSQL specific, views that don't exist are skipped); the
+# rollup views of 01 are plain views over the rollups of 04_setup_sensor_rollups.pgsql, rebuilt instead
+VIEWS = ['hourly_sensor_data']
+ROLLUPS = ['second', 'minute', 'hour']
+
+# Function to parse the command line, the defaults reproduce the original small fake data set
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load fake data into aquaponics_db.')
+    parser.add_argument('--bulk', action='store_true',
+                        help='Load sensor_datum with COPY FROM STDIN instead of one INSERT per row.')
+    parser.add_argument('--rows', type=int, default=1000,
+                        help='Number of sensor_datum rows to generate, rounded down to whole time steps across all sensors (default 1000).')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                        help='Rows generated per batch and sent per COPY in bulk mode (default 100000).')
+    parser.add_argument('--sensors', type=int, default=10,
+                        help='Number of fake sensors to create (default 10).')
+    parser.add_argument('--interval-seconds', type=int, default=60,
+                        help='Seconds between readings of one sensor (default 60).')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes for sensor_datum, each slice with its own connection; more than 1 implies --bulk (default 1).')
+    parser.add_argument('--sensor-groups', type=int, default=1,
+                        help='Groups the sensors are split into for parallel loading, on top of the split by hypertable chunk (default 1).')
+    parser.add_argument('--deadband', action='store_true',
+                        help="Drop readings within each sensor type's capture_after_delta_percent before they are written.")
+    return parser.parse_args()
 
 # Function to set seed for random number generation
 def set_seed_with_entropy():
@@ -23,18 +48,9 @@ def set_seed_with_entropy():
     final_seed = ((session_seed + time_seed) / 1000000000000000000) % 1
     random.seed(final_seed)
     print(f'Random seed set to {final_seed}')
-    
-# Connect to the database
-try:
-    conn = psycopg2.connect(
-        dbname=db_name,
-        user=db_user,
-        password=db_password,
-        host="localhost"  # Adjust if your PostgreSQL server isn't on localhost
-    )
-    cur = conn.cursor()
-    set_seed_with_entropy()
 
+# Function to insert the fake areas, systems, sensor types and sensors the readings refer to
+def load_reference_data(cur, num_sensors):
     # Area Table Insertion
     for _ in range(5):
         cur.execute(sql.SQL("INSERT INTO area (area_name, description) VALUES (%s, %s)"),
@@ -56,35 +72,23 @@ try:
         cur.execute(sql.SQL("INSERT INTO sensor_type (type_name, scale_factor, unit, capture_after_delta_percent) VALUES (%s, %s, %s, %s)"),
                     (type_name, scale_factor, unit, capture_after_delta_percent))
 
-    # Sensor Table Insertion
-    for _ in range(10):
+    # Sensor Table Insertion, positioned in metres east / north of the geo_ref anchor, inside the 30 m x 54 m plot
+    for _ in range(num_sensors):
         cur.execute(sql.SQL("""
-            INSERT INTO sensor (sensor_type_id, area_id, system_id, location, installation_date) 
-            VALUES (%s, %s, %s, %s, %s)
-        """), (random.randint(1, 4), random.randint(1, 5), random.randint(1, 3), fake.street_address(), fake.date_between(start_date='-3y', end_date='today')))
-
-    # Sensor Data Insertion
-    for _ in range(1000):
-        sensor_id = random.randint(1, 10)  # Assuming 10 sensors were created
-        sensor_type_id = random.randint(1, 4)
-        time = datetime.now() - timedelta(days=random.randint(0, 10))
-        if sensor_type_id == 1:  # Temperature
-            value = random.randint(0, 40000)
-        elif sensor_type_id == 2:  # Humidity
-            value = random.randint(0, 100000)
-        elif sensor_type_id == 3:  # pH
-            value = random.randint(0, 1400)
-        else:  # EC
-            value = random.randint(0, 500)
-        cur.execute(sql.SQL("INSERT INTO sensor_datum (time, sensor_id, value) VALUES (%s, %s, %s)"),
-                    (time, sensor_id, value))
+            INSERT INTO sensor (sensor_type_id, area_id, system_id, location, local_x, local_y, local_z, installation_date)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """), (random.randint(1, 4), random.randint(1, 5), random.randint(1, 3), fake.street_address(),
+               round(random.uniform(0, 30), 2), round(random.uniform(0, 54), 2), round(random.uniform(0, 2), 2),
+               fake.date_between(start_date='-3y', end_date='today')))
 
+# Function to insert the fake alerts, labels and label assignments
+def load_alerts_and_labels(cur, num_sensors):
     # System-wide Alert Insertion
     for _ in range(5):
         cur.execute(sql.SQL("""
             INSERT INTO systemwide_alert (sensor_id, area_id, system_id, alert_type, alert_message)
             VALUES (%s, %s, %s, %s, %s)
-        """), (random.randint(1, 10), random.randint(1, 5), random.randint(1, 3), 
+        """), (random.randint(1, num_sensors), random.randint(1, 5), random.randint(1, 3),
                "Warning" if random.random() > 0.5 else "Critical", fake.sentence()))
 
     # Label Table Insertion
@@ -92,24 +96,99 @@ try:
         cur.execute(sql.SQL("INSERT INTO label (label_name, description) VALUES (%s, %s)"),
                     (fake.word(), fake.sentence()))
 
-    # Label Assignment Insertion
+    # Label Assignment Insertion, random picks can repeat a (sensor, label) pair
     for _ in range(10):
-        cur.execute(sql.SQL("INSERT INTO label_assignment (entity_id, entity_type, label_id) VALUES (%s, %s, %s)"),
-                    (random.randint(1, 10), 'sensor', random.randint(1, 3)))
+        cur.execute(sql.SQL("INSERT INTO label_assignment (entity_id, entity_type, label_id) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING"),
+                    (random.randint(1, num_sensors), 'sensor', random.randint(1, 3)))
 
-    # Refresh Materialized Views (this is PostgreSQL specific, might need adjustments if not all views exist)
-    views = ['hourly_sensor_data', 'minute_by_minute_last_24_hours', 'hourly_last_week', 'second_by_second_last_15_minutes']
-    for view in views:
+# Function to refresh the materialized views that exist, and rebuild the rollups of 04_setup_sensor_rollups.pgsql that
+# replace them, each in its own transaction so one failure can't discard the others
+def refresh_views(conn):
+    errors = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT matviewname FROM pg_matviews WHERE schemaname = 'public'")
+        existing = {row[0] for row in cur.fetchall()}
+        cur.execute("SELECT to_regclass('sensor_rollup_config') IS NOT NULL")
+        has_rollups = cur.fetchone()[0]
+    conn.commit()
+    # The fake readings are backfilled behind the rollups' high-water marks, so rebuild them in full
+    for rollup in ROLLUPS if has_rollups else []:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT refresh_sensor_rollup(%s, TRUE)", (rollup,))
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            errors.append(f"rollup {rollup}: {e}")
+    for view in VIEWS:
+        if view not in existing:
+            continue
         try:
-            cur.execute(sql.SQL("REFRESH MATERIALIZED VIEW CONCURRENTLY {}").format(sql.Identifier(view)))
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL("REFRESH MATERIALIZED VIEW CONCURRENTLY {}").format(sql.Identifier(view)))
+            conn.commit()
         except psycopg2.Error as e:
-            print(f"Error refreshing materialized view {view}: {e}")
+            conn.rollback()
+            errors.append(f"{view}: {e}")
+    return errors
 
-    conn.commit()
-    print('Fake data loading completed.')
+def main():
+    args = parse_args()
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        set_seed_with_entropy()
+
+        # Reference rows are committed first so worker connections can see them
+        load_reference_data(cur, args.sensors)
+        conn.commit()
+
+        # Sensor Data Insertion, ordered per-sensor series ending now that honor each sensor's sensor_type
+        sensors = load_sensors(cur)
+        num_steps = max(1, args.rows // max(len(sensors), 1))
+        start = datetime.now(timezone.utc) - timedelta(seconds=args.interval_seconds * num_steps)
+        seed = random.getrandbits(32)
+        thresholds = load_thresholds(cur) if args.deadband else None
+        if args.workers > 1:
+            chunk_interval = get_chunk_interval(cur)
+            conn.commit()
+            load_sensor_data_parallel(sensors, start, args.interval_seconds, num_steps, chunk_interval,
+                                      args.workers, sensor_groups=args.sensor_groups,
+                                      batch_rows=args.chunk_size, seed=seed, thresholds=thresholds)
+        else:
+            batches = generate_reading_batches(sensors, start, args.interval_seconds, num_steps,
+                                               batch_steps=max(1, args.chunk_size // max(len(sensors), 1)),
+                                               seed=seed)
+            compressor = None
+            if thresholds is not None:
+                compressor = DeadbandCompressor(thresholds)
+                batches = compressor.compress_batches(batches)
+            if args.bulk:
+                copy_sensor_data(cur, batches, args.chunk_size)
+            else:
+                for reading_time, sensor_id, value in iter_readings(batches):
+                    cur.execute(sql.SQL("INSERT INTO sensor_datum (time, sensor_id, value) VALUES (%s, %s, %s)"),
+                                (reading_time, sensor_id, value))
+            if compressor is not None:
+                print(f'Deadband kept {compressor.readings_out} of {compressor.readings_in} readings ({compressor.ratio():.1%})')
+
+        load_alerts_and_labels(cur, args.sensors)
+        conn.commit()
+        cur.close()
+
+        errors = refresh_views(conn)
+        if errors:
+            for error in errors:
+                print(f"Error refreshing {error}", file=sys.stderr)
+            return 1
+        print('Fake data loading completed.')
+        return 0
+    except (psycopg2.Error, SensorLoadError) as e:
+        conn.rollback()
+        print(f'Fake data loading failed: {e}', file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
 
-except Exception as e:
-    print(f'An error occurred: {e}')
-finally:
-    if 'conn' in locals():
-        conn.close()
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
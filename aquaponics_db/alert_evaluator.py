@@ -0,0 +1,381 @@
+"""
+MIT License Notice
+Copyright (c) 2024 Jeremy D. Gerdes <seakintruth@gmail.com>
+See full license in the repository.
+
+Threshold alerting on live readings, writing systemwide_alert.
+
+The alert_rule table (07_setup_alert_rules.pgsql) holds min / max limits and a maximum rate of change
+per minute, scoped to a sensor type and/or a label (on a sensor, or on its area or system, resolved
+through label_query.LabelIndex). AlertEvaluator compiles the rules once into the list of rules that
+apply to every sensor, so evaluating a reading is a list index plus a few comparisons per matching
+rule, with no lookups by type or label.
+
+Per-sensor state (last value and time, for the rate of change) and per (rule, sensor) state (raised
+or armed, time of the last alert) live in flat arrays like those of DeadbandCompressor. A rule raises
+an alert when a reading leaves its limits and is armed again only once readings are back inside the
+limits by the rule's hysteresis, and a (rule, sensor) pair raises at most one alert per cooldown.
+Alerts are collected, deduplicated per (rule, sensor), and written with one INSERT per flush.
+
+Readings reach the evaluator in-process from sensor_ingest_service.py --alerts, or, run as a script,
+by LISTENing for the sensor_datum_inserted notification and reading the new rows of sensor_datum.
+"""
+import argparse
+import io
+import select
+import sys
+import time
+from array import array
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from db_connection import DB_NAME, connect
+from deadband_compressor import from_microseconds, to_microseconds
+from label_query import LabelIndex, parse_copy_text
+
+MICROSECONDS_PER_MINUTE = 60 * 1000000
+INFINITY = float('inf')
+NEVER = -(2 ** 62)
+
+AlertRule = namedtuple('AlertRule', 'rule_id rule_name alert_type sensor_type_name label_name min_value max_value '
+                                    'max_rate_per_minute hysteresis rate_hysteresis cooldown_us')
+SensorInfo = namedtuple('SensorInfo', 'type_name unit scale_factor area_id system_id')
+
+def load_rules(cur):
+    """Read the enabled alert rules, ordered by id."""
+    cur.execute("""
+        SELECT alert_rule_id, rule_name, alert_type, sensor_type_name, label_name, min_value, max_value,
+               max_rate_per_minute, hysteresis, rate_hysteresis, (extract(epoch FROM cooldown) * 1000000)::BIGINT
+        FROM alert_rule
+        WHERE enabled
+        ORDER BY alert_rule_id
+    """)
+    return [AlertRule(*row) for row in cur.fetchall()]
+
+def load_sensors(cur):
+    """Read {sensor_id: SensorInfo} for every sensor."""
+    cur.execute("""
+        SELECT s.sensor_id, st.type_name, st.unit, st.scale_factor, s.area_id, s.system_id
+        FROM sensor s
+        JOIN sensor_type st ON st.sensor_type_id = s.sensor_type_id
+    """)
+    return {row[0]: SensorInfo(row[1], row[2], row[3] or 1, row[4], row[5]) for row in cur.fetchall()}
+
+def write_alerts(cur, alerts):
+    """Insert (sensor_id, area_id, system_id, alert_type, alert_message, alert_time) rows with one statement."""
+    if alerts:
+        execute_values(cur, """
+            INSERT INTO systemwide_alert (sensor_id, area_id, system_id, alert_type, alert_message, alert_time)
+            VALUES %s
+        """, alerts, page_size=1000)
+    return len(alerts)
+
+class AlertEvaluator:
+    """Evaluates readings against the alert rules in O(1) per reading and collects the alerts raised."""
+
+    def __init__(self, rules, sensors, label_index=None):
+        self.readings_in = 0
+        self.readings_stale = 0
+        self.alerts_raised = 0
+        self.alerts_suppressed = 0
+        # Flat per-sensor state, indexed by sensor_id
+        self._scale = array('d')
+        self._has_last = array('b')
+        self._last_time = array('q')
+        self._last_value = array('d')
+        self._pending = {}
+        self._requeued = []
+        self.reload(rules, sensors, label_index)
+
+    def _grow(self, sensor_id):
+        missing = sensor_id + 1 - len(self._scale)
+        if missing > 0:
+            self._scale.extend([1.0] * missing)
+            self._has_last.extend([0] * missing)
+            self._last_time.extend([0] * missing)
+            self._last_value.extend([0.0] * missing)
+            self._slots.extend([()] * missing)
+
+    def reload(self, rules, sensors, label_index=None):
+        """Compile the rules for the sensors, keeping the raised / armed state of (rule, sensor) pairs that remain."""
+        previous = {}
+        if hasattr(self, '_slot_key'):
+            for slot, key in enumerate(self._slot_key):
+                previous[key] = (self._slot_active[slot], self._slot_raised[slot])
+        labels = label_index.sensors_by_label if label_index is not None else {}
+        label_members = {rule.label_name: set(labels[rule.label_name].tolist()) if rule.label_name in labels else set()
+                         for rule in rules if rule.label_name is not None}
+
+        self.rules = list(rules)
+        self.sensors = dict(sensors)
+        # (min, max, max rate, armed min, armed max, armed rate, cooldown) with missing limits as +-infinity
+        self._limits = []
+        for rule in self.rules:
+            low = rule.min_value if rule.min_value is not None else -INFINITY
+            high = rule.max_value if rule.max_value is not None else INFINITY
+            rate = rule.max_rate_per_minute if rule.max_rate_per_minute is not None else INFINITY
+            self._limits.append((low, high, rate, low + rule.hysteresis, high - rule.hysteresis,
+                                 rate - rule.rate_hysteresis, rule.cooldown_us))
+        self._slots = [()] * len(self._scale)
+        self._slot_rule = array('i')
+        self._slot_key = []
+        self._slot_active = array('b')
+        self._slot_raised = array('q')
+        for sensor_id in sorted(self.sensors):
+            info = self.sensors[sensor_id]
+            self._grow(sensor_id)
+            self._scale[sensor_id] = float(info.scale_factor)
+            slots = []
+            for rule_index, rule in enumerate(self.rules):
+                if rule.sensor_type_name is not None and rule.sensor_type_name != info.type_name:
+                    continue
+                if rule.label_name is not None and sensor_id not in label_members[rule.label_name]:
+                    continue
+                key = (rule.rule_id, sensor_id)
+                active, raised = previous.get(key, (0, NEVER))
+                slots.append(len(self._slot_rule))
+                self._slot_rule.append(rule_index)
+                self._slot_key.append(key)
+                self._slot_active.append(active)
+                self._slot_raised.append(raised)
+            self._slots[sensor_id] = tuple(slots)
+        self._pending = {key: alert for key, alert in self._pending.items() if key[1] in self.sensors}
+
+    def pairs(self):
+        """Number of (rule, sensor) pairs being evaluated."""
+        return len(self._slot_rule)
+
+    def offer(self, time_us, sensor_id, value):
+        """Evaluate one stored reading (time in epoch microseconds, value as stored), returns the number of alerts raised."""
+        if sensor_id >= len(self._slots) or value is None:
+            return 0
+        self.readings_in += 1
+        if self._has_last[sensor_id] and time_us <= self._last_time[sensor_id]:
+            # Already seen, or older than the newest reading the rate is based on
+            self.readings_stale += 1
+            return 0
+        reading = value / self._scale[sensor_id]
+        if self._has_last[sensor_id]:
+            rate = abs(reading - self._last_value[sensor_id]) * MICROSECONDS_PER_MINUTE / (time_us - self._last_time[sensor_id])
+        else:
+            rate = 0.0
+        self._has_last[sensor_id] = 1
+        self._last_time[sensor_id] = time_us
+        self._last_value[sensor_id] = reading
+        raised = 0
+        for slot in self._slots[sensor_id]:
+            low, high, max_rate, armed_low, armed_high, armed_rate, cooldown_us = self._limits[self._slot_rule[slot]]
+            if self._slot_active[slot]:
+                if armed_low <= reading <= armed_high and rate <= armed_rate:
+                    self._slot_active[slot] = 0
+            elif reading < low or reading > high or rate > max_rate:
+                self._slot_active[slot] = 1
+                if time_us - self._slot_raised[slot] >= cooldown_us:
+                    self._slot_raised[slot] = time_us
+                    self._raise(slot, time_us, sensor_id, reading, rate)
+                    raised += 1
+        return raised
+
+    def _raise(self, slot, time_us, sensor_id, reading, rate):
+        key = self._slot_key[slot]
+        if key in self._pending:
+            self.alerts_suppressed += 1
+            return
+        rule = self.rules[self._slot_rule[slot]]
+        info = self.sensors[sensor_id]
+        unit = f' {info.unit}' if info.unit else ''
+        if rule.min_value is not None and reading < rule.min_value:
+            detail = f'{reading:g}{unit} below {rule.min_value:g}{unit}'
+        elif rule.max_value is not None and reading > rule.max_value:
+            detail = f'{reading:g}{unit} above {rule.max_value:g}{unit}'
+        else:
+            detail = f'changing {rate:.3g}{unit} per minute, limit {rule.max_rate_per_minute:g}{unit} per minute'
+        message = f'{rule.rule_name}: {info.type_name} sensor {sensor_id} {detail}'
+        alert_time = from_microseconds(time_us).replace(tzinfo=None)
+        self._pending[key] = (sensor_id, info.area_id, info.system_id, rule.alert_type, message, alert_time)
+        self.alerts_raised += 1
+
+    def offer_readings(self, readings):
+        """Evaluate (datetime, sensor_id, value) tuples as queued by the ingest service."""
+        offer = self.offer
+        for moment, sensor_id, value in readings:
+            offer(to_microseconds(moment), sensor_id, value)
+
+    def offer_batch(self, times_us, sensor_ids, values):
+        """Evaluate numpy arrays of epoch microseconds, sensor ids and stored values, in time order."""
+        offer = self.offer
+        for time_us, sensor_id, value in zip(times_us.tolist(), sensor_ids.tolist(), values.tolist()):
+            offer(time_us, sensor_id, value)
+
+    def take_pending(self):
+        """Alerts raised since the last call, and any put back by requeue(), as systemwide_alert rows ordered by time."""
+        alerts = sorted(self._requeued + list(self._pending.values()), key=lambda alert: alert[5])
+        self._pending = {}
+        self._requeued = []
+        return alerts
+
+    def requeue(self, alerts):
+        """Put back alerts from take_pending() that could not be written, so the next take_pending() returns them again."""
+        self._requeued.extend(alerts)
+
+    def active(self):
+        """(rule_name, sensor_id) of every rule currently raised for a sensor."""
+        return [(self.rules[self._slot_rule[slot]].rule_name, self._slot_key[slot][1])
+                for slot in range(len(self._slot_rule)) if self._slot_active[slot]]
+
+class RuleSource:
+    """Reloads an AlertEvaluator when alert_rule, the labels, the sensors or the sensor types changed."""
+
+    def __init__(self):
+        self.label_index = LabelIndex()
+        self.rules = None
+
+    def load(self, cur):
+        """A new AlertEvaluator from the database."""
+        self.label_index.refresh(cur, force=True)
+        self.rules = load_rules(cur)
+        return AlertEvaluator(self.rules, load_sensors(cur), self.label_index)
+
+    def changes(self, cur):
+        """
+        (rules, sensors, label_index) to reload an evaluator with, or None when nothing changed.
+
+        Nothing is remembered until apply(), so changes that never reach the evaluator are found again.
+        """
+        rules = load_rules(cur)
+        label_index = self.label_index
+        if label_index.current_version(cur) != label_index.version:
+            label_index = LabelIndex()
+            label_index.refresh(cur)
+        elif rules == self.rules:
+            return None
+        return rules, load_sensors(cur), label_index
+
+    def apply(self, evaluator, changes):
+        """Reload the evaluator with the result of changes() and remember it as what the evaluator was built from."""
+        rules, sensors, label_index = changes
+        evaluator.reload(rules, sensors, label_index)
+        self.rules = rules
+        self.label_index = label_index
+
+    def refresh(self, cur, evaluator):
+        """Recompile the evaluator if anything it was built from changed, returns True when it was."""
+        changes = self.changes(cur)
+        if changes is None:
+            return False
+        self.apply(evaluator, changes)
+        return True
+
+# Function to read the sensor_datum rows newer than after_us, as (times_us, sensor_ids, values) arrays in time order
+def read_new_readings(cur, after_us):
+    query = cur.mogrify("""
+        COPY (
+            SELECT (extract(epoch FROM time) * 1000000)::BIGINT, sensor_id, value
+            FROM sensor_datum
+            WHERE time > %s AND value IS NOT NULL
+            ORDER BY time
+        ) TO STDOUT
+    """, (from_microseconds(after_us),)).decode()
+    buffer = io.StringIO()
+    cur.copy_expert(query, buffer)
+    series = parse_copy_text(buffer.getvalue())
+    return series.time.astype(np.int64), series.sensor_id, series.value
+
+def listen(conn, source, evaluator, lookback_seconds, flush_interval, reload_interval):
+    """Evaluate new sensor_datum rows whenever a sensor_datum_inserted notification arrives, until interrupted."""
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("LISTEN sensor_datum_inserted")
+        watermark = to_microseconds(datetime.now(timezone.utc))
+        lookback_us = int(lookback_seconds * 1000000)
+        last_reload = time.monotonic()
+        while True:
+            if select.select([conn], [], [], flush_interval) != ([], [], []):
+                conn.poll()
+                conn.notifies.clear()
+                # Re-read the lookback window for rows committed late with older times; seen readings are skipped
+                times_us, sensor_ids, values = read_new_readings(cur, watermark - lookback_us)
+                if len(times_us):
+                    evaluator.offer_batch(times_us, sensor_ids, values)
+                    watermark = max(watermark, int(times_us[-1]))
+            alerts = evaluator.take_pending()
+            try:
+                written = write_alerts(cur, alerts)
+            except psycopg2.Error as e:
+                evaluator.requeue(alerts)
+                print(f'Writing {len(alerts)} alerts failed, keeping them for the next flush: {e}', file=sys.stderr)
+                written = 0
+            if written:
+                print(f'{written} alerts written, {len(evaluator.active())} rules raised', flush=True)
+            if time.monotonic() - last_reload >= reload_interval:
+                if source.refresh(cur, evaluator):
+                    print(f'Rules reloaded: {len(evaluator.rules)} rules, {evaluator.pairs()} rule/sensor pairs', flush=True)
+                last_reload = time.monotonic()
+
+def benchmark(num_sensors, num_readings, seed=0):
+    """Readings per second of offer() on random walk readings of the seeded example rules, without a database."""
+    rng = np.random.default_rng(seed)
+    rules = [
+        AlertRule(1, 'pH out of range', 'Warning', 'pH', None, 6.4, 7.6, None, 0.1, 0.0, 15 * MICROSECONDS_PER_MINUTE),
+        AlertRule(2, 'pH critical', 'Critical', 'pH', None, 6.0, 8.0, None, 0.1, 0.0, 15 * MICROSECONDS_PER_MINUTE),
+        AlertRule(3, 'Dissolved oxygen low', 'Critical', 'Dissolved Oxygen', None, 5.0, None, None, 0.3, 0.0, 15 * MICROSECONDS_PER_MINUTE),
+        AlertRule(4, 'Temperature out of range', 'Warning', 'Temperature', None, 10.0, 32.0, 2.0, 0.5, 0.5, 15 * MICROSECONDS_PER_MINUTE),
+    ]
+    types = [('pH', 'pH', 100, 7.0), ('Dissolved Oxygen', 'mg/L', 100, 6.5), ('Temperature', '°C', 10, 24.0)]
+    sensors = {sensor_id: SensorInfo(types[sensor_id % 3][0], types[sensor_id % 3][1], types[sensor_id % 3][2], 1, 1)
+               for sensor_id in range(1, num_sensors + 1)}
+    evaluator = AlertEvaluator(rules, sensors)
+    sensor_ids = rng.integers(1, num_sensors + 1, num_readings)
+    centres = np.array([0.0] + [types[sensor_id % 3][3] for sensor_id in range(1, num_sensors + 1)])
+    scales = np.array([1] + [types[sensor_id % 3][2] for sensor_id in range(1, num_sensors + 1)])
+    values = np.round((centres[sensor_ids] + rng.normal(0, 0.6, num_readings)) * scales[sensor_ids]).astype(np.int64)
+    times_us = to_microseconds(datetime.now(timezone.utc)) + np.arange(num_readings, dtype=np.int64) * 1000
+    started = time.perf_counter()
+    evaluator.offer_batch(times_us, sensor_ids, values)
+    elapsed = time.perf_counter() - started
+    alerts = evaluator.take_pending()
+    print(f'{num_readings} readings of {num_sensors} sensors ({evaluator.pairs()} rule/sensor pairs) in {elapsed:.3f}s: '
+          f'{num_readings / elapsed:,.0f} readings/s, {evaluator.alerts_raised} alerts raised, {len(alerts)} pending')
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate new sensor_datum readings against alert_rule and write systemwide_alert.')
+    parser.add_argument('--dbname', default=DB_NAME, help='Database to watch (default aquaponics_db).')
+    parser.add_argument('--lookback', type=float, default=5.0,
+                        help='Seconds before the newest evaluated reading to re-read for late commits (default 5).')
+    parser.add_argument('--flush-interval', type=float, default=1.0,
+                        help='Longest seconds between alert writes while readings arrive (default 1).')
+    parser.add_argument('--reload-interval', type=float, default=60.0,
+                        help='Seconds between checks for changed rules, labels, sensors or sensor types (default 60).')
+    parser.add_argument('--benchmark', type=int, metavar='READINGS', default=None,
+                        help='Time this many synthetic readings through the evaluator without a database and exit.')
+    parser.add_argument('--sensors', type=int, default=1000, help='Sensors of the --benchmark readings (default 1000).')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.sensors, args.benchmark)
+        return 0
+
+    conn = connect(dbname=args.dbname)
+    evaluator = None
+    try:
+        source = RuleSource()
+        with conn.cursor() as cur:
+            evaluator = source.load(cur)
+        conn.commit()
+        print(f'Watching sensor_datum: {len(evaluator.rules)} rules, {evaluator.pairs()} rule/sensor pairs', flush=True)
+        listen(conn, source, evaluator, args.lookback, args.flush_interval, args.reload_interval)
+    except KeyboardInterrupt:
+        if evaluator is not None:
+            with conn.cursor() as cur:
+                write_alerts(cur, evaluator.take_pending())
+            conn.commit()
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
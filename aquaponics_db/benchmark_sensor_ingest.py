@@ -0,0 +1,300 @@
+"""
+MIT License Notice
+Copyright (c) 2024 Jeremy D. Gerdes <seakintruth@gmail.com>
+See full license in the repository.
+
+Ingestion benchmark for the sensor_datum hypertable.
+
+Measures insert throughput for row-by-row INSERT, executemany, execute_values and COPY across batch
+sizes and sensor counts, with and without the idx_sensor_datum_time index, then times the refresh
+and a full read of each rollup: the materialized views of 01_setup_aquaponics_db.pgsql where they
+exist, refresh_sensor_rollup() and the *_incremental views once 04_setup_sensor_rollups.pgsql is
+applied. Read cases are keyed by rollup, so --compare against a run before 04 shows the change from
+one path to the other. Results go to a JSON file that a later run can be compared against.
+
+Run it against a THROWAWAY database with the schema from 01_setup_aquaponics_db.pgsql applied
+(plus 02 and 04 for the rollup path): sensor_datum is truncated before every case.
+    createdb aquaponics_bench
+    psql -d aquaponics_bench -f 01_setup_aquaponics_db.pgsql
+    python3 benchmark_sensor_ingest.py --dbname aquaponics_bench --output before.json
+    psql -d aquaponics_bench -f 02_setup_pg_cron_jobs.pgsql -f 04_setup_sensor_rollups.pgsql
+    python3 benchmark_sensor_ingest.py --dbname aquaponics_bench --compare before.json
+"""
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from db_connection import DB_NAME, connect
+from sensor_reading_generator import load_sensors, generate_reading_batches, iter_readings, batch_to_copy_text
+
+INSERT_SQL = "INSERT INTO sensor_datum (time, sensor_id, value) VALUES (%s, %s, %s)"
+COPY_SQL = "COPY sensor_datum (time, sensor_id, value) FROM STDIN"
+METHODS = ['row', 'executemany', 'execute_values', 'copy']
+# (rollup name, materialized view of 01, incremental view of 04)
+READ_VIEWS = [
+    ('second', 'second_by_second_last_15_minutes', 'second_by_second_last_15_minutes_incremental'),
+    ('minute', 'minute_by_minute_last_24_hours', 'minute_by_minute_last_24_hours_incremental'),
+    ('hour', 'hourly_last_week', 'hourly_last_week_incremental'),
+]
+TIME_INDEX = 'idx_sensor_datum_time'
+
+def parse_int_list(text):
+    return [int(item) for item in text.split(',') if item.strip()]
+
+def ensure_sensors(cur, count):
+    """Make sure at least count sensors exist and return the first count of them."""
+    sensors = load_sensors(cur)
+    if len(sensors) < count:
+        cur.execute("SELECT sensor_type_id FROM sensor_type WHERE type_name = 'Temperature' ORDER BY sensor_type_id LIMIT 1")
+        row = cur.fetchone()
+        if row is None:
+            cur.execute("""
+                INSERT INTO sensor_type (type_name, scale_factor, unit, capture_after_delta_percent)
+                VALUES ('Temperature', 10, '°C', 0.5) RETURNING sensor_type_id
+            """)
+            row = cur.fetchone()
+        for _ in range(count - len(sensors)):
+            cur.execute("INSERT INTO sensor (sensor_type_id, location) VALUES (%s, 'benchmark')", (row[0],))
+        sensors = load_sensors(cur)
+    return sensors[:count]
+
+def set_time_index(cur, present):
+    """Create or drop the secondary idx_sensor_datum_time index for an index variant."""
+    if present:
+        cur.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON sensor_datum (time)").format(sql.Identifier(TIME_INDEX)))
+    else:
+        cur.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(TIME_INDEX)))
+
+def generate_case_data(sensors, rows, interval_seconds, seed):
+    """Pre-generate the readings of one case so generation time is not measured."""
+    num_steps = max(1, rows // len(sensors))
+    start = datetime.now(timezone.utc) - timedelta(seconds=interval_seconds * num_steps)
+    return list(generate_reading_batches(sensors, start, interval_seconds, num_steps, seed=seed))
+
+def prepare_payload(method, batches):
+    """Convert the batches to what an ingest method sends, outside of the timed section."""
+    if method == 'copy':
+        return ''.join(batch_to_copy_text(*batch) for batch in batches).splitlines(keepends=True)
+    return list(iter_readings(batches))
+
+def write_case(conn, method, payload, batch_size):
+    """Write one payload with an ingest method and commit."""
+    with conn.cursor() as cur:
+        if method == 'row':
+            for row in payload:
+                cur.execute(INSERT_SQL, row)
+        elif method == 'executemany':
+            for i in range(0, len(payload), batch_size):
+                cur.executemany(INSERT_SQL, payload[i:i + batch_size])
+        elif method == 'execute_values':
+            execute_values(cur, "INSERT INTO sensor_datum (time, sensor_id, value) VALUES %s", payload, page_size=batch_size)
+        elif method == 'copy':
+            for i in range(0, len(payload), batch_size):
+                cur.copy_expert(COPY_SQL, io.StringIO(''.join(payload[i:i + batch_size])))
+        else:
+            raise ValueError(f'Unknown ingest method {method}')
+    conn.commit()
+
+def run_insert_case(conn, method, payload, batch_size):
+    """Truncate sensor_datum, then time writing the payload, returning (rows, seconds)."""
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE sensor_datum")
+    conn.commit()
+    started = time.perf_counter()
+    write_case(conn, method, payload, batch_size)
+    return len(payload), time.perf_counter() - started
+
+def time_statement(conn, statement, repeats, fetch=False):
+    """Run a statement repeats times, each in its own transaction, returning (timings, rows of the last run)."""
+    timings = []
+    rows = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        with conn.cursor() as cur:
+            cur.execute(statement)
+            rows = len(cur.fetchall()) if fetch else None
+        conn.commit()
+        timings.append(time.perf_counter() - started)
+    return timings, rows
+
+def read_result(rollup, operation, view, timings, view_rows):
+    print(f'  {operation} {view}: {min(timings):.3f}s min, {view_rows} rows')
+    return {
+        'kind': 'read',
+        'rollup': rollup,
+        'operation': operation,
+        'view': view,
+        'view_rows': view_rows,
+        'seconds_min': min(timings),
+        'seconds_median': sorted(timings)[len(timings) // 2],
+        'repeats': len(timings),
+    }
+
+def run_read_cases(conn, repeats):
+    """
+    Time the refresh and a full read of each rollup over the loaded data.
+
+    A materialized view is refreshed with REFRESH MATERIALIZED VIEW CONCURRENTLY; a rollup of
+    04_setup_sensor_rollups.pgsql is rebuilt once untimed, then refresh_sensor_rollup() is timed as
+    the cron job runs it, after which its *_incremental view is read in full.
+    """
+    results = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT matviewname FROM pg_matviews WHERE schemaname = 'public'")
+        matviews = {row[0] for row in cur.fetchall()}
+        cur.execute("SELECT to_regclass('sensor_rollup_config') IS NOT NULL")
+        has_rollups = cur.fetchone()[0]
+    conn.commit()
+    for rollup, matview, incremental_view in READ_VIEWS:
+        if has_rollups:
+            time_statement(conn, sql.SQL("SELECT refresh_sensor_rollup({}, TRUE)").format(sql.Literal(rollup)), 1)
+            timings, _ = time_statement(conn, sql.SQL("SELECT refresh_sensor_rollup({})").format(sql.Literal(rollup)), repeats)
+            results.append(read_result(rollup, 'refresh', f'rollup {rollup}', timings, None))
+            timings, view_rows = time_statement(conn, sql.SQL("SELECT * FROM {}").format(sql.Identifier(incremental_view)),
+                                                repeats, fetch=True)
+            results.append(read_result(rollup, 'select', incremental_view, timings, view_rows))
+        elif matview in matviews:
+            timings, _ = time_statement(conn, sql.SQL("REFRESH MATERIALIZED VIEW CONCURRENTLY {}").format(sql.Identifier(matview)),
+                                        repeats)
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(matview)))
+                view_rows = cur.fetchone()[0]
+            conn.commit()
+            results.append(read_result(rollup, 'refresh', matview, timings, view_rows))
+            timings, view_rows = time_statement(conn, sql.SQL("SELECT * FROM {}").format(sql.Identifier(matview)),
+                                                repeats, fetch=True)
+            results.append(read_result(rollup, 'select', matview, timings, view_rows))
+        else:
+            print(f'Skipping read cases of {rollup}, neither {matview} nor the sensor rollups exist.')
+    return results
+
+def server_versions(conn):
+    with conn.cursor() as cur:
+        cur.execute("SHOW server_version")
+        postgres = cur.fetchone()[0]
+        cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'timescaledb'")
+        row = cur.fetchone()
+    conn.commit()
+    return postgres, row[0] if row else None
+
+def case_key(result):
+    if result['kind'] == 'read':
+        # Files from before the rollups only hold materialized view refreshes, keyed by view name
+        rollup = result.get('rollup') or next((r for r, view, _ in READ_VIEWS if view == result['view']), result['view'])
+        return ('read', rollup, result.get('operation', 'refresh'))
+    return ('insert', result['method'], result['batch_size'], result['sensors'], result['time_index'])
+
+def compare_results(previous_path, results):
+    """Print the throughput change of each case against an earlier results file."""
+    with open(previous_path, 'r') as f:
+        previous = {case_key(r): r for r in json.load(f)['results']}
+    print(f'Comparison with {previous_path}:')
+    for result in results:
+        before = previous.get(case_key(result))
+        if before is None:
+            continue
+        if result['kind'] == 'read':
+            change = result['seconds_min'] / before['seconds_min'] - 1 if before['seconds_min'] else 0.0
+            print(f"  {result.get('operation', 'refresh')} {result['rollup']} ({result['view']}): {change:+.1%} time")
+        else:
+            change = result['rows_per_sec'] / before['rows_per_sec'] - 1 if before['rows_per_sec'] else 0.0
+            print(f"  {result['method']} batch {result['batch_size']} sensors {result['sensors']} "
+                  f"index {'on' if result['time_index'] else 'off'}: {change:+.1%} rows/sec")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sensor_datum ingest and rollup refreshes on a throwaway database.')
+    parser.add_argument('--dbname', default='aquaponics_bench', help='Throwaway database to benchmark (default aquaponics_bench).')
+    parser.add_argument('--rows', type=int, default=50000, help='Rows written per insert case (default 50000).')
+    parser.add_argument('--row-limit', type=int, default=20000,
+                        help='Cap on rows for the slow row-by-row method (default 20000).')
+    parser.add_argument('--methods', default=','.join(METHODS), help=f'Ingest methods to run (default {",".join(METHODS)}).')
+    parser.add_argument('--batch-sizes', default='100,1000,10000', help='Comma separated batch sizes (default 100,1000,10000).')
+    parser.add_argument('--sensor-counts', default='10,100', help='Comma separated sensor counts (default 10,100).')
+    parser.add_argument('--index-variants', default='with,without', choices=['with', 'without', 'with,without'],
+                        help=f'Run with and/or without the {TIME_INDEX} index (default with,without).')
+    parser.add_argument('--interval-seconds', type=int, default=1, help='Seconds between readings of one sensor (default 1).')
+    parser.add_argument('--read-repeats', type=int, default=3, help='Timed runs of each rollup refresh and read (default 3).')
+    parser.add_argument('--output', default=None, help='Results file (default bench_results_<timestamp>.json).')
+    parser.add_argument('--compare', default=None, help='Earlier results file to compare against.')
+    args = parser.parse_args()
+
+    if args.dbname == DB_NAME:
+        print(f'Refusing to benchmark {DB_NAME}: sensor_datum is truncated for every case. Use a throwaway database.', file=sys.stderr)
+        return 2
+
+    methods = [m.strip() for m in args.methods.split(',') if m.strip()]
+    unknown = set(methods) - set(METHODS)
+    if unknown:
+        parser.error(f'unknown method(s): {", ".join(sorted(unknown))}')
+    batch_sizes = parse_int_list(args.batch_sizes)
+    sensor_counts = parse_int_list(args.sensor_counts)
+    index_variants = [variant == 'with' for variant in args.index_variants.split(',')]
+
+    conn = connect(dbname=args.dbname)
+    results = []
+    started_at = datetime.now(timezone.utc)
+    try:
+        postgres_version, timescaledb_version = server_versions(conn)
+        with conn.cursor() as cur:
+            sensors = ensure_sensors(cur, max(sensor_counts))
+        conn.commit()
+
+        for time_index in index_variants:
+            with conn.cursor() as cur:
+                set_time_index(cur, time_index)
+            conn.commit()
+            for sensor_count in sensor_counts:
+                for method in methods:
+                    rows = min(args.rows, args.row_limit) if method == 'row' else args.rows
+                    batches = generate_case_data(sensors[:sensor_count], rows, args.interval_seconds, seed=sensor_count)
+                    payload = prepare_payload(method, batches)
+                    # Row-by-row has no batch size, run it once per sensor count
+                    for batch_size in (batch_sizes[:1] if method == 'row' else batch_sizes):
+                        written, elapsed = run_insert_case(conn, method, payload, batch_size)
+                        result = {
+                            'kind': 'insert',
+                            'method': method,
+                            'batch_size': batch_size if method != 'row' else 1,
+                            'sensors': sensor_count,
+                            'time_index': time_index,
+                            'rows': written,
+                            'seconds': elapsed,
+                            'rows_per_sec': written / max(elapsed, 1e-9),
+                        }
+                        results.append(result)
+                        print(f"  {method} batch {result['batch_size']} sensors {sensor_count} "
+                              f"index {'on' if time_index else 'off'}: {result['rows_per_sec']:,.0f} rows/sec")
+
+        # Read paths run over the last (largest) data set that was loaded, with the schema's own index restored
+        with conn.cursor() as cur:
+            set_time_index(cur, True)
+        conn.commit()
+        results.extend(run_read_cases(conn, args.read_repeats))
+    finally:
+        conn.close()
+
+    output = args.output or f"bench_results_{started_at.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, 'w') as f:
+        json.dump({
+            'started_at': started_at.isoformat(),
+            'dbname': args.dbname,
+            'postgres_version': postgres_version,
+            'timescaledb_version': timescaledb_version,
+            'python_version': platform.python_version(),
+            'settings': vars(args),
+            'results': results,
+        }, f, indent=4)
+    print(f'Results written to {output}')
+    if args.compare:
+        compare_results(args.compare, results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""
+MIT License Notice
+Copyright (c) 2024 Jeremy D. Gerdes <seakintruth@gmail.com>
+See full license in the repository.
+
+Shared connection setup for the aquaponics_db Python scripts.
+"""
+import os
+
+import psycopg2
+import psycopg2.pool
+
+# Database connection details
+DB_NAME = "aquaponics_db"
+DB_USER = "aquaponics"
+DB_HOST = "localhost"  # Adjust if your PostgreSQL server isn't on localhost
+
+def read_pgpass_password(path='~/.pgpass'):
+    """Read the password kept in the .pgpass file, format: "*:*:*:*:{password}"."""
+    with open(os.path.expanduser(path), 'r') as file:
+        _, _, _, _, db_password = file.read().strip().split(':')
+    return db_password
+
+def connect(dbname=DB_NAME, user=DB_USER, host=DB_HOST, password=None):
+    """Open a new psycopg2 connection to aquaponics_db."""
+    return psycopg2.connect(
+        dbname=dbname,
+        user=user,
+        password=password if password is not None else read_pgpass_password(),
+        host=host
+    )
+
+def create_pool(minconn, maxconn, dbname=DB_NAME, user=DB_USER, host=DB_HOST, password=None):
+    """Open a thread safe psycopg2 connection pool to aquaponics_db."""
+    return psycopg2.pool.ThreadedConnectionPool(
+        minconn,
+        maxconn,
+        dbname=dbname,
+        user=user,
+        password=password if password is not None else read_pgpass_password(),
+        host=host
+    )
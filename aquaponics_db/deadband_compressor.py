@@ -0,0 +1,158 @@
+"""
+MIT License Notice
+Copyright (c) 2024 Jeremy D. Gerdes <seakintruth@gmail.com>
+See full license in the repository.
+
+Ingest-side deadband compression of sensor readings.
+
+A reading is stored when it is the first reading of its sensor, or when it differs from the last
+stored value of that sensor by more than the sensor_type capture_after_delta_percent, with the
+ABS(value - previous) * 100 / GREATEST(previous, 1) test of the sensor_data_cleanup job. The previous
+value is not the same: sensor_data_cleanup compares with the previous raw reading (LAG), this
+compares with the last reading kept. A slow drift of small steps is therefore stored every time it
+has moved by the deadband in total, where the cleanup job would drop every step. Like that job, the
+last reading of every hour is kept too: a dropped reading is held back and written when the sensor's
+next reading arrives in a later hour (or on flush()). Readings inside the deadband never reach the
+database, instead of being written, indexed and deleted an hour later.
+
+Per-sensor state lives in flat arrays indexed by sensor_id, so the cache costs a few dozen bytes per
+sensor and a lookup is a list index.
+"""
+from array import array
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+MICROSECONDS_PER_HOUR = 3600 * 1000000
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+def to_microseconds(moment):
+    """Microseconds since the epoch for a datetime, naive values are taken as UTC."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - EPOCH) // ONE_MICROSECOND
+
+def from_microseconds(microseconds):
+    return EPOCH + timedelta(microseconds=microseconds)
+
+def load_thresholds(cur):
+    """Read capture_after_delta_percent for every sensor as {sensor_id: percent}."""
+    cur.execute("""
+        SELECT s.sensor_id, st.capture_after_delta_percent
+        FROM sensor s
+        JOIN sensor_type st ON st.sensor_type_id = s.sensor_type_id
+    """)
+    return {sensor_id: float(percent) for sensor_id, percent in cur.fetchall()}
+
+class DeadbandCompressor:
+    """Drops readings inside each sensor's deadband while keeping at least the last reading per hour."""
+
+    def __init__(self, thresholds=None, default_percent=0.0):
+        self.default_percent = default_percent
+        self.readings_in = 0
+        self.readings_out = 0
+        # Flat per-sensor state, indexed by sensor_id
+        self._percent = array('d')
+        self._has_stored = array('b')
+        self._stored_value = array('q')
+        self._hour = array('q')
+        self._has_pending = array('b')
+        self._pending_time = array('q')
+        self._pending_value = array('q')
+        for sensor_id, percent in (thresholds or {}).items():
+            self.set_threshold(sensor_id, percent)
+
+    def _grow(self, sensor_id):
+        missing = sensor_id + 1 - len(self._percent)
+        if missing > 0:
+            self._percent.extend([self.default_percent] * missing)
+            for state in (self._has_stored, self._has_pending):
+                state.extend([0] * missing)
+            for state in (self._stored_value, self._hour, self._pending_time, self._pending_value):
+                state.extend([0] * missing)
+
+    def set_threshold(self, sensor_id, percent):
+        self._grow(sensor_id)
+        self._percent[sensor_id] = float(percent)
+
+    def offer_microseconds(self, time_us, sensor_id, value):
+        """Offer one reading (time in epoch microseconds), returns the (time_us, sensor_id, value) rows to store."""
+        if sensor_id >= len(self._percent):
+            self._grow(sensor_id)
+        self.readings_in += 1
+        stored = []
+        hour = time_us // MICROSECONDS_PER_HOUR
+        if self._has_pending[sensor_id] and hour != self._hour[sensor_id]:
+            # The held back reading was the last one of its hour
+            stored.append((self._pending_time[sensor_id], sensor_id, self._pending_value[sensor_id]))
+            self._stored_value[sensor_id] = self._pending_value[sensor_id]
+            self._has_pending[sensor_id] = 0
+        self._hour[sensor_id] = hour
+
+        if value is None or not self._has_stored[sensor_id]:
+            keep = True
+        else:
+            previous = self._stored_value[sensor_id]
+            keep = abs(value - previous) * 100.0 / max(previous, 1) > self._percent[sensor_id]
+        if keep:
+            stored.append((time_us, sensor_id, value))
+            if value is not None:
+                self._stored_value[sensor_id] = value
+                self._has_stored[sensor_id] = 1
+            self._has_pending[sensor_id] = 0
+        else:
+            self._pending_time[sensor_id] = time_us
+            self._pending_value[sensor_id] = value
+            self._has_pending[sensor_id] = 1
+        self.readings_out += len(stored)
+        return stored
+
+    def compress(self, readings):
+        """Filter (datetime, sensor_id, value) tuples, yielding the readings to store (in time order per sensor)."""
+        for moment, sensor_id, value in readings:
+            for time_us, stored_id, stored_value in self.offer_microseconds(to_microseconds(moment), sensor_id, value):
+                yield from_microseconds(time_us), stored_id, stored_value
+
+    def compress_batch(self, times, sensor_ids, values):
+        """Filter one (times, sensor_ids, values) numpy batch as produced by sensor_reading_generator."""
+        offer = self.offer_microseconds
+        kept = []
+        for time_us, sensor_id, value in zip(times.astype('datetime64[us]').astype(np.int64).tolist(),
+                                             sensor_ids.tolist(), values.tolist()):
+            kept.extend(offer(time_us, sensor_id, value))
+        if not kept:
+            return times[:0], sensor_ids[:0], values[:0]
+        kept_times, kept_ids, kept_values = zip(*kept)
+        return (np.array(kept_times, dtype=np.int64).astype('datetime64[us]'),
+                np.array(kept_ids, dtype=sensor_ids.dtype),
+                np.array(kept_values, dtype=values.dtype))
+
+    def compress_batches(self, batches):
+        """Filter a stream of numpy batches, ending with the readings still held back."""
+        for batch in batches:
+            kept = self.compress_batch(*batch)
+            if len(kept[0]):
+                yield kept
+        pending = self.flush()
+        if pending:
+            kept_times, kept_ids, kept_values = zip(*pending)
+            yield (np.array(kept_times, dtype=np.int64).astype('datetime64[us]'),
+                   np.array(kept_ids, dtype=np.int32),
+                   np.array(kept_values, dtype=np.int64))
+
+    def flush(self):
+        """Release every held back reading, returns (time_us, sensor_id, value) rows ordered by time."""
+        pending = []
+        for sensor_id in range(len(self._has_pending)):
+            if self._has_pending[sensor_id]:
+                pending.append((self._pending_time[sensor_id], sensor_id, self._pending_value[sensor_id]))
+                self._stored_value[sensor_id] = self._pending_value[sensor_id]
+                self._has_pending[sensor_id] = 0
+        pending.sort()
+        self.readings_out += len(pending)
+        return pending
+
+    def ratio(self):
+        """Share of offered readings that were stored."""
+        return self.readings_out / self.readings_in if self.readings_in else 1.0
@@ -0,0 +1,335 @@
+"""
+MIT License Notice
+Copyright (c) 2024 Jeremy D. Gerdes <seakintruth@gmail.com>
+See full license in the repository.
+
+Spatial lookup of zones and sensors from geo_ref and default_geo_ref_definition.kml.
+
+The KML is read with a streaming parser, one Placemark at a time, and its polygons are stored in
+geo_ref as zones (05_setup_geo_zones.pgsql). SpatialIndex projects the zone outlines into the local
+metre grid of the sensors (local_x east and local_y north of the first geo_ref anchor) and puts the
+zones and sensor positions in a uniform grid of cells:
+
+    - the sensors inside every zone are found once, when the index is built, so "which sensors are in
+      the aquaponics shed" is a dict lookup
+    - zones_at() only tests the zones whose bounding box covers the point's cell
+    - nearest_sensors() searches rings of cells outwards from the point and stops as soon as no
+      unvisited cell can hold a closer sensor
+
+Only the outer boundary of a polygon is used; holes (innerBoundaryIs) are ignored.
+"""
+import argparse
+import heapq
+import json
+import math
+import sys
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from db_connection import DB_NAME, connect
+
+KML_NS = '{http://www.opengis.net/kml/2.2}'
+DEFAULT_KML = 'default_geo_ref_definition.kml'
+EARTH_RADIUS_M = 6371008.8
+# Grid cells are sized for about this many sensors per cell, unless a cell size is given
+SENSORS_PER_CELL = 2
+
+Placemark = namedtuple('Placemark', ['name', 'description', 'coordinates'])
+Zone = namedtuple('Zone', ['zone_id', 'name', 'ring'])
+
+# Function to stream the placemarks of a KML file, coordinates are [(lon, lat, altitude)] of the polygon's outer boundary or the point
+def iter_placemarks(path):
+    stack = []
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            continue
+        stack.pop()
+        if elem.tag != KML_NS + 'Placemark':
+            continue
+        coordinates = elem.find(f'.//{KML_NS}outerBoundaryIs/{KML_NS}LinearRing/{KML_NS}coordinates')
+        if coordinates is None:
+            coordinates = elem.find(f'.//{KML_NS}Point/{KML_NS}coordinates')
+        if coordinates is not None and coordinates.text:
+            yield Placemark(
+                (elem.findtext(KML_NS + 'name') or '').strip(),
+                (elem.findtext(KML_NS + 'description') or '').strip(),
+                [parse_coordinate(text) for text in coordinates.text.split()],
+            )
+        # Drop the placemark from the tree, so memory stays flat however large the file is
+        elem.clear()
+        if stack:
+            stack[-1].remove(elem)
+
+def parse_coordinate(text):
+    values = [float(value) for value in text.split(',')]
+    return values[0], values[1], values[2] if len(values) > 2 else 0.0
+
+class LocalProjection:
+    """Equirectangular projection around an anchor, in metres east (x) and north (y) of it."""
+
+    def __init__(self, anchor_lat, anchor_lon):
+        self.anchor_lat = float(anchor_lat)
+        self.anchor_lon = float(anchor_lon)
+        self.metres_per_deg_lat = math.radians(1) * EARTH_RADIUS_M
+        self.metres_per_deg_lon = self.metres_per_deg_lat * math.cos(math.radians(self.anchor_lat))
+
+    def to_local(self, lat, lon):
+        return ((np.asarray(lon, dtype=np.float64) - self.anchor_lon) * self.metres_per_deg_lon,
+                (np.asarray(lat, dtype=np.float64) - self.anchor_lat) * self.metres_per_deg_lat)
+
+    def to_latlon(self, x, y):
+        return (self.anchor_lat + np.asarray(y, dtype=np.float64) / self.metres_per_deg_lat,
+                self.anchor_lon + np.asarray(x, dtype=np.float64) / self.metres_per_deg_lon)
+
+# Function to upsert the polygon placemarks into geo_ref as zones, returns the number of zones
+def load_geo_ref(cur, placemarks):
+    rows = []
+    for placemark in placemarks:
+        if len(placemark.coordinates) < 3:
+            continue
+        # The closing vertex repeats the first one and would weigh it twice in the centroid
+        vertices = placemark.coordinates[:-1] if placemark.coordinates[0] == placemark.coordinates[-1] else placemark.coordinates
+        lon, lat, altitude = (sum(values) / len(vertices) for values in zip(*vertices))
+        rows.append((lat, lon, altitude, placemark.description or placemark.name, placemark.name,
+                     json.dumps([list(vertex) for vertex in placemark.coordinates])))
+    execute_values(cur, """
+        INSERT INTO geo_ref (anchor_lat, anchor_lon, anchor_elevation, anchor_description, anchor_name, boundary)
+        VALUES %s
+        ON CONFLICT (anchor_name) WHERE boundary IS NOT NULL DO UPDATE SET
+            anchor_lat = EXCLUDED.anchor_lat,
+            anchor_lon = EXCLUDED.anchor_lon,
+            anchor_elevation = EXCLUDED.anchor_elevation,
+            anchor_description = EXCLUDED.anchor_description,
+            boundary = EXCLUDED.boundary
+    """, rows)
+    return len(rows)
+
+# Function to read the origin of the sensor local coordinates, the first anchor that is not a zone
+def load_projection(cur):
+    cur.execute("SELECT anchor_lat, anchor_lon FROM geo_ref WHERE boundary IS NULL ORDER BY anchor_id LIMIT 1")
+    row = cur.fetchone()
+    if row is None:
+        raise LookupError('geo_ref has no anchor, run 03_intialize_ref_data.pgsql first')
+    return LocalProjection(*row)
+
+def load_zones(cur, projection):
+    cur.execute("SELECT anchor_id, anchor_name, boundary FROM geo_ref WHERE boundary IS NOT NULL ORDER BY anchor_id")
+    zones = []
+    for anchor_id, name, boundary in cur.fetchall():
+        if isinstance(boundary, str):
+            boundary = json.loads(boundary)
+        zones.append(zone_from_coordinates(anchor_id, name, boundary, projection))
+    return zones
+
+def zone_from_coordinates(zone_id, name, coordinates, projection):
+    """Zone with its outline as a closed (n, 2) array of local metres."""
+    lon, lat = np.array([vertex[:2] for vertex in coordinates], dtype=np.float64).T
+    x, y = projection.to_local(lat, lon)
+    ring = np.column_stack([x, y])
+    if not np.array_equal(ring[0], ring[-1]):
+        ring = np.vstack([ring, ring[:1]])
+    return Zone(zone_id, name, ring)
+
+def load_sensor_positions(cur):
+    """Sensor ids and (n, 2) local_x / local_y of the sensors that have a position."""
+    cur.execute("SELECT sensor_id, local_x, local_y FROM sensor WHERE local_x IS NOT NULL AND local_y IS NOT NULL ORDER BY sensor_id")
+    rows = cur.fetchall()
+    sensor_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    positions = np.array([(float(row[1]), float(row[2])) for row in rows], dtype=np.float64).reshape(-1, 2)
+    return sensor_ids, positions
+
+def points_in_ring(points, ring):
+    """Even-odd test of (n, 2) points against a closed ring, vectorized over the points."""
+    x, y = points[:, 0], points[:, 1]
+    inside = np.zeros(len(points), dtype=bool)
+    for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+        if y1 == y2:
+            continue
+        crosses = (y1 > y) != (y2 > y)
+        inside ^= crosses & (x < x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+    return inside
+
+def point_in_ring(x, y, ring):
+    """points_in_ring for one point, over a ring of tuples (faster than NumPy for a single point)."""
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+class SpatialIndex:
+    """Grid index over zone outlines and sensor positions, in local metres."""
+
+    def __init__(self, zones, sensor_ids, positions, cell_size=None, projection=None):
+        self.projection = projection
+        self.zones = list(zones)
+        self.zone_by_name = {zone.name: zone for zone in self.zones}
+        self.sensor_ids = np.asarray(sensor_ids, dtype=np.int64)
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = float(cell_size) if cell_size else self._default_cell_size()
+        # Plain lists: a single query reads a handful of entries, where NumPy scalars are slower
+        self._xs = self.positions[:, 0].tolist()
+        self._ys = self.positions[:, 1].tolist()
+        self._ids = self.sensor_ids.tolist()
+
+        self._sensor_cells = {}
+        cells = np.floor(self.positions / self.cell_size).astype(np.int64)
+        for index, cell in enumerate(map(tuple, cells.tolist())):
+            self._sensor_cells.setdefault(cell, []).append(index)
+        if len(cells):
+            self._cell_min, self._cell_max = cells.min(axis=0), cells.max(axis=0)
+
+        self._zone_cells = {}
+        self._zone_rings = []
+        self._zone_boxes = []
+        self._zone_sensors = {}
+        for index, zone in enumerate(self.zones):
+            low, high = zone.ring.min(axis=0), zone.ring.max(axis=0)
+            self._zone_boxes.append((low[0], low[1], high[0], high[1]))
+            self._zone_rings.append([tuple(vertex) for vertex in zone.ring.tolist()])
+            for cell in self._cells_covering(low, high):
+                self._zone_cells.setdefault(cell, []).append(index)
+            self._zone_sensors[zone.name] = self.sensors_in_polygon(zone.ring)
+
+    def _default_cell_size(self):
+        """Cell size giving about SENSORS_PER_CELL sensors per cell over the area the sensors and zones span."""
+        points = np.vstack([self.positions] + [zone.ring for zone in self.zones])
+        if len(points) < 2:
+            return 1.0
+        width, height = np.maximum(points.max(axis=0) - points.min(axis=0), 1e-3)
+        return max(math.sqrt(width * height * SENSORS_PER_CELL / max(len(self.positions), 1)), 1e-3)
+
+    @classmethod
+    def from_database(cls, cur, cell_size=None):
+        projection = load_projection(cur)
+        sensor_ids, positions = load_sensor_positions(cur)
+        return cls(load_zones(cur, projection), sensor_ids, positions, cell_size, projection)
+
+    def _cells_covering(self, low, high):
+        (i0, j0), (i1, j1) = np.floor(np.asarray(low) / self.cell_size).astype(int), np.floor(np.asarray(high) / self.cell_size).astype(int)
+        return [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+    def sensors_in_zone(self, name):
+        """Sensor ids inside a zone, precomputed when the index was built."""
+        return self._zone_sensors[name]
+
+    def sensors_in_polygon(self, ring):
+        """Sensor ids inside any closed ring of local metres, testing only the sensors of the cells it covers."""
+        ring = np.asarray(ring, dtype=np.float64)
+        candidates = [index for cell in self._cells_covering(ring.min(axis=0), ring.max(axis=0))
+                      for index in self._sensor_cells.get(cell, ())]
+        if not candidates:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.array(candidates, dtype=np.int64)
+        return np.sort(self.sensor_ids[candidates[points_in_ring(self.positions[candidates], ring)]])
+
+    def zones_at(self, x, y):
+        """Names of the zones containing the point, smallest bounding box first (the shed before the plot)."""
+        cell = (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+        found = []
+        for index in self._zone_cells.get(cell, ()):
+            x0, y0, x1, y1 = self._zone_boxes[index]
+            if x0 <= x <= x1 and y0 <= y <= y1 and point_in_ring(x, y, self._zone_rings[index]):
+                found.append(((x1 - x0) * (y1 - y0), self.zones[index].name))
+        return [name for _, name in sorted(found)]
+
+    def nearest_sensors(self, x, y, k=1, max_distance=math.inf):
+        """The k nearest sensors as [(sensor_id, distance_m)], nearest first."""
+        if not self._ids or k <= 0:
+            return []
+        ci, cj = math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+        # Rings beyond this one lie outside the occupied cells
+        last_ring = max(ci - self._cell_min[0], self._cell_max[0] - ci, cj - self._cell_min[1], self._cell_max[1] - cj, 0)
+        best = []  # max-heap of (-distance², sensor index) holding the k best so far
+        ring = 0
+        while ring <= last_ring:
+            for cell in self._ring_cells(ci, cj, ring):
+                for index in self._sensor_cells.get(cell, ()):
+                    d2 = (self._xs[index] - x) ** 2 + (self._ys[index] - y) ** 2
+                    if len(best) < k:
+                        heapq.heappush(best, (-d2, index))
+                    elif d2 < -best[0][0]:
+                        heapq.heapreplace(best, (-d2, index))
+            # Every sensor in a later ring is at least ring * cell_size away
+            reach = ring * self.cell_size
+            if len(best) == k and -best[0][0] <= reach * reach or reach > max_distance:
+                break
+            ring += 1
+        return [(self._ids[index], distance) for distance, index in
+                sorted((math.sqrt(-neg_d2), index) for neg_d2, index in best) if distance <= max_distance]
+
+    @staticmethod
+    def _ring_cells(ci, cj, ring):
+        if ring == 0:
+            return [(ci, cj)]
+        cells = [(ci + di, cj + dj) for di in (-ring, ring) for dj in range(-ring, ring + 1)]
+        cells += [(ci + di, cj + dj) for dj in (-ring, ring) for di in range(-ring + 1, ring)]
+        return cells
+
+# Function to time random zones_at and nearest_sensors queries over the plot, in microseconds per query
+def benchmark(index, queries, seed=None):
+    rng = np.random.default_rng(seed)
+    if len(index.positions):
+        low, high = index.positions.min(axis=0), index.positions.max(axis=0)
+    else:
+        low, high = np.zeros(2), np.ones(2)
+    points = rng.uniform(low, high, size=(queries, 2)).tolist()
+    results = {}
+    for name, query in (('zones_at', index.zones_at), ('nearest_sensors', index.nearest_sensors)):
+        started = time.perf_counter()
+        for x, y in points:
+            query(x, y)
+        results[name] = (time.perf_counter() - started) / queries * 1e6
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Load KML zones into geo_ref and query zones and sensors spatially.')
+    parser.add_argument('--dbname', default=DB_NAME, help='Database to use (default aquaponics_db).')
+    parser.add_argument('--load-kml', nargs='?', const=DEFAULT_KML, default=None, metavar='KML',
+                        help=f'Load the polygons of a KML file into geo_ref first (default {DEFAULT_KML}).')
+    parser.add_argument('--zone', action='append', default=[], help='Print the sensors inside this zone (repeatable).')
+    parser.add_argument('--nearest', nargs=2, type=float, metavar=('LAT', 'LON'), help='Print the sensors nearest to this point and the zones it is in.')
+    parser.add_argument('-k', type=int, default=5, help='Number of nearest sensors (default 5).')
+    parser.add_argument('--cell-size', type=float, default=None,
+                        help=f'Grid cell size in metres (default sized for about {SENSORS_PER_CELL} sensors per cell).')
+    parser.add_argument('--benchmark', type=int, default=0, metavar='N', help='Time N random point queries.')
+    args = parser.parse_args()
+
+    conn = connect(dbname=args.dbname)
+    try:
+        with conn.cursor() as cur:
+            if args.load_kml:
+                print(f'Loaded {load_geo_ref(cur, iter_placemarks(args.load_kml))} zones from {args.load_kml} into geo_ref')
+                conn.commit()
+            started = time.perf_counter()
+            index = SpatialIndex.from_database(cur, args.cell_size)
+            print(f'Indexed {len(index.zones)} zones and {len(index.sensor_ids)} positioned sensors '
+                  f'in {(time.perf_counter() - started) * 1000:.1f} ms, {index.cell_size:.2f} m cells')
+    except LookupError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+
+    for zone in (args.zone or ([] if args.nearest or args.benchmark else index.zone_by_name)):
+        if zone not in index.zone_by_name:
+            print(f'Unknown zone {zone!r}, zones are: {", ".join(index.zone_by_name)}', file=sys.stderr)
+            return 1
+        print(f'{zone}: {index.sensors_in_zone(zone).tolist()}')
+    if args.nearest:
+        x, y = index.projection.to_local(*args.nearest)
+        print(f'Zones at {args.nearest[0]}, {args.nearest[1]}: {index.zones_at(float(x), float(y))}')
+        for sensor_id, distance in index.nearest_sensors(float(x), float(y), args.k):
+            print(f'  sensor {sensor_id}: {distance:.2f} m')
+    if args.benchmark:
+        for name, micros in benchmark(index, args.benchmark).items():
+            print(f'{name}: {micros:.1f} us per query')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+MIT License Notice
+Copyright (c) 2024 Jeremy D. Gerdes <seakintruth@gmail.com>
+See full license in the repository.
+
+Synthetic load generator for sensor_ingest_service.py.
+
+Reads the sensors of the target database, generates their readings with sensor_reading_generator
+and sends them in real time over the line protocol, one reading of every sensor each
+--interval-seconds, spread over --connections sockets (a sensor always uses the same socket so its
+readings stay in order). When the service pushes back, the sockets stop draining and the generator
+falls behind its schedule; the lag is reported with the rate achieved. At the end the service
+metrics are fetched with STATS and the readings that reached sensor_datum are counted.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from db_connection import DB_NAME, connect
+from sensor_reading_generator import load_sensors, generate_reading_batches
+
+async def open_connection(args):
+    if args.unix_socket:
+        return await asyncio.open_unix_connection(args.unix_socket)
+    return await asyncio.open_connection(args.host, args.port)
+
+async def read_errors(reader, counter):
+    """Count the ERR lines the service answers with."""
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        counter[0] += 1
+        if counter[0] <= 5:
+            print(f'Service: {line.decode().strip()}', file=sys.stderr)
+
+async def fetch_stats(args):
+    reader, writer = await open_connection(args)
+    writer.write(b'STATS\n')
+    await writer.drain()
+    line = await reader.readline()
+    writer.close()
+    return json.loads(line)
+
+async def generate_load(args, sensors):
+    """Send the readings on schedule, returns (sent, start, end, max_lag_seconds, errors, elapsed_seconds)."""
+    connections = [await open_connection(args) for _ in range(max(1, args.connections))]
+    errors = [0]
+    error_readers = [asyncio.ensure_future(read_errors(reader, errors)) for reader, _ in connections]
+    writers = [writer for _, writer in connections]
+    assignment = np.arange(len(sensors)) % len(writers)
+    scale = np.array([sensor.scale_factor for sensor in sensors], dtype=np.float64)
+
+    num_steps = max(1, int(args.duration // args.interval_seconds))
+    start = datetime.now(timezone.utc)
+    started = time.monotonic()
+    batch_steps = max(1, int(1.0 // args.interval_seconds))
+    sent = 0
+    max_lag = 0.0
+    for times, sensor_ids, values in generate_reading_batches(sensors, start, args.interval_seconds, num_steps,
+                                                              batch_steps=batch_steps, seed=args.seed):
+        time_text = np.datetime_as_string(times, unit='us', timezone='UTC')
+        readings = (values.reshape(-1, len(sensors)) / scale).ravel()
+        lines = np.char.add(np.char.add(np.char.add(np.char.add(sensor_ids.astype(str), ','),
+                                                    readings.astype(str)), ','), time_text)
+        for step_lines in lines.reshape(-1, len(sensors)):
+            due = started + (sent // len(sensors)) * args.interval_seconds
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+            for index, writer in enumerate(writers):
+                writer.write(('\n'.join(step_lines[assignment == index]) + '\n').encode())
+            await asyncio.gather(*(writer.drain() for writer in writers))
+            sent += len(step_lines)
+    end = start + timedelta(seconds=num_steps * args.interval_seconds)
+
+    for writer in writers:
+        writer.close()
+    await asyncio.sleep(0.5)
+    for task in error_readers:
+        task.cancel()
+    return sent, start, end, max_lag, errors[0], time.monotonic() - started
+
+def count_stored(dbname, sensors, start, end):
+    conn = connect(dbname=dbname)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM sensor_datum WHERE sensor_id = ANY(%s) AND time >= %s AND time <= %s",
+                        ([sensor.sensor_id for sensor in sensors], start, end))
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Send synthetic live readings to sensor_ingest_service.py and report what arrived.')
+    parser.add_argument('--dbname', default=DB_NAME, help='Database the service writes to (default aquaponics_db).')
+    parser.add_argument('--host', default='127.0.0.1', help='Service address (default 127.0.0.1).')
+    parser.add_argument('--port', type=int, default=5555, help='Service port (default 5555).')
+    parser.add_argument('--unix-socket', default=None, help='Connect to this unix socket path instead of TCP.')
+    parser.add_argument('--connections', type=int, default=4, help='Sockets the sensors are spread over (default 4).')
+    parser.add_argument('--sensors', type=int, default=0, help='Use only the first N sensors (default all).')
+    parser.add_argument('--interval-seconds', type=float, default=1.0, help='Seconds between readings of one sensor (default 1).')
+    parser.add_argument('--duration', type=float, default=60.0, help='Seconds of readings to send (default 60).')
+    parser.add_argument('--settle-seconds', type=float, default=2.0,
+                        help='Wait this long for the last batches before counting stored rows (default 2).')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for repeatable readings.')
+    args = parser.parse_args()
+
+    conn = connect(dbname=args.dbname)
+    try:
+        with conn.cursor() as cur:
+            sensors = load_sensors(cur)
+    finally:
+        conn.close()
+    if args.sensors:
+        sensors = sensors[:args.sensors]
+    if not sensors:
+        print('No sensors found, load reference data first.', file=sys.stderr)
+        return 1
+
+    target = len(sensors) / args.interval_seconds
+    print(f'Sending {len(sensors)} sensors every {args.interval_seconds}s ({target:,.0f} readings/sec) for {args.duration}s')
+    sent, start, end, max_lag, errors, elapsed = asyncio.run(generate_load(args, sensors))
+    print(f'Sent {sent} readings in {elapsed:.2f}s ({sent / max(elapsed, 1e-9):,.0f} readings/sec), '
+          f'max schedule lag {max_lag:.3f}s, {errors} rejected')
+
+    time.sleep(args.settle_seconds)
+    print(json.dumps(asyncio.run(fetch_stats(args)), indent=2))
+    stored = count_stored(args.dbname, sensors, start, end)
+    print(f'{stored} of {sent} readings are in sensor_datum (fewer is expected when the service runs with --deadband)')
+    return 0 if errors == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""
+MIT License Notice
+Copyright (c) 2024 Jeremy D. Gerdes <seakintruth@gmail.com>
+See full license in the repository.
+
+Latency and trend report of the pg_cron jobs.
+
+Combines two sources over the last --days days:
+- cron.job_run_details, which pg_cron keeps for every run: status, start and end time. The start
+  delay is how long after its scheduled minute a run started.
+- job_metric (02_setup_pg_cron_jobs.pgsql), which the instrumented jobs fill themselves: duration,
+  rows affected and refresh lag (how far behind its high-water mark the job was when it started).
+
+For every job it prints the run count, failures, percentiles, and the least squares trend of duration
+and lag per day. It also lists the jobs that are missing their schedule: runs missed or overrunning the
+schedule period, a p95 duration above half the period, or a refresh lag that is growing and already
+more than two periods behind.
+"""
+import argparse
+import json
+import re
+import sys
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import psycopg2
+import psycopg2.errors
+
+from db_connection import DB_NAME, connect
+
+SECONDS_PER_DAY = 86400.0
+PERCENTILES = (50, 95, 99)
+
+# Function to turn a cron schedule into its period in seconds, None for schedules without a fixed period
+def schedule_period(schedule):
+    if not schedule:
+        return None
+    match = re.fullmatch(r'\s*(\d+)\s+seconds?\s*', schedule)
+    if match:
+        return float(match.group(1))
+    fields = schedule.split()
+    if len(fields) != 5 or fields[2:] != ['*', '*', '*']:
+        return None
+    minute, hour = fields[0], fields[1]
+    if hour == '*':
+        if minute == '*':
+            return 60.0
+        if minute.startswith('*/') and minute[2:].isdigit():
+            return 60.0 * int(minute[2:])
+        if minute.isdigit():
+            return 3600.0
+    elif hour.isdigit() and minute.isdigit():
+        return SECONDS_PER_DAY
+    return None
+
+def percentiles(values):
+    """{p50, p95, p99, max} of a sequence, None values when it is empty."""
+    if len(values) == 0:
+        return dict.fromkeys([f'p{p}' for p in PERCENTILES] + ['max'])
+    result = dict(zip((f'p{p}' for p in PERCENTILES), np.percentile(values, PERCENTILES).tolist()))
+    result['max'] = float(np.max(values))
+    return result
+
+def trend_per_day(times, values):
+    """Least squares slope of values per day, None with fewer than three points or a single instant."""
+    if len(values) < 3:
+        return None
+    days = (np.asarray(times, dtype=np.float64) - times[0]) / SECONDS_PER_DAY
+    if days[-1] <= 0:
+        return None
+    return float(np.polyfit(days, np.asarray(values, dtype=np.float64), 1)[0])
+
+def read_cron_runs(cur, since):
+    """{job name: (schedule, [(start epoch, duration s, succeeded)])} from cron.job_run_details, None without pg_cron history."""
+    try:
+        cur.execute("""
+            SELECT COALESCE(j.jobname, d.command), j.schedule, d.status,
+                   extract(epoch FROM d.start_time), extract(epoch FROM d.end_time - d.start_time)
+            FROM cron.job_run_details d
+            LEFT JOIN cron.job j ON j.jobid = d.jobid
+            WHERE d.start_time >= %s
+            ORDER BY d.start_time
+        """, (since,))
+    except (psycopg2.errors.UndefinedTable, psycopg2.errors.InvalidSchemaName):
+        cur.connection.rollback()
+        return None
+    jobs = {}
+    for job_name, schedule, status, start, duration in cur.fetchall():
+        runs = jobs.setdefault(job_name, (schedule, []))[1]
+        runs.append((float(start), float(duration) if duration is not None else None, status == 'succeeded'))
+    return jobs
+
+def read_schedules(cur):
+    try:
+        cur.execute("SELECT jobname, schedule FROM cron.job WHERE jobname IS NOT NULL")
+    except (psycopg2.errors.UndefinedTable, psycopg2.errors.InvalidSchemaName):
+        cur.connection.rollback()
+        return {}
+    return dict(cur.fetchall())
+
+def read_job_metrics(cur, since):
+    """{job name: [(start epoch, duration ms, rows affected, refresh lag s)]} from job_metric."""
+    cur.execute("""
+        SELECT job_name, extract(epoch FROM started_at), duration_ms, rows_affected, extract(epoch FROM refresh_lag)
+        FROM job_metric
+        WHERE started_at >= %s
+        ORDER BY started_at
+    """, (since,))
+    jobs = {}
+    for job_name, start, duration_ms, rows, lag in cur.fetchall():
+        jobs.setdefault(job_name, []).append((float(start), duration_ms, rows, float(lag) if lag is not None else None))
+    return jobs
+
+def summarize_cron(schedule, runs, window_start, window_end):
+    period = schedule_period(schedule)
+    starts = np.array([run[0] for run in runs])
+    durations = np.array([run[1] for run in runs if run[1] is not None])
+    duration_times = [run[0] for run in runs if run[1] is not None]
+    # pg_cron starts jobs on the minute, anything after that is dispatch delay
+    delays = np.mod(starts, 60.0) if period is None or period >= 60 else np.empty(0)
+    summary = {
+        'schedule': schedule,
+        'period_seconds': period,
+        'runs': len(runs),
+        'failed': sum(1 for run in runs if not run[2]),
+        'duration_seconds': percentiles(durations),
+        'duration_trend_seconds_per_day': trend_per_day(duration_times, durations),
+        'start_delay_seconds': percentiles(delays),
+        'overruns': int(np.sum(durations > period)) if period else None,
+        'missed_runs': None,
+    }
+    if period and len(starts):
+        # Runs due from the first run seen to the end of the window, the first run itself included
+        expected = int((window_end - max(starts[0], window_start)) // period) + 1
+        summary['missed_runs'] = max(0, expected - len(runs))
+    return summary
+
+def summarize_metrics(metrics, period):
+    times = [metric[0] for metric in metrics]
+    durations = np.array([metric[1] for metric in metrics], dtype=np.float64) / 1000.0
+    rows = [metric[2] for metric in metrics if metric[2] is not None]
+    lag_points = [(metric[0], metric[3]) for metric in metrics if metric[3] is not None]
+    lags = np.array([lag for _, lag in lag_points])
+    summary = {
+        'runs': len(metrics),
+        'duration_seconds': percentiles(durations),
+        'duration_trend_seconds_per_day': trend_per_day(times, durations),
+        'rows_affected': percentiles(np.array(rows, dtype=np.float64)),
+        'rows_trend_per_day': trend_per_day([metric[0] for metric in metrics if metric[2] is not None], rows),
+        'rows_per_second': float(np.sum(rows) / np.sum(durations)) if rows and np.sum(durations) > 0 else None,
+        'refresh_lag_seconds': percentiles(lags),
+        'refresh_lag_trend_seconds_per_day': trend_per_day([time for time, _ in lag_points], lags),
+        'latest_refresh_lag_seconds': float(lags[-1]) if len(lags) else None,
+        'period_seconds': period,
+    }
+    return summary
+
+def warnings_for(job_name, cron, metrics):
+    """Reasons a job looks like it is missing its schedule."""
+    warnings = []
+    period = (cron or metrics or {}).get('period_seconds')
+    if cron:
+        if cron['failed']:
+            warnings.append(f"{job_name}: {cron['failed']} of {cron['runs']} runs failed")
+        if cron['missed_runs']:
+            warnings.append(f"{job_name}: {cron['missed_runs']} scheduled runs did not run")
+        if cron['overruns']:
+            warnings.append(f"{job_name}: {cron['overruns']} runs took longer than the {period:g}s schedule period")
+    durations = (metrics or cron or {}).get('duration_seconds', {})
+    if period and durations.get('p95') is not None and durations['p95'] > period / 2:
+        warnings.append(f"{job_name}: p95 duration {durations['p95']:.2f}s is {durations['p95'] * 100 / period:.0f}% "
+                        f"of its {period:g}s schedule period")
+    if metrics and period:
+        trend = metrics['refresh_lag_trend_seconds_per_day']
+        latest = metrics['latest_refresh_lag_seconds']
+        if trend is not None and trend > 0 and latest is not None and latest > 2 * period:
+            warnings.append(f"{job_name}: refresh lag {latest:.0f}s and growing {trend:.1f}s per day")
+    return warnings
+
+def by_day(metrics):
+    """[(day, runs, p50 s, p95 s, max lag s, rows)] of one job's job_metric rows."""
+    days = {}
+    for start, duration_ms, rows, lag in metrics:
+        day = datetime.fromtimestamp(start, timezone.utc).date()
+        days.setdefault(day, []).append((duration_ms / 1000.0, rows or 0, lag))
+    result = []
+    for day, entries in sorted(days.items()):
+        durations = [entry[0] for entry in entries]
+        lags = [entry[2] for entry in entries if entry[2] is not None]
+        result.append((day.isoformat(), len(entries), float(np.percentile(durations, 50)), float(np.percentile(durations, 95)),
+                       max(lags) if lags else None, sum(entry[1] for entry in entries)))
+    return result
+
+def fmt(value, digits=3):
+    return '-' if value is None else f'{value:.{digits}f}'
+
+def print_report(report, days_by_job):
+    print(f"Jobs from {report['window_start']} to {report['window_end']}")
+    if report['cron'] is None:
+        print('cron.job_run_details is not available, only job_metric is reported.')
+    else:
+        print('\npg_cron runs (cron.job_run_details)')
+        print(f"{'job':<40} {'runs':>6} {'failed':>6} {'missed':>6} {'p50 s':>9} {'p95 s':>9} {'p99 s':>9} {'max s':>9} "
+              f"{'delay p95':>9} {'trend s/day':>11}")
+        for job_name, summary in sorted(report['cron'].items()):
+            durations = summary['duration_seconds']
+            missed = summary['missed_runs']
+            print(f"{job_name[:40]:<40} {summary['runs']:>6} {summary['failed']:>6} {'-' if missed is None else missed:>6} "
+                  f"{fmt(durations['p50']):>9} {fmt(durations['p95']):>9} {fmt(durations['p99']):>9} {fmt(durations['max']):>9} "
+                  f"{fmt(summary['start_delay_seconds']['p95']):>9} {fmt(summary['duration_trend_seconds_per_day'], 4):>11}")
+    print('\nInstrumented runs (job_metric)')
+    print(f"{'job':<40} {'runs':>6} {'p50 s':>9} {'p95 s':>9} {'max s':>9} {'rows p50':>10} {'rows/s':>10} "
+          f"{'lag p50 s':>9} {'lag max s':>9} {'lag s/day':>9}")
+    for job_name, summary in sorted(report['metrics'].items()):
+        durations = summary['duration_seconds']
+        lags = summary['refresh_lag_seconds']
+        print(f"{job_name[:40]:<40} {summary['runs']:>6} {fmt(durations['p50']):>9} {fmt(durations['p95']):>9} "
+              f"{fmt(durations['max']):>9} {fmt(summary['rows_affected']['p50'], 0):>10} {fmt(summary['rows_per_second'], 0):>10} "
+              f"{fmt(lags['p50'], 1):>9} {fmt(lags['max'], 1):>9} {fmt(summary['refresh_lag_trend_seconds_per_day'], 1):>9}")
+    for job_name, days in sorted(days_by_job.items()):
+        print(f"\n{job_name} by day")
+        print(f"{'day':<12} {'runs':>6} {'p50 s':>9} {'p95 s':>9} {'lag max s':>9} {'rows':>12}")
+        for day, runs, p50, p95, lag, rows in days:
+            print(f"{day:<12} {runs:>6} {p50:>9.3f} {p95:>9.3f} {fmt(lag, 1):>9} {rows:>12,}")
+    print('\nMissing their schedule:' if report['warnings'] else '\nAll jobs are keeping up with their schedules.')
+    for warning in report['warnings']:
+        print(f'  {warning}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize pg_cron job runs and job_metric into latency percentiles and trends.')
+    parser.add_argument('--dbname', default=DB_NAME, help='Database to report on (default aquaponics_db).')
+    parser.add_argument('--days', type=float, default=7.0, help='Days of history to summarize (default 7).')
+    parser.add_argument('--job', action='append', default=None, help='Only this job (repeatable), e.g. rollup_second.')
+    parser.add_argument('--by-day', action='store_true', help='Also print per-day duration percentiles of each job.')
+    parser.add_argument('--json', default=None, help='Also write the report as JSON to this file.')
+    args = parser.parse_args()
+
+    window_end = datetime.now(timezone.utc)
+    window_start = window_end - timedelta(days=args.days)
+    conn = connect(dbname=args.dbname)
+    try:
+        with conn.cursor() as cur:
+            cron_runs = read_cron_runs(cur, window_start)
+            schedules = read_schedules(cur)
+            job_metrics = read_job_metrics(cur, window_start)
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f'Reading the job history failed: {e}', file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+
+    wanted = set(args.job) if args.job else None
+    report = {'window_start': window_start.isoformat(), 'window_end': window_end.isoformat(),
+              'cron': None, 'metrics': {}, 'warnings': []}
+    if cron_runs is not None:
+        report['cron'] = {job_name: summarize_cron(schedule, runs, window_start.timestamp(), window_end.timestamp())
+                          for job_name, (schedule, runs) in cron_runs.items() if wanted is None or job_name in wanted}
+    for job_name, metrics in job_metrics.items():
+        if wanted is None or job_name in wanted:
+            report['metrics'][job_name] = summarize_metrics(metrics, schedule_period(schedules.get(job_name)))
+    for job_name in sorted(set(report['cron'] or {}) | set(report['metrics'])):
+        report['warnings'].extend(warnings_for(job_name, (report['cron'] or {}).get(job_name), report['metrics'].get(job_name)))
+
+    days_by_job = {job_name: by_day(job_metrics[job_name]) for job_name in report['metrics']} if args.by_day else {}
+    print_report(report, days_by_job)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'Report written to {args.json}')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
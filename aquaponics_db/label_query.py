@@ -0,0 +1,210 @@
+"""
+MIT License Notice
+Copyright (c) 2024 Jeremy D. Gerdes <seakintruth@gmail.com>
+See full license in the repository.
+
+Label based retrieval of sensor readings.
+
+label_assignment is polymorphic (entity_type sensor / area / system / alert), so finding the sensors
+behind a label normally takes joins through label, label_assignment and sensor on every query.
+LabelIndex loads the assignments once and resolves every label to a sorted array of sensor ids: a
+sensor label to the sensor, an area or system label to every sensor in that area or system (alert
+labels don't name sensors and are skipped). The index is rebuilt only when label_index_version
+(06_setup_label_index.pgsql) shows that label, label_assignment, sensor or sensor_type changed since
+it was built.
+
+LabelQuery then fetches the readings of all the sensors behind the labels with one bulk
+COPY (SELECT ... WHERE sensor_id = ANY(...)) from sensor_datum or one of the rollup views, and returns
+them as NumPy arrays instead of row tuples.
+"""
+import argparse
+import io
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from db_connection import DB_NAME, connect
+
+# Where the readings come from; the rollup views are those of 04_setup_sensor_rollups.pgsql
+SOURCES = {
+    'raw': 'sensor_datum',
+    'second': 'second_by_second_last_15_minutes_incremental',
+    'minute': 'minute_by_minute_last_24_hours_incremental',
+    'hour': 'hourly_last_week_incremental',
+}
+
+EMPTY_IDS = np.empty(0, dtype=np.int64)
+
+class SensorSeries:
+    """Readings ordered by (sensor_id, time): time as datetime64[us] UTC, sensor_id as int64, value as int64 or float64."""
+
+    def __init__(self, time, sensor_id, value):
+        self.time = time
+        self.sensor_id = sensor_id
+        self.value = value
+
+    def __len__(self):
+        return len(self.sensor_id)
+
+    def for_sensor(self, sensor_id):
+        """(time, value) of one sensor, a slice of the arrays since they are ordered by sensor."""
+        start, end = np.searchsorted(self.sensor_id, [sensor_id, sensor_id + 1])
+        return self.time[start:end], self.value[start:end]
+
+    def to_arrow(self):
+        """The readings as a pyarrow.Table (pyarrow is only needed for this)."""
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError('to_arrow() needs pyarrow: pip install pyarrow')
+        return pa.table({'time': pa.array(self.time, type=pa.timestamp('us', tz='UTC')),
+                         'sensor_id': self.sensor_id, 'value': self.value})
+
+class LabelIndex:
+    """Cached label name -> sensor id arrays, rebuilt when label_index_version changes."""
+
+    def __init__(self):
+        self.version = None
+        self.sensors_by_label = {}
+        self.scale_factors = {}
+
+    def current_version(self, cur):
+        cur.execute("SELECT version FROM label_index_version")
+        row = cur.fetchone()
+        return row[0] if row else 0
+
+    def refresh(self, cur, force=False):
+        """Rebuild the index if the labels or sensors changed since it was built, returns True when it was rebuilt."""
+        version = self.current_version(cur)
+        if not force and version == self.version:
+            return False
+        cur.execute("""
+            SELECT s.sensor_id, s.area_id, s.system_id, st.scale_factor
+            FROM sensor s JOIN sensor_type st ON st.sensor_type_id = s.sensor_type_id
+        """)
+        by_entity = {'sensor': {}, 'area': {}, 'system': {}}
+        scale_factors = {}
+        for sensor_id, area_id, system_id, scale_factor in cur.fetchall():
+            by_entity['sensor'][sensor_id] = [sensor_id]
+            by_entity['area'].setdefault(area_id, []).append(sensor_id)
+            by_entity['system'].setdefault(system_id, []).append(sensor_id)
+            scale_factors[sensor_id] = scale_factor or 1
+        cur.execute("""
+            SELECT l.label_name, la.entity_type, la.entity_id
+            FROM label_assignment la JOIN label l ON l.label_id = la.label_id
+            WHERE la.entity_type IN ('sensor', 'area', 'system')
+        """)
+        members = {}
+        for label_name, entity_type, entity_id in cur.fetchall():
+            members.setdefault(label_name, []).extend(by_entity[entity_type].get(entity_id, ()))
+        self.sensors_by_label = {label_name: np.unique(np.array(ids, dtype=np.int64)) for label_name, ids in members.items()}
+        self.scale_factors = scale_factors
+        self.version = version
+        return True
+
+    def sensor_ids(self, labels, match='any'):
+        """Sorted sensor ids behind any (union) or all (intersection) of the labels, unknown labels match nothing."""
+        if isinstance(labels, str):
+            labels = [labels]
+        arrays = [self.sensors_by_label.get(label, EMPTY_IDS) for label in labels]
+        if not arrays:
+            return EMPTY_IDS
+        if match == 'all':
+            result = arrays[0]
+            for ids in arrays[1:]:
+                result = np.intersect1d(result, ids, assume_unique=True)
+            return result
+        return np.unique(np.concatenate(arrays))
+
+class LabelQuery:
+    """Label based reading queries over one connection, sharing one LabelIndex."""
+
+    def __init__(self, conn, index=None):
+        self.conn = conn
+        self.index = index or LabelIndex()
+
+    def sensor_ids(self, labels, match='any'):
+        with self.conn.cursor() as cur:
+            self.index.refresh(cur)
+        self.conn.commit()
+        return self.index.sensor_ids(labels, match)
+
+    def fetch(self, labels, start, end=None, source='raw', match='any', engineering_units=False):
+        """
+        Readings of the sensors behind the labels with start <= time < end (end defaults to now), as a SensorSeries.
+
+        source is raw (sensor_datum) or one of the second / minute / hour rollup views. With
+        engineering_units the stored integer values are divided by their sensor type's scale_factor.
+        """
+        if source not in SOURCES:
+            raise ValueError(f"Unknown source {source!r}, use one of {', '.join(SOURCES)}")
+        end = end or datetime.now(timezone.utc)
+        with self.conn.cursor() as cur:
+            self.index.refresh(cur)
+            sensor_ids = self.index.sensor_ids(labels, match)
+            if sensor_ids.size == 0:
+                series = empty_series()
+            else:
+                # Epoch microseconds keep the COPY output all integers, parsed by NumPy in one call
+                query = cur.mogrify(f"""
+                    COPY (
+                        SELECT (extract(epoch FROM time) * 1000000)::BIGINT, sensor_id, value
+                        FROM {SOURCES[source]}
+                        WHERE sensor_id = ANY(%s) AND time >= %s AND time < %s AND value IS NOT NULL
+                        ORDER BY sensor_id, time
+                    ) TO STDOUT
+                """, (sensor_ids.tolist(), start, end)).decode()
+                buffer = io.StringIO()
+                cur.copy_expert(query, buffer)
+                series = parse_copy_text(buffer.getvalue())
+        self.conn.commit()
+        if engineering_units and len(series):
+            scale = np.array([self.index.scale_factors.get(sensor_id, 1) for sensor_id in sensor_ids.tolist()], dtype=np.float64)
+            series.value = series.value / scale[np.searchsorted(sensor_ids, series.sensor_id)]
+        return series
+
+def empty_series():
+    return SensorSeries(np.empty(0, dtype='datetime64[us]'), EMPTY_IDS, np.empty(0, dtype=np.int64))
+
+def parse_copy_text(text):
+    """SensorSeries from COPY text output of (epoch microseconds, sensor_id, value) rows."""
+    if not text:
+        return empty_series()
+    values = np.fromstring(text, dtype=np.int64, sep=' ').reshape(-1, 3)
+    return SensorSeries(values[:, 0].astype('datetime64[us]'), values[:, 1].copy(), values[:, 2].copy())
+
+def main():
+    parser = argparse.ArgumentParser(description='Fetch the readings of every sensor behind one or more labels.')
+    parser.add_argument('labels', nargs='+', help='Label names; sensors labeled directly or through their area or system.')
+    parser.add_argument('--dbname', default=DB_NAME, help='Database to query (default aquaponics_db).')
+    parser.add_argument('--hours', type=float, default=24.0, help='Hours of readings up to now (default 24).')
+    parser.add_argument('--source', choices=list(SOURCES), default='raw', help='sensor_datum or a rollup view (default raw).')
+    parser.add_argument('--all', action='store_true', help='Only sensors carrying every label, instead of any of them.')
+    parser.add_argument('--engineering-units', action='store_true', help="Divide values by their sensor type's scale_factor.")
+    args = parser.parse_args()
+
+    conn = connect(dbname=args.dbname)
+    try:
+        query = LabelQuery(conn)
+        end = datetime.now(timezone.utc)
+        started = time.perf_counter()
+        series = query.fetch(args.labels, end - timedelta(hours=args.hours), end, args.source,
+                             'all' if args.all else 'any', args.engineering_units)
+        elapsed = time.perf_counter() - started
+        sensor_ids = query.index.sensor_ids(args.labels, 'all' if args.all else 'any')
+        print(f'{len(sensor_ids)} sensors, {len(series)} readings from {SOURCES[args.source]} in {elapsed * 1000:.1f} ms')
+        for sensor_id in sensor_ids.tolist():
+            times, values = series.for_sensor(sensor_id)
+            if len(values):
+                print(f'  sensor {sensor_id}: {len(values)} readings, last {values[-1]} at {times[-1]}, '
+                      f'min {values.min()}, max {values.max()}, mean {values.mean():.2f}')
+            else:
+                print(f'  sensor {sensor_id}: no readings')
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
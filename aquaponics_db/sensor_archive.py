@@ -0,0 +1,446 @@
+"""
+MIT License Notice
+Copyright (c) 2024 Jeremy D. Gerdes <seakintruth@gmail.com>
+See full license in the repository.
+
+Archive tier of sensor_datum: export old chunks to files per sensor and month, and read them back.
+
+The exporter takes the sensor_datum chunks that end before now() - archive_after
+(08_setup_sensor_retention.pgsql, or --older-than-days), oldest first, and for each one:
+locks the chunk against writes, streams its readings out with one COPY ordered by (sensor_id, time),
+writes them as
+
+    <root>/sensor_id=<id>/month=<YYYY-MM>/<chunk name>.parquet
+
+(columns time as timestamp[us, UTC] and value as int32, the stored value), records the chunk in
+sensor_datum_archive and in <root>/_manifest.json, drops it with drop_chunks() and commits. The COPY
+output is parsed in fixed size batches and only one file is open at a time, so memory stays bounded
+by one sensor's readings of one chunk, whatever the size of the chunk. Readings with a NULL value are
+not exported. Without pyarrow the files are compressed NumPy .npz files with time (epoch
+microseconds) and value arrays instead.
+
+Readings written late into an archived range land in a new chunk, which the next export picks up
+like any other chunk ending before the cutoff. Until then they are only in the database, so
+ArchiveReader reads the files of the dropped chunks and, with a connection, sensor_datum over the
+whole requested range (chunk exclusion keeps the archived part of that scan cheap), and returns the
+union as one label_query.SensorSeries; without a connection it returns the files only. The
+directory layout is Hive partitioning, so pyarrow.dataset, DuckDB or Spark can also read the archive
+directly.
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import psycopg2
+from psycopg2 import sql
+
+from db_connection import DB_NAME, connect
+from deadband_compressor import to_microseconds
+from label_query import SensorSeries, empty_series, parse_copy_text
+
+MANIFEST_FILE = '_manifest.json'
+# COPY text parsed per batch, and rows buffered per Parquet row group
+BATCH_BYTES = 8 * 1024 * 1024
+ROW_GROUP_ROWS = 1000000
+
+def have_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def default_format():
+    return 'parquet' if have_pyarrow() else 'npz'
+
+def partition_dir(root, sensor_id, month):
+    """Directory of one sensor's readings of one month (month as YYYY-MM)."""
+    return os.path.join(root, f'sensor_id={sensor_id}', f'month={month}')
+
+def months_of(times_us):
+    """YYYY-MM month of every epoch microsecond time, as numpy datetime64[M]."""
+    return times_us.astype('datetime64[us]').astype('datetime64[M]')
+
+class PartitionWriter:
+    """Writes the readings of one chunk, one (sensor, month) file at a time, as .part files renamed on close."""
+
+    def __init__(self, root, file_format, file_stem):
+        if file_format == 'parquet' and not have_pyarrow():
+            raise ImportError('Parquet files need pyarrow: pip install pyarrow, or use --format npz')
+        self.root = root
+        self.file_format = file_format
+        self.file_stem = file_stem
+        self.files = []
+        self.rows = 0
+        self._key = None
+        self._times = []
+        self._values = []
+        self._buffered = 0
+        self._parquet = None
+
+    def _path(self, key):
+        return os.path.join(partition_dir(self.root, *key), f'{self.file_stem}.{self.file_format}')
+
+    def write(self, sensor_id, month, times_us, values):
+        """Append readings of one sensor and month, in time order; a new key closes the previous file."""
+        key = (sensor_id, month)
+        if key != self._key:
+            self._close_file()
+            self._key = key
+            os.makedirs(partition_dir(self.root, *key), exist_ok=True)
+        self._times.append(times_us)
+        self._values.append(values)
+        self._buffered += len(times_us)
+        self.rows += len(times_us)
+        if self.file_format == 'parquet' and self._buffered >= ROW_GROUP_ROWS:
+            self._write_row_group()
+
+    def _write_row_group(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.table({'time': pa.array(np.concatenate(self._times), type=pa.timestamp('us', tz='UTC')),
+                          'value': pa.array(np.concatenate(self._values), type=pa.int32())})
+        if self._parquet is None:
+            self._parquet = pq.ParquetWriter(self._path(self._key) + '.part', table.schema, compression='zstd')
+        self._parquet.write_table(table)
+        self._times, self._values, self._buffered = [], [], 0
+
+    def _close_file(self):
+        if self._key is None:
+            return
+        path = self._path(self._key)
+        if self.file_format == 'parquet':
+            if self._buffered:
+                self._write_row_group()
+            self._parquet.close()
+            self._parquet = None
+        else:
+            with open(path + '.part', 'wb') as file:
+                np.savez_compressed(file, time=np.concatenate(self._times), value=np.concatenate(self._values))
+            self._times, self._values, self._buffered = [], [], 0
+        os.replace(path + '.part', path)
+        self.files.append(path)
+        self._key = None
+
+    def close(self):
+        self._close_file()
+
+    def discard(self):
+        """Remove every file of this chunk written so far, after a failed export."""
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+        if self._key is not None:
+            self.files.append(self._path(self._key) + '.part')
+            self._key = None
+        for path in self.files:
+            if os.path.exists(path):
+                os.remove(path)
+        self.files = []
+
+class CopyToPartitions(io.TextIOBase):
+    """File object for copy_expert(COPY ... TO STDOUT) that parses the rows in batches into a PartitionWriter."""
+
+    def __init__(self, writer, batch_bytes=BATCH_BYTES):
+        self.writer = writer
+        self.batch_bytes = batch_bytes
+        self._parts = []
+        self._size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode()
+        self._parts.append(data)
+        self._size += len(data)
+        if self._size >= self.batch_bytes:
+            text = ''.join(self._parts)
+            cut = text.rfind('\n') + 1
+            self._parts = [text[cut:]]
+            self._size = len(self._parts[0])
+            self._dispatch(text[:cut])
+        return len(data)
+
+    def finish(self):
+        self._dispatch(''.join(self._parts))
+        self._parts, self._size = [], 0
+
+    def _dispatch(self, text):
+        series = parse_copy_text(text)
+        if not len(series):
+            return
+        times_us = series.time.astype(np.int64)
+        months = months_of(times_us)
+        # Rows arrive ordered by (sensor_id, time), so every (sensor, month) is one contiguous run
+        breaks = np.flatnonzero((series.sensor_id[1:] != series.sensor_id[:-1]) | (months[1:] != months[:-1])) + 1
+        for start, end in zip(np.r_[0, breaks].tolist(), np.r_[breaks, len(times_us)].tolist()):
+            self.writer.write(int(series.sensor_id[start]), str(months[start]), times_us[start:end], series.value[start:end])
+
+def read_manifest(root):
+    path = os.path.join(root, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'archived_until': None, 'chunks': []}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def write_manifest(root, manifest):
+    """Replace the manifest atomically, so a reader never sees a half written one."""
+    path = os.path.join(root, MANIFEST_FILE)
+    with open(path + '.part', 'w') as file:
+        json.dump(manifest, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + '.part', path)
+
+def archive_cutoff(cur, older_than_days=None):
+    """Chunks ending before this time are archived: now() - archive_after, or --older-than-days."""
+    if older_than_days is not None:
+        cur.execute("SELECT now() - %s * interval '1 day'", (older_than_days,))
+    else:
+        cur.execute("SELECT now() - archive_after FROM sensor_datum_retention WHERE state_id = 1")
+    return cur.fetchone()[0]
+
+def chunks_to_archive(cur, cutoff):
+    """(schema, chunk name, range start, range end) of the sensor_datum chunks ending by cutoff, oldest first."""
+    cur.execute("""
+        SELECT chunk_schema, chunk_name, range_start, range_end
+        FROM timescaledb_information.chunks
+        WHERE hypertable_name = 'sensor_datum' AND range_end <= %s
+        ORDER BY range_start
+    """, (cutoff,))
+    return cur.fetchall()
+
+def export_chunk(conn, root, chunk, file_format, drop=True):
+    """Export one chunk to partition files, record it, drop it and commit; returns (rows, files)."""
+    chunk_schema, chunk_name, range_start, range_end = chunk
+    chunk_table = sql.Identifier(chunk_schema, chunk_name)
+    writer = PartitionWriter(root, file_format, chunk_name)
+    try:
+        with conn.cursor() as cur:
+            # Late writes into the chunk wait until it is dropped instead of being lost with it
+            cur.execute(sql.SQL("LOCK TABLE {} IN SHARE MODE").format(chunk_table))
+            stream = CopyToPartitions(writer)
+            cur.copy_expert(sql.SQL("""
+                COPY (
+                    SELECT (extract(epoch FROM time) * 1000000)::BIGINT, sensor_id, value
+                    FROM {}
+                    WHERE value IS NOT NULL
+                    ORDER BY sensor_id, time
+                ) TO STDOUT
+            """).format(chunk_table).as_string(conn), stream)
+            stream.finish()
+            writer.close()
+            cur.execute("""
+                INSERT INTO sensor_datum_archive (chunk_name, range_start, range_end, rows_exported, files_written, archive_path, file_format)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (chunk_name) DO UPDATE SET
+                    rows_exported = EXCLUDED.rows_exported, files_written = EXCLUDED.files_written,
+                    archive_path = EXCLUDED.archive_path, file_format = EXCLUDED.file_format, exported_at = now()
+            """, (chunk_name, range_start, range_end, writer.rows, len(writer.files), os.path.abspath(root), file_format))
+            # The files are complete before the manifest claims them, and claimed before the rows are dropped
+            manifest = read_manifest(root)
+            manifest['chunks'] = [entry for entry in manifest['chunks'] if entry['chunk_name'] != chunk_name]
+            manifest['chunks'].append({'chunk_name': chunk_name, 'range_start': range_start.isoformat(),
+                                       'range_end': range_end.isoformat(), 'rows': writer.rows,
+                                       'files': len(writer.files), 'file_format': file_format, 'dropped': drop})
+            dropped = [datetime.fromisoformat(entry['range_end']) for entry in manifest['chunks'] if entry.get('dropped')]
+            # Chunks written with --keep can still change in the database, they don't move archived_until
+            manifest['archived_until'] = max(dropped).isoformat() if dropped else None
+            write_manifest(root, manifest)
+            if drop:
+                cur.execute("SELECT drop_chunks('sensor_datum', older_than => %s, newer_than => %s)", (range_end, range_start))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        writer.discard()
+        raise
+    return writer.rows, len(writer.files)
+
+def export_archive(conn, root, file_format, older_than_days=None, max_chunks=None, drop=True, dry_run=False):
+    """Export (and drop) every chunk due for the archive, oldest first, stopping at the first failure."""
+    os.makedirs(root, exist_ok=True)
+    with conn.cursor() as cur:
+        cutoff = archive_cutoff(cur, older_than_days)
+        chunks = chunks_to_archive(cur, cutoff)
+    conn.commit()
+    if max_chunks is not None:
+        chunks = chunks[:max_chunks]
+    print(f'{len(chunks)} chunks end before {cutoff:%Y-%m-%d %H:%M %Z}')
+    total_rows = 0
+    for chunk in chunks:
+        label = f'{chunk[1]} {chunk[2]:%Y-%m-%d} -> {chunk[3]:%Y-%m-%d}'
+        if dry_run:
+            print(f'  would export {label}')
+            continue
+        started = time.perf_counter()
+        rows, files = export_chunk(conn, root, chunk, file_format, drop)
+        elapsed = time.perf_counter() - started
+        total_rows += rows
+        print(f"  {label}: {rows:,} rows in {files} files, {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)"
+              f"{', dropped' if drop else ''}")
+    return total_rows
+
+class ArchiveReader:
+    """Reads sensor readings from the files of the dropped chunks and from sensor_datum."""
+
+    def __init__(self, root, conn=None):
+        self.root = root
+        self.conn = conn
+        self.reload()
+
+    def reload(self):
+        """Re-read the manifest, after an export has moved archived_until."""
+        self.manifest = read_manifest(self.root)
+        until = self.manifest.get('archived_until')
+        self.archived_until = datetime.fromisoformat(until) if until else None
+        # Files of chunks exported with --keep duplicate rows that are still in the database
+        self.dropped_chunks = {entry['chunk_name'] for entry in self.manifest['chunks'] if entry.get('dropped')}
+
+    def _read_file(self, path):
+        if path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            table = pq.read_table(path, columns=['time', 'value'])
+            times = table.column('time').to_numpy().astype('datetime64[us]').astype(np.int64)
+            return times, table.column('value').to_numpy().astype(np.int64)
+        with np.load(path) as data:
+            return data['time'], data['value'].astype(np.int64)
+
+    def read_archive(self, sensor_ids, start, end):
+        """Archived readings of the sensors with start <= time < end, as a SensorSeries."""
+        start_us, end_us = to_microseconds(start), to_microseconds(end)
+        months = np.arange(np.datetime64(start_us, 'us').astype('datetime64[M]'),
+                           np.datetime64(end_us - 1, 'us').astype('datetime64[M]') + 1)
+        times, ids, values = [], [], []
+        for sensor_id in sorted(set(int(sensor_id) for sensor_id in sensor_ids)):
+            for month in months:
+                for path in sorted(glob.glob(os.path.join(partition_dir(self.root, sensor_id, str(month)), '*.*'))):
+                    if path.endswith('.part') or os.path.basename(path).rsplit('.', 1)[0] not in self.dropped_chunks:
+                        continue
+                    file_times, file_values = self._read_file(path)
+                    keep = (file_times >= start_us) & (file_times < end_us)
+                    times.append(file_times[keep])
+                    values.append(file_values[keep])
+                    ids.append(np.full(int(keep.sum()), sensor_id, dtype=np.int64))
+        if not times:
+            return empty_series()
+        return sort_series(np.concatenate(times), np.concatenate(ids), np.concatenate(values))
+
+    def read_live(self, sensor_ids, start, end):
+        """Readings of the sensors still in sensor_datum with start <= time < end, as a SensorSeries."""
+        with self.conn.cursor() as cur:
+            query = cur.mogrify("""
+                COPY (
+                    SELECT (extract(epoch FROM time) * 1000000)::BIGINT, sensor_id, value
+                    FROM sensor_datum
+                    WHERE sensor_id = ANY(%s) AND time >= %s AND time < %s AND value IS NOT NULL
+                    ORDER BY sensor_id, time
+                ) TO STDOUT
+            """, ([int(sensor_id) for sensor_id in sensor_ids], start, end)).decode()
+            buffer = io.StringIO()
+            cur.copy_expert(query, buffer)
+        self.conn.commit()
+        return parse_copy_text(buffer.getvalue())
+
+    def fetch(self, sensor_ids, start, end=None):
+        """
+        Readings of the sensors with start <= time < end (end defaults to now), ordered by (sensor_id, time).
+
+        The files cover the range up to archived_until and sensor_datum is read over the whole range, for
+        chunks created inside the archived range after it was exported; without a connection only the
+        archived part is returned. A reading found in both, while an export is dropping its chunk, is
+        returned once.
+        """
+        end = end or datetime.now(timezone.utc)
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+        parts = []
+        if self.archived_until is not None and start < self.archived_until:
+            parts.append(self.read_archive(sensor_ids, start, min(end, self.archived_until)))
+        if self.conn is not None and start < end:
+            parts.append(self.read_live(sensor_ids, start, end))
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return empty_series()
+        if len(parts) == 1:
+            return parts[0]
+        return sort_series(np.concatenate([part.time.astype(np.int64) for part in parts]),
+                           np.concatenate([part.sensor_id for part in parts]),
+                           np.concatenate([part.value for part in parts]), unique=True)
+
+def sort_series(times_us, sensor_ids, values, unique=False):
+    """SensorSeries ordered by (sensor_id, time); unique keeps one reading per (sensor_id, time)."""
+    order = np.lexsort((times_us, sensor_ids))
+    times_us, sensor_ids, values = times_us[order], sensor_ids[order], values[order]
+    if unique and len(times_us):
+        keep = np.r_[True, (times_us[1:] != times_us[:-1]) | (sensor_ids[1:] != sensor_ids[:-1])]
+        times_us, sensor_ids, values = times_us[keep], sensor_ids[keep], values[keep]
+    return SensorSeries(times_us.astype('datetime64[us]'), sensor_ids, values)
+
+def parse_timestamp(text):
+    moment = datetime.fromisoformat(text)
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+def main():
+    parser = argparse.ArgumentParser(description='Export old sensor_datum chunks to Parquet files per sensor and month, or read them back.')
+    parser.add_argument('--dbname', default=DB_NAME, help='Database to archive from or read live data from (default aquaponics_db).')
+    parser.add_argument('--root', required=True, help='Archive directory.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='Export the chunks older than archive_after and drop them.')
+    export.add_argument('--older-than-days', type=float, default=None,
+                        help='Archive chunks ending before this many days ago (default archive_after of sensor_datum_retention).')
+    export.add_argument('--format', choices=['parquet', 'npz'], default=None,
+                        help='File format (default parquet when pyarrow is installed, npz otherwise).')
+    export.add_argument('--max-chunks', type=int, default=None, help='Export at most this many chunks in this run.')
+    export.add_argument('--keep', action='store_true', help='Write the files but keep the chunks in the database.')
+    export.add_argument('--dry-run', action='store_true', help='Only list the chunks that would be exported.')
+    read = commands.add_parser('read', help='Summarize readings from the archive and the live table.')
+    read.add_argument('sensor_ids', type=int, nargs='+', help='Sensors to read.')
+    read.add_argument('--since', type=parse_timestamp, required=True, help='Start of the range, ISO format (naive is UTC).')
+    read.add_argument('--until', type=parse_timestamp, default=None, help='End of the range, ISO format (default now).')
+    read.add_argument('--archive-only', action='store_true', help='Do not connect to the database, read the files only.')
+    args = parser.parse_args()
+
+    if args.command == 'read' and args.archive_only:
+        conn = None
+    else:
+        conn = connect(dbname=args.dbname)
+    try:
+        if args.command == 'export':
+            file_format = args.format or default_format()
+            total = export_archive(conn, args.root, file_format, args.older_than_days, args.max_chunks,
+                                   drop=not args.keep, dry_run=args.dry_run)
+            print(f'{total:,} readings archived to {args.root} as {file_format}')
+        else:
+            reader = ArchiveReader(args.root, conn)
+            started = time.perf_counter()
+            series = reader.fetch(args.sensor_ids, args.since, args.until)
+            elapsed = time.perf_counter() - started
+            until = reader.archived_until.isoformat() if reader.archived_until else 'nothing archived'
+            print(f'{len(series)} readings in {elapsed * 1000:.1f} ms (archived until {until})')
+            for sensor_id in args.sensor_ids:
+                times, values = series.for_sensor(sensor_id)
+                if len(values):
+                    print(f'  sensor {sensor_id}: {len(values)} readings from {times[0]} to {times[-1]}, '
+                          f'min {values.min()}, max {values.max()}, mean {values.mean():.2f}')
+                else:
+                    print(f'  sensor {sensor_id}: no readings')
+    except psycopg2.Error as e:
+        print(f'Archive {args.command} failed: {e}', file=sys.stderr)
+        return 1
+    finally:
+        if conn is not None:
+            conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+MIT License Notice
+Copyright (c) 2024 Jeremy D. Gerdes <seakintruth@gmail.com>
+See full license in the repository.
+
+Dry-run reporter for the sensor_data_cleanup job in 02_setup_pg_cron_jobs.pgsql.
+
+Runs sensor_data_cleanup_range(..., p_dry_run => TRUE) over the chunk ranges the next hourly run would
+compact (or over --since/--until) and reports the rows that would be kept and dropped per sensor and
+the elapsed time per chunk. Nothing is deleted and the job's high-water mark is left alone.
+"""
+import argparse
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from db_connection import connect
+
+def parse_timestamp(text):
+    return datetime.fromisoformat(text)
+
+def main():
+    parser = argparse.ArgumentParser(description='Dry-run the sensor_data_cleanup deadband compaction and report what it would drop.')
+    parser.add_argument('--dbname', default=None, help='Database to inspect (default aquaponics_db).')
+    parser.add_argument('--since', type=parse_timestamp, default=None,
+                        help='Start of the range to report on, ISO format (default: where the last cleanup run stopped).')
+    parser.add_argument('--until', type=parse_timestamp, default=None,
+                        help='End of the range to report on, ISO format (default: the last complete hour).')
+    args = parser.parse_args()
+
+    conn = connect(dbname=args.dbname) if args.dbname else connect()
+    per_sensor = defaultdict(lambda: [0, 0])
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT range_from, range_to FROM sensor_data_cleanup_ranges(%s, %s)", (args.until, args.since))
+            ranges = cur.fetchall()
+            if not ranges:
+                print('No chunk ranges are pending cleanup.')
+                return 0
+            print(f"{'chunk range':<36} {'kept':>12} {'dropped':>12} {'dropped %':>9} {'seconds':>9}")
+            for range_from, range_to in ranges:
+                started = time.perf_counter()
+                cur.execute("SELECT sensor_id, rows_kept, rows_dropped FROM sensor_data_cleanup_range(%s, %s, TRUE)",
+                            (range_from, range_to))
+                rows = cur.fetchall()
+                elapsed = time.perf_counter() - started
+                kept = sum(row[1] for row in rows)
+                dropped = sum(row[2] for row in rows)
+                for sensor_id, sensor_kept, sensor_dropped in rows:
+                    per_sensor[sensor_id][0] += sensor_kept
+                    per_sensor[sensor_id][1] += sensor_dropped
+                share = dropped * 100.0 / (kept + dropped) if kept + dropped else 0.0
+                label = f"{range_from:%Y-%m-%d %H:%M} -> {range_to:%Y-%m-%d %H:%M}"
+                print(f"{label:<36} {kept:>12,} {dropped:>12,} {share:>8.1f}% {elapsed:>9.3f}")
+        # Dry run only, never keep anything the functions did
+        conn.rollback()
+    finally:
+        conn.close()
+
+    print()
+    print(f"{'sensor_id':>9} {'kept':>12} {'dropped':>12} {'dropped %':>9}")
+    for sensor_id in sorted(per_sensor):
+        kept, dropped = per_sensor[sensor_id]
+        share = dropped * 100.0 / (kept + dropped) if kept + dropped else 0.0
+        print(f"{sensor_id:>9} {kept:>12,} {dropped:>12,} {share:>8.1f}%")
+    total_kept = sum(kept for kept, _ in per_sensor.values())
+    total_dropped = sum(dropped for _, dropped in per_sensor.values())
+    print(f"{'total':>9} {total_kept:>12,} {total_dropped:>12,}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
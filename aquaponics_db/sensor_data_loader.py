@@ -0,0 +1,169 @@
+"""
+MIT License Notice
+Copyright (c) 2024 Jeremy D. Gerdes <seakintruth@gmail.com>
+See full license in the repository.
+
+COPY based sensor_datum loaders, single connection and multi-process.
+
+The parallel loader splits the requested time range at TimescaleDB chunk boundaries and the sensors
+into groups, so every worker process owns a disjoint (sensors, time range) slice and its own
+connection. Each slice commits on its own; worker failures are collected and raised together once
+every slice has finished instead of being printed and skipped. The phase of every sensor and its
+drift at each chunk boundary are drawn once before the slices are handed out, so the series a sensor
+gets from its slices is continuous across chunks.
+"""
+import io
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+from db_connection import connect
+from deadband_compressor import DeadbandCompressor
+from sensor_reading_generator import draw_series_state, generate_reading_batches, batch_to_copy_text
+
+COPY_SQL = "COPY sensor_datum (time, sensor_id, value) FROM STDIN"
+# TimescaleDB default chunk_time_interval, used when the hypertable can't be inspected
+DEFAULT_CHUNK_INTERVAL = timedelta(days=7)
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# A disjoint piece of work: num_steps readings of each sensor in the group starting at start, step first_step of the load
+LoadSlice = namedtuple('LoadSlice', ['slice_id', 'sensors', 'start', 'first_step', 'num_steps'])
+
+class SensorLoadError(Exception):
+    """Raised when one or more slices of a parallel load failed."""
+
+def copy_sensor_data(cur, batches, chunk_size):
+    """Stream generated sensor_datum batches into the table with COPY, one COPY per batch."""
+    total = 0
+    started = time.perf_counter()
+    for batch in batches:
+        cur.copy_expert(COPY_SQL, io.StringIO(batch_to_copy_text(*batch)))
+        total += len(batch[0])
+    elapsed = time.perf_counter() - started
+    print(f'Copied {total} sensor_datum rows in {elapsed:.2f}s '
+          f'({total / max(elapsed, 1e-9):,.0f} rows/sec, chunk size {chunk_size})')
+    return total, elapsed
+
+def get_chunk_interval(cur, table_name='sensor_datum'):
+    """Return the chunk_time_interval of a hypertable, falling back to the TimescaleDB default."""
+    cur.execute("""
+        SELECT time_interval
+        FROM timescaledb_information.dimensions
+        WHERE hypertable_name = %s AND dimension_type = 'Time'
+    """, (table_name,))
+    row = cur.fetchone()
+    return row[0] if row and row[0] else DEFAULT_CHUNK_INTERVAL
+
+def plan_slices(sensors, start, interval_seconds, num_steps, chunk_interval, sensor_groups=1):
+    """
+    Split num_steps readings of every sensor into slices that never cross a chunk boundary.
+
+    Time is cut where TimescaleDB cuts chunks (multiples of chunk_interval since the epoch) and the
+    sensors are cut into sensor_groups contiguous groups; every (group, time range) pair is a slice.
+    """
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    step_us = int(interval_seconds * 1000000)
+    chunk_us = int(chunk_interval.total_seconds() * 1000000)
+    offset_us = (start - EPOCH) // timedelta(microseconds=1)
+
+    step_ranges = []
+    first = 0
+    while first < num_steps:
+        next_boundary_us = (((offset_us + first * step_us) // chunk_us) + 1) * chunk_us
+        last = min(num_steps, max(first + 1, -(-(next_boundary_us - offset_us) // step_us)))
+        step_ranges.append((first, last))
+        first = last
+
+    sensor_groups = max(1, min(sensor_groups, len(sensors)))
+    group_size = -(-len(sensors) // sensor_groups)
+    groups = [sensors[i:i + group_size] for i in range(0, len(sensors), group_size)]
+
+    slices = []
+    for first, last in step_ranges:
+        for group in groups:
+            slice_start = start + timedelta(microseconds=first * step_us)
+            slices.append(LoadSlice(len(slices), group, slice_start, first, last - first))
+    return slices
+
+def copy_slice(work, interval_seconds, batch_rows, seed, thresholds=None, state=None):
+    """
+    Worker: COPY one slice through its own connection and return (slice_id, rows, elapsed).
+
+    state is (phase, drift_start, drift_end) of the slice's sensors, see draw_series_state.
+    With thresholds ({sensor_id: capture_after_delta_percent}) readings inside the deadband are dropped
+    before they are sent; each slice starts with an empty deadband cache.
+    """
+    started = time.perf_counter()
+    batch_steps = max(1, batch_rows // max(len(work.sensors), 1))
+    rows = 0
+    phase, drift_start, drift_end = state if state is not None else (None, None, None)
+    batches = generate_reading_batches(work.sensors, work.start, interval_seconds, work.num_steps,
+                                       batch_steps=batch_steps, seed=seed,
+                                       phase=phase, drift_start=drift_start, drift_end=drift_end)
+    if thresholds is not None:
+        batches = DeadbandCompressor(thresholds).compress_batches(batches)
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            for batch in batches:
+                cur.copy_expert(COPY_SQL, io.StringIO(batch_to_copy_text(*batch)))
+                rows += len(batch[0])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return work.slice_id, rows, time.perf_counter() - started
+
+def load_sensor_data_parallel(sensors, start, interval_seconds, num_steps, chunk_interval,
+                              workers, sensor_groups=1, batch_rows=100000, seed=None, thresholds=None):
+    """
+    Load sensor_datum with a pool of worker processes, each slice copied through its own connection.
+
+    The reference tables (sensor, sensor_type, ...) must already be committed, since workers run in
+    their own transactions. Returns (rows, elapsed) or raises SensorLoadError listing every failed slice.
+    """
+    slices = plan_slices(sensors, start, interval_seconds, num_steps, chunk_interval, sensor_groups)
+    boundaries = sorted({s.first_step for s in slices} | {num_steps})
+    phase, drift = draw_series_state(sensors, interval_seconds, boundaries, seed)
+    boundary_row = {step: row for row, step in enumerate(boundaries)}
+    sensor_column = {sensor.sensor_id: column for column, sensor in enumerate(sensors)}
+
+    def slice_state(s):
+        columns = [sensor_column[sensor.sensor_id] for sensor in s.sensors]
+        row = boundary_row[s.first_step]
+        return phase[columns], drift[row, columns], drift[row + 1, columns]
+
+    print(f'Loading {len(slices)} slices of sensor_datum with {workers} workers '
+          f'(chunk interval {chunk_interval}, {sensor_groups} sensor group(s))')
+    total = 0
+    failures = []
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(copy_slice, s, interval_seconds, batch_rows, None if seed is None else [seed, s.slice_id],
+                        thresholds, slice_state(s)): s
+            for s in slices
+        }
+        for future in as_completed(futures):
+            s = futures[future]
+            try:
+                _, rows, elapsed = future.result()
+            except Exception as e:
+                failures.append((s, e))
+                continue
+            total += rows
+            print(f'  slice {s.slice_id}: {rows} rows from {s.start:%Y-%m-%d %H:%M} '
+                  f'for sensors {s.sensors[0].sensor_id}-{s.sensors[-1].sensor_id} in {elapsed:.2f}s')
+    elapsed = time.perf_counter() - started
+    print(f'Copied {total} sensor_datum rows in {elapsed:.2f}s ({total / max(elapsed, 1e-9):,.0f} rows/sec)')
+    if failures:
+        details = '; '.join(
+            f'slice {s.slice_id} ({s.start:%Y-%m-%d %H:%M}, sensors {s.sensors[0].sensor_id}-{s.sensors[-1].sensor_id}): {e}'
+            for s, e in sorted(failures, key=lambda failure: failure[0].slice_id)
+        )
+        raise SensorLoadError(f'{len(failures)} of {len(slices)} slices failed: {details}')
+    return total, elapsed
@@ -0,0 +1,531 @@
+"""
+MIT License Notice
+Copyright (c) 2024 Jeremy D. Gerdes <seakintruth@gmail.com>
+See full license in the repository.
+
+Asyncio ingest daemon for live sensor_datum writes.
+
+Sensors (or the gateways in front of them) send one reading per line over a local TCP or unix socket:
+
+    sensor_id,value[,time]
+
+value is in engineering units and is stored as round(value * scale_factor) of the sensor's
+sensor_type, time is ISO 8601 (naive times are UTC) and defaults to the time the line arrived.
+Readings of unknown sensors are answered with "ERR ..." and dropped; the sensor list is reloaded from
+the sensor / sensor_type tables when an unknown sensor_id shows up, at most once per --catalog-refresh
+seconds. With --alerts every accepted reading is also checked against alert_rule as it arrives
+(alert_evaluator.py) and the alerts raised are written to systemwide_alert every --alert-interval
+seconds. A line holding just STATS is answered with the metrics as one line of JSON. With --http-port
+the same readings can be POSTed to /readings and the metrics fetched from GET /metrics.
+
+Readings go through a bounded queue and are micro-batched until --batch-rows readings or
+--max-latency-ms after the first reading of the batch, whichever comes first, and every batch is
+written with one COPY on a connection from a small pool. When every pool connection is busy the
+batcher waits, the queue fills and the socket handlers stop reading, so a slow database pushes back
+on the senders through TCP flow control instead of growing memory. Batches that fail on a lost
+connection are retried with backoff; a batch holding readings that are already stored is written
+again through a staging table with ON CONFLICT DO NOTHING.
+
+Run ingest_load_generator.py against it to size the batch, latency and pool settings.
+"""
+import argparse
+import asyncio
+import io
+import json
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+import psycopg2.errors
+
+from alert_evaluator import RuleSource, write_alerts
+from db_connection import DB_NAME, create_pool
+from deadband_compressor import DeadbandCompressor, load_thresholds, to_microseconds
+
+COPY_SQL = "COPY sensor_datum (time, sensor_id, value) FROM STDIN"
+STAGING_COPY_SQL = "COPY ingest_staging (time, sensor_id, value) FROM STDIN"
+# Retry delays after a lost connection, doubling up to the maximum
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30.0
+# Flushes kept for the batch size and flush latency percentiles
+METRICS_WINDOW = 1000
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sequence, 0.0 when it is empty."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def parse_time(text):
+    """Parse an ISO 8601 reading time, naive values are taken as UTC."""
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    moment = datetime.fromisoformat(text)
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+def readings_to_copy_text(readings):
+    """Format (time, sensor_id, value) tuples as tab separated text for COPY."""
+    return ''.join(f'{moment.isoformat()}\t{sensor_id}\t{value}\n' for moment, sensor_id, value in readings)
+
+class IngestMetrics:
+    """Counters and recent flush statistics of the ingest service."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.readings_received = 0
+        self.readings_rejected = 0
+        self.readings_written = 0
+        self.readings_duplicate = 0
+        self.readings_failed = 0
+        self.batches_written = 0
+        self.write_retries = 0
+        self.backpressure_waits = 0
+        self.alerts_written = 0
+        self.queue_high_water = 0
+        self.batch_rows = deque(maxlen=METRICS_WINDOW)
+        self.flush_seconds = deque(maxlen=METRICS_WINDOW)
+
+    def record_flush(self, rows, written, seconds):
+        self.batches_written += 1
+        self.readings_written += written
+        self.batch_rows.append(rows)
+        self.flush_seconds.append(seconds)
+
+    def snapshot(self, queue_depth, queue_size, flushes_in_flight):
+        uptime = time.monotonic() - self.started
+        return {
+            'uptime_seconds': round(uptime, 3),
+            'queue_depth': queue_depth,
+            'queue_size': queue_size,
+            'queue_high_water': self.queue_high_water,
+            'flushes_in_flight': flushes_in_flight,
+            'readings_received': self.readings_received,
+            'readings_rejected': self.readings_rejected,
+            'readings_written': self.readings_written,
+            'readings_duplicate': self.readings_duplicate,
+            'readings_failed': self.readings_failed,
+            'written_per_second': round(self.readings_written / uptime, 1) if uptime else 0.0,
+            'batches_written': self.batches_written,
+            'batch_rows_mean': round(sum(self.batch_rows) / len(self.batch_rows), 1) if self.batch_rows else 0.0,
+            'batch_rows_max': max(self.batch_rows, default=0),
+            'flush_seconds_p50': round(percentile(self.flush_seconds, 0.50), 4),
+            'flush_seconds_p95': round(percentile(self.flush_seconds, 0.95), 4),
+            'flush_seconds_max': round(max(self.flush_seconds, default=0.0), 4),
+            'write_retries': self.write_retries,
+            'backpressure_waits': self.backpressure_waits,
+            'alerts_written': self.alerts_written,
+        }
+
+class IngestService:
+    """Queue, batcher and COPY writers shared by the socket and HTTP front ends."""
+
+    def __init__(self, pool, pool_size, batch_rows=5000, max_latency=0.2, max_queue=100000,
+                 catalog_refresh=30.0, compressor=None, alerts=None, rule_source=None):
+        self.pool = pool
+        self.batch_rows = batch_rows
+        self.max_latency = max_latency
+        self.catalog_refresh = catalog_refresh
+        self.compressor = compressor
+        self.alerts = alerts
+        self.rule_source = rule_source
+        self.metrics = IngestMetrics()
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size + 1)
+        self.slots = asyncio.Semaphore(pool_size)
+        self.flushes = set()
+        self.clients = set()
+        self.scale_factors = {}
+        self.catalog_loaded = 0.0
+        self.catalog_lock = asyncio.Lock()
+        self.last_arrival = datetime.min.replace(tzinfo=timezone.utc)
+
+    # Function to read sensor_id -> scale_factor from the sensor and sensor_type tables (runs in a thread)
+    def read_catalog(self):
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT s.sensor_id, st.scale_factor
+                    FROM sensor s
+                    JOIN sensor_type st ON st.sensor_type_id = s.sensor_type_id
+                """)
+                scale_factors = dict(cur.fetchall())
+            conn.commit()
+        finally:
+            self.pool.putconn(conn)
+        return scale_factors
+
+    async def load_catalog(self):
+        loop = asyncio.get_running_loop()
+        self.scale_factors = await loop.run_in_executor(self.executor, self.read_catalog)
+        self.catalog_loaded = time.monotonic()
+
+    async def scale_factor(self, sensor_id):
+        """Scale factor of a sensor, reloading the catalog (rate limited) for sensors not seen before."""
+        scale = self.scale_factors.get(sensor_id)
+        if scale is None and time.monotonic() - self.catalog_loaded >= self.catalog_refresh:
+            async with self.catalog_lock:
+                if sensor_id not in self.scale_factors and time.monotonic() - self.catalog_loaded >= self.catalog_refresh:
+                    try:
+                        await self.load_catalog()
+                    except psycopg2.Error as e:
+                        # Keep the sensors we know, try again after the next catalog_refresh seconds
+                        self.catalog_loaded = time.monotonic()
+                        print(f'Reloading the sensor list failed: {e}', file=sys.stderr)
+            scale = self.scale_factors.get(sensor_id)
+        return scale
+
+    def arrival_time(self):
+        """Time a line arrived, strictly increasing so readings without a time never share a primary key."""
+        now = datetime.now(timezone.utc)
+        if now <= self.last_arrival:
+            now = self.last_arrival + timedelta(microseconds=1)
+        self.last_arrival = now
+        return now
+
+    async def parse_line(self, text, received):
+        """Turn one "sensor_id,value[,time]" line into a (time, sensor_id, value) reading, raises ValueError."""
+        fields = text.split(',')
+        if len(fields) not in (2, 3):
+            raise ValueError(f'expected sensor_id,value[,time]: {text!r}')
+        sensor_id = int(fields[0])
+        reading = float(fields[1])
+        if reading != reading or reading in (float('inf'), float('-inf')):
+            raise ValueError(f'value is not a finite number: {text!r}')
+        moment = parse_time(fields[2].strip()) if len(fields) == 3 else received
+        scale = await self.scale_factor(sensor_id)
+        if scale is None:
+            raise ValueError(f'unknown sensor_id {sensor_id}')
+        return moment, sensor_id, int(round(reading * scale))
+
+    async def submit(self, reading):
+        """Queue one reading, waiting while the queue is full (this is the backpressure)."""
+        self.metrics.readings_received += 1
+        if self.alerts is not None:
+            # Before the deadband, so readings it drops are still checked
+            self.alerts.offer(to_microseconds(reading[0]), reading[1], reading[2])
+        readings = [reading] if self.compressor is None else self.compressor.compress([reading])
+        for stored in readings:
+            if self.queue.full():
+                self.metrics.backpressure_waits += 1
+            await self.queue.put(stored)
+        depth = self.queue.qsize()
+        if depth > self.metrics.queue_high_water:
+            self.metrics.queue_high_water = depth
+
+    async def submit_lines(self, lines):
+        """Parse and queue lines, returns (accepted, errors)."""
+        accepted = 0
+        errors = []
+        for line in lines:
+            text = line.strip()
+            if not text or text.startswith('#'):
+                continue
+            try:
+                reading = await self.parse_line(text, self.arrival_time())
+            except ValueError as e:
+                self.metrics.readings_rejected += 1
+                errors.append(str(e))
+                continue
+            await self.submit(reading)
+            accepted += 1
+        return accepted, errors
+
+    def snapshot(self):
+        return self.metrics.snapshot(self.queue.qsize(), self.queue.maxsize, len(self.flushes))
+
+    async def run_batcher(self):
+        """Collect readings into batches by size or deadline and hand them to the writers until a None arrives."""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self.queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.batch_rows:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            # Waiting for a free connection here is what lets the queue fill up under load
+            await self.slots.acquire()
+            task = asyncio.ensure_future(self.flush(batch))
+            self.flushes.add(task)
+            task.add_done_callback(self.flushes.discard)
+        if self.flushes:
+            await asyncio.gather(*self.flushes)
+
+    async def flush(self, batch):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            written = await loop.run_in_executor(self.executor, self.write_batch, batch)
+        finally:
+            self.slots.release()
+        self.metrics.record_flush(len(batch), written, loop.time() - started)
+
+    # Function to COPY one batch on a pooled connection (runs in a thread), returns the rows written
+    def write_batch(self, batch):
+        text = readings_to_copy_text(batch)
+        delay = RETRY_DELAY
+        while True:
+            conn = None
+            try:
+                conn = self.pool.getconn()
+                with conn.cursor() as cur:
+                    try:
+                        cur.copy_expert(COPY_SQL, io.StringIO(text))
+                        written = len(batch)
+                    except psycopg2.errors.UniqueViolation:
+                        # Resent readings, keep the stored ones and write the rest
+                        conn.rollback()
+                        cur.execute("CREATE TEMP TABLE IF NOT EXISTS ingest_staging (LIKE sensor_datum) ON COMMIT DELETE ROWS")
+                        cur.copy_expert(STAGING_COPY_SQL, io.StringIO(text))
+                        cur.execute("""
+                            INSERT INTO sensor_datum (time, sensor_id, value)
+                            SELECT time, sensor_id, value FROM ingest_staging
+                            ON CONFLICT DO NOTHING
+                        """)
+                        written = cur.rowcount
+                        self.metrics.readings_duplicate += len(batch) - written
+                conn.commit()
+                self.pool.putconn(conn)
+                return written
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if conn is not None:
+                    self.pool.putconn(conn, close=True)
+                self.metrics.write_retries += 1
+                print(f'Write of {len(batch)} readings failed, retrying in {delay:.1f}s: {e}', file=sys.stderr)
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+            except psycopg2.Error as e:
+                # Bad data fails the same way every time, log it and drop the batch
+                if conn is not None:
+                    conn.rollback()
+                    self.pool.putconn(conn)
+                self.metrics.readings_failed += len(batch)
+                print(f'Dropped a batch of {len(batch)} readings: {e}', file=sys.stderr)
+                return 0
+
+    # Function to write alerts and read changed rules on a pooled connection (runs in a thread), returns (written, changes)
+    # with written None when the alerts could not be written
+    def write_pending_alerts(self, alerts, check_rules=False):
+        if not alerts and not check_rules:
+            return 0, None
+        conn = None
+        try:
+            conn = self.pool.getconn()
+            with conn.cursor() as cur:
+                written = write_alerts(cur, alerts)
+                changes = self.rule_source.changes(cur) if check_rules else None
+            conn.commit()
+        except psycopg2.Error as e:
+            if conn is not None and not conn.closed:
+                conn.rollback()
+            print(f'Writing {len(alerts)} alerts failed, keeping them for the next flush: {e}', file=sys.stderr)
+            return None, None
+        finally:
+            if conn is not None:
+                self.pool.putconn(conn, close=bool(conn.closed))
+        self.metrics.alerts_written += written
+        return written, changes
+
+    async def run_alert_writer(self, interval, reload_interval):
+        """Write the alerts raised every interval seconds; the evaluator itself is only touched on the event loop."""
+        loop = asyncio.get_running_loop()
+        last_check = loop.time()
+        while True:
+            await asyncio.sleep(interval)
+            check_rules = loop.time() - last_check >= reload_interval
+            if check_rules:
+                last_check = loop.time()
+            alerts = self.alerts.take_pending()
+            written, changes = await loop.run_in_executor(self.executor, self.write_pending_alerts, alerts, check_rules)
+            if written is None:
+                self.alerts.requeue(alerts)
+            if changes is not None:
+                self.rule_source.apply(self.alerts, changes)
+
+    async def handle_client(self, reader, writer):
+        """Line protocol: one reading per line, STATS for metrics."""
+        self.clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                text = line.decode('utf-8', errors='replace').strip()
+                if text.upper() == 'STATS':
+                    writer.write((json.dumps(self.snapshot()) + '\n').encode())
+                    await writer.drain()
+                    continue
+                _, errors = await self.submit_lines([text])
+                if errors:
+                    writer.write(f'ERR {errors[0]}\n'.encode())
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def handle_http(self, reader, writer):
+        """Minimal HTTP/1.1: POST /readings with one reading per line, GET /metrics."""
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            method, path = (request_line + ['', ''])[:2]
+            if method == 'GET' and path == '/metrics':
+                status, payload = '200 OK', self.snapshot()
+            elif method == 'POST' and path == '/readings':
+                accepted, errors = await self.submit_lines(body.decode('utf-8', errors='replace').splitlines())
+                status = '200 OK' if not errors else '400 Bad Request'
+                payload = {'accepted': accepted, 'rejected': len(errors), 'errors': errors[:10]}
+            else:
+                status, payload = '404 Not Found', {'error': 'use POST /readings or GET /metrics'}
+            content = json.dumps(payload).encode()
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                         f'Content-Length: {len(content)}\r\nConnection: close\r\n\r\n'.encode() + content)
+            await writer.drain()
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def report_stats(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            print(json.dumps(self.snapshot()), flush=True)
+
+    async def drain(self):
+        """Write everything still queued (and held back by the deadband) and stop the batcher."""
+        if self.compressor is not None:
+            for time_us, sensor_id, value in self.compressor.flush():
+                await self.queue.put((datetime.fromtimestamp(time_us / 1000000, timezone.utc), sensor_id, value))
+        await self.queue.put(None)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Asyncio ingest daemon that micro-batches live readings into sensor_datum with COPY.')
+    parser.add_argument('--dbname', default=DB_NAME, help='Database to write to (default aquaponics_db).')
+    parser.add_argument('--host', default='127.0.0.1', help='Address of the line protocol socket (default 127.0.0.1).')
+    parser.add_argument('--port', type=int, default=5555, help='Port of the line protocol socket (default 5555).')
+    parser.add_argument('--unix-socket', default=None, help='Listen on this unix socket path instead of TCP.')
+    parser.add_argument('--http-port', type=int, default=None, help='Also serve POST /readings and GET /metrics on this port.')
+    parser.add_argument('--batch-rows', type=int, default=5000, help='Readings per COPY at most (default 5000).')
+    parser.add_argument('--max-latency-ms', type=float, default=200.0,
+                        help='Longest a reading waits for its batch to fill before it is written (default 200).')
+    parser.add_argument('--max-queue', type=int, default=100000,
+                        help='Readings queued before senders are made to wait (default 100000).')
+    parser.add_argument('--pool-size', type=int, default=4, help='Concurrent COPY connections (default 4).')
+    parser.add_argument('--catalog-refresh', type=float, default=30.0,
+                        help='Minimum seconds between sensor list reloads triggered by unknown sensor_ids (default 30).')
+    parser.add_argument('--deadband', action='store_true',
+                        help="Drop readings within each sensor type's capture_after_delta_percent before they are queued.")
+    parser.add_argument('--alerts', action='store_true',
+                        help='Check every reading against alert_rule and write the alerts raised to systemwide_alert.')
+    parser.add_argument('--alert-interval', type=float, default=1.0,
+                        help='Seconds between writes of the alerts raised (default 1).')
+    parser.add_argument('--stats-interval', type=float, default=10.0,
+                        help='Seconds between metrics lines on stdout, 0 to disable (default 10).')
+    return parser.parse_args()
+
+async def serve(args):
+    pool = create_pool(1, args.pool_size + 1, dbname=args.dbname)
+    compressor = None
+    alerts = None
+    rule_source = RuleSource() if args.alerts else None
+    if args.deadband or args.alerts:
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                if args.deadband:
+                    compressor = DeadbandCompressor(load_thresholds(cur))
+                if args.alerts:
+                    alerts = rule_source.load(cur)
+            conn.commit()
+        finally:
+            pool.putconn(conn)
+    service = IngestService(pool, args.pool_size, batch_rows=args.batch_rows, max_latency=args.max_latency_ms / 1000.0,
+                            max_queue=args.max_queue, catalog_refresh=args.catalog_refresh, compressor=compressor,
+                            alerts=alerts, rule_source=rule_source)
+    await service.load_catalog()
+
+    if args.unix_socket:
+        servers = [await asyncio.start_unix_server(service.handle_client, path=args.unix_socket)]
+        print(f'Listening on {args.unix_socket} for {len(service.scale_factors)} sensors')
+    else:
+        servers = [await asyncio.start_server(service.handle_client, args.host, args.port)]
+        print(f'Listening on {args.host}:{args.port} for {len(service.scale_factors)} sensors')
+    if args.http_port:
+        servers.append(await asyncio.start_server(service.handle_http, args.host, args.http_port))
+        print(f'HTTP on {args.host}:{args.http_port} (POST /readings, GET /metrics)')
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except NotImplementedError:
+            pass  # Windows, Ctrl+C still raises KeyboardInterrupt
+    batcher = asyncio.ensure_future(service.run_batcher())
+    reporter = asyncio.ensure_future(service.report_stats(args.stats_interval)) if args.stats_interval > 0 else None
+    # Rules, labels and sensors are checked for changes as often as the sensor list may be reloaded
+    alert_writer = (asyncio.ensure_future(service.run_alert_writer(args.alert_interval, args.catalog_refresh))
+                    if alerts is not None else None)
+    try:
+        await stop.wait()
+    finally:
+        print('Stopping, writing queued readings...')
+        for server in servers:
+            server.close()
+        # Connected senders would otherwise keep their handlers (and wait_closed) alive
+        for writer in list(service.clients):
+            writer.close()
+        for server in servers:
+            await server.wait_closed()
+        await service.drain()
+        await batcher
+        if reporter is not None:
+            reporter.cancel()
+        if alert_writer is not None:
+            alert_writer.cancel()
+            await loop.run_in_executor(service.executor, service.write_pending_alerts, service.alerts.take_pending())
+        service.executor.shutdown()
+        pool.closeall()
+        print(json.dumps(service.snapshot()))
+    return 0
+
+def main():
+    args = parse_args()
+    try:
+        return asyncio.run(serve(args))
+    except psycopg2.Error as e:
+        print(f'Ingest service failed: {e}', file=sys.stderr)
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
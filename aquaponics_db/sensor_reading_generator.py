@@ -0,0 +1,213 @@
+"""
+MIT License Notice
+Copyright (c) 2024 Jeremy D. Gerdes <seakintruth@gmail.com>
+See full license in the repository.
+
+Streaming generator of realistic sensor_datum readings.
+
+Readings are produced lazily in batches of time steps, ordered by time and then sensor_id, so the
+(time, sensor_id) primary key never collides and consecutive rows land in the same hypertable chunk.
+Each sensor follows the profile of its sensor_type (baseline, diurnal cycle, slow drift and noise)
+and values are stored the way sensor_datum expects them: engineering units times scale_factor,
+rounded to an integer. Memory use is bounded by the batch size, not by the number of readings.
+"""
+import csv
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+
+# A sensor as stored in the sensor / sensor_type tables
+Sensor = namedtuple('Sensor', ['sensor_id', 'type_name', 'scale_factor'])
+
+# Behaviour of a sensor type in engineering units:
+# baseline value, diurnal amplitude, noise standard deviation, drift standard deviation per day, clip range
+SensorProfile = namedtuple('SensorProfile', ['baseline', 'diurnal_amplitude', 'noise', 'drift_per_day', 'minimum', 'maximum'])
+
+SENSOR_PROFILES = {
+    # Generic Sensors
+    'Temperature': SensorProfile(22.0, 5.0, 0.1, 0.3, -20.0, 50.0),
+    'Humidity': SensorProfile(60.0, 15.0, 0.5, 1.0, 0.0, 100.0),
+    'Pressure': SensorProfile(101.3, 0.3, 0.05, 0.2, 90.0, 110.0),
+    'Air Flow': SensorProfile(1.0, 0.5, 0.1, 0.05, 0.0, 20.0),
+    'Power Draw': SensorProfile(400.0, 150.0, 20.0, 5.0, 0.0, 10000.0),
+    'Water Flow Rate': SensorProfile(20.0, 0.0, 0.5, 0.2, 0.0, 200.0),
+    # Aquaponics Sensors
+    'pH': SensorProfile(7.0, 0.1, 0.02, 0.05, 0.0, 14.0),
+    'Water Level': SensorProfile(80.0, 0.5, 0.2, 0.5, 0.0, 200.0),
+    'Light Intensity': SensorProfile(10000.0, 10000.0, 200.0, 50.0, 0.0, 100000.0),
+    'Dissolved Oxygen': SensorProfile(7.5, 0.8, 0.05, 0.1, 0.0, 20.0),
+    'Conductivity': SensorProfile(1200.0, 20.0, 5.0, 10.0, 0.0, 5000.0),
+    'EC': SensorProfile(1.2, 0.02, 0.01, 0.02, 0.0, 5.0),
+    'Nitrate': SensorProfile(40.0, 1.0, 0.5, 1.0, 0.0, 300.0),
+    'Ammonia': SensorProfile(0.5, 0.05, 0.02, 0.05, 0.0, 10.0),
+    'Turbidity': SensorProfile(5.0, 0.5, 0.3, 0.2, 0.0, 100.0),
+    'Salinity': SensorProfile(0.5, 0.0, 0.02, 0.01, 0.0, 40.0),
+    'Total Dissolved Solids': SensorProfile(600.0, 10.0, 3.0, 5.0, 0.0, 3000.0),
+    'CO2 Concentration': SensorProfile(450.0, 100.0, 10.0, 5.0, 0.0, 5000.0),
+    'Nitrite': SensorProfile(0.2, 0.02, 0.01, 0.02, 0.0, 10.0),
+    'Feed Weight': SensorProfile(500.0, 0.0, 2.0, 10.0, 0.0, 5000.0),
+    'Vibration Sensor': SensorProfile(50.0, 0.0, 1.0, 0.1, 0.0, 1000.0),
+    'Light Sensor': SensorProfile(10000.0, 10000.0, 200.0, 50.0, 0.0, 100000.0),
+    'Leaf Wetness': SensorProfile(2.0, 2.0, 0.1, 0.1, 0.0, 24.0),
+    # Weather Station Sensors
+    'Barometric Pressure': SensorProfile(1013.0, 1.5, 0.2, 3.0, 950.0, 1060.0),
+    'Wind Speed': SensorProfile(3.0, 1.5, 0.8, 0.5, 0.0, 60.0),
+    'Wind Direction': SensorProfile(180.0, 30.0, 15.0, 20.0, 0.0, 359.0),
+    'Rain Gauge': SensorProfile(0.0, 0.0, 0.2, 0.0, 0.0, 100.0),
+    'Solar Radiation': SensorProfile(300.0, 400.0, 20.0, 10.0, 0.0, 1400.0),
+    'UV Index': SensorProfile(3.0, 4.0, 0.2, 0.1, 0.0, 15.0),
+    # Home Automation Sensors
+    'Motion Detection': SensorProfile(0.0, 0.2, 0.3, 0.0, 0.0, 1.0),
+    'Door/Window Sensor': SensorProfile(0.0, 0.1, 0.3, 0.0, 0.0, 1.0),
+    'Smoke Detector': SensorProfile(0.0, 0.0, 0.1, 0.0, 0.0, 1.0),
+    'Occupancy Sensor': SensorProfile(0.0, 0.3, 0.3, 0.0, 0.0, 1.0),
+    'Sound Level': SensorProfile(40.0, 10.0, 3.0, 1.0, 0.0, 140.0),
+}
+DEFAULT_PROFILE = SensorProfile(50.0, 5.0, 1.0, 0.5, 0.0, 100.0)
+
+SECONDS_PER_DAY = 86400
+# Local hour of the daily maximum for diurnal sensors (mid afternoon)
+DIURNAL_PEAK_HOUR = 15
+
+def load_sensors(cur):
+    """Read every sensor with its type name and scale factor, ordered by sensor_id."""
+    cur.execute("""
+        SELECT s.sensor_id, st.type_name, st.scale_factor
+        FROM sensor s
+        JOIN sensor_type st ON st.sensor_type_id = s.sensor_type_id
+        ORDER BY s.sensor_id
+    """)
+    return [Sensor(*row) for row in cur.fetchall()]
+
+def to_utc_datetime64(moment):
+    """Convert a datetime (naive values are taken as UTC) to a numpy datetime64[us]."""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(moment, 'us')
+
+def drift_steps(sensors, interval_seconds):
+    """Standard deviation of the drift random walk per reading interval, one value per sensor."""
+    profiles = [SENSOR_PROFILES.get(sensor.type_name, DEFAULT_PROFILE) for sensor in sensors]
+    return np.array([p.drift_per_day for p in profiles]) * np.sqrt(interval_seconds / SECONDS_PER_DAY)
+
+def draw_series_state(sensors, interval_seconds, boundaries, seed=None):
+    """
+    Draw the phase of every sensor and its drift at each step index in boundaries (ascending, from 0).
+
+    Returns (phase, drift) with drift[i] the walk before step boundaries[i]. Passing a sensor's phase
+    and the drift at both ends of a step range to generate_reading_batches lets separate processes
+    generate the pieces of one continuous series.
+    """
+    rng = np.random.default_rng(seed)
+    num_sensors = len(sensors)
+    phase = rng.uniform(-1.0, 1.0, num_sensors) * 3600.0
+    steps = np.diff(np.asarray(boundaries, dtype=np.float64))
+    increments = rng.normal(size=(len(steps), num_sensors)) * np.sqrt(steps)[:, None] * drift_steps(sensors, interval_seconds)
+    drift = np.vstack([np.zeros((1, num_sensors)), np.cumsum(increments, axis=0)])
+    return phase, drift
+
+def generate_reading_batches(sensors, start, interval_seconds, num_steps, batch_steps=1000, seed=None,
+                             phase=None, drift_start=None, drift_end=None):
+    """
+    Lazily yield (times, sensor_ids, values) numpy arrays covering num_steps readings of every sensor.
+
+    Each batch holds batch_steps time steps for all sensors, flattened time-major so rows are ordered
+    by (time, sensor_id). Drift is a per-sensor random walk carried across batches, so the series are
+    continuous no matter how they are chunked. phase, drift_start and drift_end (per-sensor arrays,
+    see draw_series_state) continue a series generated elsewhere: the walk starts at drift_start and
+    is pinned to end at drift_end after num_steps readings.
+    """
+    if not sensors:
+        return
+    rng = np.random.default_rng(seed)
+    num_sensors = len(sensors)
+    profiles = [SENSOR_PROFILES.get(sensor.type_name, DEFAULT_PROFILE) for sensor in sensors]
+    sensor_ids = np.array([sensor.sensor_id for sensor in sensors], dtype=np.int32)
+    scale = np.array([sensor.scale_factor for sensor in sensors], dtype=np.float64)
+    baseline = np.array([p.baseline for p in profiles])
+    amplitude = np.array([p.diurnal_amplitude for p in profiles])
+    noise = np.array([p.noise for p in profiles])
+    drift_step = drift_steps(sensors, interval_seconds)
+    minimum = np.array([p.minimum for p in profiles])
+    maximum = np.array([p.maximum for p in profiles])
+    if phase is None:
+        # Small per-sensor phase offsets so co-located sensors are not perfectly in step
+        phase = rng.uniform(-1.0, 1.0, num_sensors) * 3600.0
+    drift = np.zeros(num_sensors) if drift_start is None else np.asarray(drift_start, dtype=np.float64)
+
+    start64 = to_utc_datetime64(start)
+    start_second_of_day = (start64 - start64.astype('datetime64[D]')) / np.timedelta64(1, 's')
+    interval = np.timedelta64(int(interval_seconds * 1000000), 'us')
+    batch_steps = max(1, int(batch_steps))
+
+    for first_step in range(0, num_steps, batch_steps):
+        steps = min(batch_steps, num_steps - first_step)
+        step_index = np.arange(first_step, first_step + steps)
+        seconds = start_second_of_day + step_index * float(interval_seconds)
+
+        # (steps, sensors) matrices of engineering values
+        walk = np.cumsum(rng.normal(size=(steps, num_sensors)) * drift_step, axis=0)
+        if drift_end is None:
+            walk += drift
+        else:
+            # Brownian bridge: draw where this batch ends given the steps left to drift_end, then pin the walk to it
+            remaining = num_steps - first_step
+            if steps == remaining:
+                batch_end = drift_end
+            else:
+                batch_end = (drift + (drift_end - drift) * steps / remaining
+                             + rng.normal(size=num_sensors) * drift_step * np.sqrt(steps * (remaining - steps) / remaining))
+            fraction = np.arange(1, steps + 1)[:, None] / steps
+            walk = drift + walk + fraction * (batch_end - drift - walk[-1])
+        drift = walk[-1]
+        angle = 2 * np.pi * (seconds[:, None] - phase - DIURNAL_PEAK_HOUR * 3600.0) / SECONDS_PER_DAY
+        readings = baseline + amplitude * np.cos(angle) + walk + rng.normal(size=(steps, num_sensors)) * noise
+        np.clip(readings, minimum, maximum, out=readings)
+
+        times = np.repeat(start64 + step_index * interval, num_sensors)
+        yield times, np.tile(sensor_ids, steps), np.rint(readings * scale).astype(np.int64).ravel()
+
+def iter_readings(batches):
+    """Flatten batches into (datetime, sensor_id, value) tuples for row based sinks."""
+    for times, sensor_ids, values in batches:
+        yield from zip((t.replace(tzinfo=timezone.utc) for t in times.tolist()), sensor_ids.tolist(), values.tolist())
+
+def batch_to_copy_text(times, sensor_ids, values):
+    """Format one batch as tab separated text for COPY sensor_datum (time, sensor_id, value) FROM STDIN."""
+    if len(times) == 0:
+        return ''
+    time_text = np.datetime_as_string(times, unit='us', timezone='UTC')
+    return '\n'.join(map('\t'.join, zip(time_text, sensor_ids.astype(str), values.astype(str)))) + '\n'
+
+def write_csv(batches, path):
+    """Stream batches into a CSV file with a time,sensor_id,value header, returning the row count."""
+    total = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['time', 'sensor_id', 'value'])
+        for times, sensor_ids, values in batches:
+            time_text = np.datetime_as_string(times, unit='us', timezone='UTC')
+            writer.writerows(zip(time_text, sensor_ids.tolist(), values.tolist()))
+            total += len(times)
+    return total
+
+if __name__ == "__main__":
+    import argparse
+    from datetime import timedelta
+
+    parser = argparse.ArgumentParser(description='Write synthetic sensor readings to a CSV file without a database.')
+    parser.add_argument('output', help='CSV file to write.')
+    parser.add_argument('--sensor-types', default='Temperature,Humidity,pH,Dissolved Oxygen',
+                        help='Comma separated sensor_type names, one sensor is generated per name.')
+    parser.add_argument('--scale-factor', type=int, default=100, help='scale_factor applied to every sensor.')
+    parser.add_argument('--days', type=float, default=1.0, help='Days of readings ending now.')
+    parser.add_argument('--interval-seconds', type=int, default=60, help='Seconds between readings.')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for repeatable output.')
+    args = parser.parse_args()
+
+    sensors = [Sensor(i + 1, name.strip(), args.scale_factor) for i, name in enumerate(args.sensor_types.split(','))]
+    num_steps = int(args.days * SECONDS_PER_DAY // args.interval_seconds)
+    start = datetime.now(timezone.utc) - timedelta(seconds=num_steps * args.interval_seconds)
+    rows = write_csv(generate_reading_batches(sensors, start, args.interval_seconds, num_steps, seed=args.seed), args.output)
+    print(f'Wrote {rows} readings to {args.output}')
@@ -0,0 +1,133 @@
+"""
+MIT License Notice
+Copyright (c) 2024 Jeremy D. Gerdes <seakintruth@gmail.com>
+See full license in the repository.
+
+Load readings and verify the incremental rollup views from 04_setup_sensor_rollups.pgsql.
+
+Each rollup is refreshed and compared, in the same transaction (so now() is identical), against the
+definition of the materialized view it replaces evaluated on the same bucket-aligned grid. With
+--load-minutes, readings are first loaded in two halves with a refresh in between, so the second
+refresh exercises the incremental path (a backfill since the second half started) rather than a
+full rebuild.
+"""
+import argparse
+import sys
+import time
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta, timezone
+
+from db_connection import connect
+from sensor_data_loader import copy_sensor_data
+from sensor_reading_generator import load_sensors, generate_reading_batches
+
+Rollup = namedtuple('Rollup', ['rollup_name', 'original_view', 'incremental_view', 'step', 'window'])
+
+ROLLUPS = [
+    Rollup('second', 'second_by_second_last_15_minutes', 'second_by_second_last_15_minutes_incremental', '1 second', '15 minutes'),
+    Rollup('minute', 'minute_by_minute_last_24_hours', 'minute_by_minute_last_24_hours_incremental', '1 minute', '24 hours'),
+    Rollup('hour', 'hourly_last_week', 'hourly_last_week_incremental', '1 hour', '1 week'),
+]
+
+# The original materialized view definition, with the grid anchored on time_bucket(step, now())
+REFERENCE_SQL = """
+    WITH grid AS (
+        SELECT generate_series(
+            time_bucket(%(step)s::interval, now()) - %(window)s::interval,
+            time_bucket(%(step)s::interval, now()),
+            %(step)s::interval
+        ) AS grid_timestamp
+    )
+    SELECT
+        g.grid_timestamp AS time,
+        sd.sensor_id,
+        sd.value,
+        sd.time AS actual_record_time
+    FROM grid g
+    LEFT JOIN (
+        SELECT
+            sensor_id,
+            value,
+            time,
+            LEAD(time) OVER (PARTITION BY sensor_id ORDER BY time) AS next_time
+        FROM sensor_datum
+        WHERE time > time_bucket(%(step)s::interval, now()) - %(window)s::interval
+    ) sd ON g.grid_timestamp >= sd.time
+        AND (sd.next_time IS NULL OR g.grid_timestamp < sd.next_time)
+"""
+
+def load_readings(conn, minutes, interval_seconds, end):
+    """COPY readings for every existing sensor over the minutes before end."""
+    with conn.cursor() as cur:
+        sensors = load_sensors(cur)
+        num_steps = int(minutes * 60 // interval_seconds)
+        start = end - timedelta(seconds=num_steps * interval_seconds)
+        copy_sensor_data(cur, generate_reading_batches(sensors, start, interval_seconds, num_steps), 100000)
+    conn.commit()
+
+def refresh(conn, rollup_name, full, since=None):
+    with conn.cursor() as cur:
+        cur.execute("SELECT refresh_sensor_rollup(%s, %s, %s)", (rollup_name, full, since))
+        return cur.fetchone()[0]
+
+def verify_rollup(conn, rollup, full, since=None):
+    """Refresh one rollup and compare its view with the reference query, returns the mismatch count."""
+    with conn.cursor() as cur:
+        started = time.perf_counter()
+        rows_written = refresh(conn, rollup.rollup_name, full, since)
+        refresh_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        cur.execute(f"SELECT time, sensor_id, value, actual_record_time FROM {rollup.incremental_view}")
+        incremental = Counter(cur.fetchall())
+        incremental_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        cur.execute(REFERENCE_SQL, {'step': rollup.step, 'window': rollup.window})
+        reference = Counter(cur.fetchall())
+        reference_seconds = time.perf_counter() - started
+    conn.commit()
+
+    missing = reference - incremental
+    extra = incremental - reference
+    mismatches = sum(missing.values()) + sum(extra.values())
+    print(f'{rollup.incremental_view} vs {rollup.original_view} definition: '
+          f'{"OK" if not mismatches else f"{mismatches} MISMATCHED ROWS"}')
+    print(f'  refresh {rows_written} rows in {refresh_seconds:.3f}s, view {sum(incremental.values())} rows in '
+          f'{incremental_seconds:.3f}s, reference {sum(reference.values())} rows in {reference_seconds:.3f}s')
+    for row in sorted(missing, key=str)[:5]:
+        print(f'  missing from incremental view: {row}')
+    for row in sorted(extra, key=str)[:5]:
+        print(f'  only in incremental view: {row}')
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description='Verify the incremental rollup views against the materialized view definitions.')
+    parser.add_argument('--dbname', default=None, help='Database to verify (default aquaponics_db).')
+    parser.add_argument('--load-minutes', type=float, default=0,
+                        help='Load this many minutes of readings ending now before verifying, in two halves with a refresh between (default 0).')
+    parser.add_argument('--interval-seconds', type=int, default=1, help='Seconds between loaded readings of one sensor (default 1).')
+    parser.add_argument('--full', action='store_true', help='Rebuild the rollups from scratch instead of refreshing incrementally.')
+    args = parser.parse_args()
+
+    conn = connect(dbname=args.dbname) if args.dbname else connect()
+    since = None
+    try:
+        if args.load_minutes:
+            end = datetime.now(timezone.utc)
+            half = args.load_minutes / 2
+            load_readings(conn, half, args.interval_seconds, end - timedelta(minutes=half))
+            for rollup in ROLLUPS:
+                refresh(conn, rollup.rollup_name, False)
+            conn.commit()
+            # The second half is older than the last refresh, so it is refreshed as a backfill
+            since = end - timedelta(minutes=half)
+            load_readings(conn, half, args.interval_seconds, end)
+
+        mismatches = sum(verify_rollup(conn, rollup, args.full, since) for rollup in ROLLUPS)
+    finally:
+        conn.close()
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
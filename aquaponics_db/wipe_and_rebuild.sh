@@ -11,6 +11,11 @@ SCRIPTS=(
     "./01_setup_aquaponics_db.pgsql"
     "./02_setup_pg_cron_jobs.pgsql"
     "./03_intialize_ref_data.pgsql"
+    "./04_setup_sensor_rollups.pgsql"
+    "./05_setup_geo_zones.pgsql"
+    "./06_setup_label_index.pgsql"
+    "./07_setup_alert_rules.pgsql"
+    "./08_setup_sensor_retention.pgsql"
     "./10_load_faker_data.py"
     #"./20_additional_sql_after_python.pgsql"
     #"./30_additional_python.py"
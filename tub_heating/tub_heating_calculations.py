@@ -1,7 +1,18 @@
+"""
+Heating time and steady-state temperature of a water tub with an electric heater.
+
+Importing the module only defines the model: TubModel holds one tub and its surroundings, and
+scipy.integrate is imported the first time an ODE solve is needed. Run it as a script, or with
+python -m tub_heating_calculations, for the default scenarios or for JSON/CSV batches of scenarios:
+
+    python -m tub_heating_calculations scenarios.csv --output results.csv
+"""
+import warnings
+from functools import lru_cache
+
 import numpy as np
-from scipy.integrate import solve_ivp
 
-# inputs
+# Default inputs
 length_ft = 7
 width_ft = 3.8
 depth_ft = 3.5
@@ -20,20 +31,28 @@ def sat_vapor_pressure_psi(T_f):
     p_hpa = 6.1094 * np.exp(17.625 * T_c / (T_c + 243.04))
     return p_hpa * 0.0145038  # Convert hPa to psi
 
-def heat_loss_per_sqft_top(T_w, T_air, RH, wind_mph, covered=False, epsilon=0.9, sigma=1.713e-9):
-    if covered:
-        k_cover = 0.02  # Btu/hr·ft·°F (polystyrene)
-        d_cover = 0.25  # 3 inches
-        return k_cover * (T_w - T_air) / d_cover
-    # Uncovered: Evap + Conv + Rad
+# Heat loss constants
+K_COVER = 0.02  # Btu/hr·ft·°F (polystyrene)
+D_COVER = 0.25  # 3 inches
+K_FOAM = 0.02  # Btu/hr·ft·°F
+MIN_INSULATION_IN = 0.1875  # Minimum 0.1875 inches
+K_EVAP = 0.14  # Evaporation coefficient per unit h_cv
+L_V = 1050  # Btu/lb
+EPSILON = 0.9
+SIGMA = 1.713e-9
+
+def heat_loss_per_sqft_covered(T_w, T_air):
+    return K_COVER * (T_w - T_air) / D_COVER
+
+def heat_loss_per_sqft_uncovered(T_w, T_air, RH, wind_mph, epsilon=EPSILON, sigma=SIGMA):
+    # Evap + Conv + Rad, works on scalars and NumPy arrays alike
     h_cv = 1 + 0.3 * wind_mph
     # Evap
     p_w = sat_vapor_pressure_psi(T_w)
     p_a = sat_vapor_pressure_psi(T_air)
     dp = p_w - RH * p_a
-    K_E = 0.14 * h_cv
-    L_v = 1050  # Btu/lb
-    Q_e = L_v * K_E * dp
+    K_E = K_EVAP * h_cv
+    Q_e = L_V * K_E * dp
     # Conv
     Q_cv = h_cv * (T_w - T_air)
     # Rad (indoor, to air temp)
@@ -42,11 +61,15 @@ def heat_loss_per_sqft_top(T_w, T_air, RH, wind_mph, covered=False, epsilon=0.9,
     Q_rad = epsilon * sigma * (T_w_r**4 - T_air_r**4)
     return Q_e + Q_cv + Q_rad
 
+def heat_loss_per_sqft_top(T_w, T_air, RH, wind_mph, covered=False, epsilon=EPSILON, sigma=SIGMA):
+    if covered:
+        return heat_loss_per_sqft_covered(T_w, T_air)
+    return heat_loss_per_sqft_uncovered(T_w, T_air, RH, wind_mph, epsilon, sigma)
+
 def heat_loss_per_sqft_sides_bottom(T_w, T_air, insulation_thickness_in):
-    k_foam = 0.02  # Btu/hr·ft·°F
-    insulation_thickness_in = max(insulation_thickness_in, 0.1875)  # Minimum 0.1875 inches
+    insulation_thickness_in = max(insulation_thickness_in, MIN_INSULATION_IN)
     insulation_thickness_ft = insulation_thickness_in / 12  # Convert to feet
-    return k_foam * (T_w - T_air) / insulation_thickness_ft
+    return K_FOAM * (T_w - T_air) / insulation_thickness_ft
 
 # Constants
 density_lb_gal = 8.345
@@ -55,40 +78,223 @@ RH = 0.5
 btu_per_hr_per_w = 3.412142
 gal_to_ft3 = 0.133681
 
-def calculate_heating_time(P_watts, length_ft, width_ft, depth_ft, insulation_thickness_in, covered=False):
-    if insulation_thickness_in < 0.1875:
-        print(f"Warning: Insulation thickness {insulation_thickness_in:.4f} in is below minimum 0.1875 in; using 0.1875 in.")
-    P_btu_hr = P_watts * btu_per_hr_per_w
-    A_top_ft2 = length_ft * width_ft
-    A_sides_bottom_ft2 = 2 * length_ft * depth_ft + 2 * width_ft * depth_ft + length_ft * width_ft
-    volume_ft3 = length_ft * width_ft * depth_ft
-    gallons = volume_ft3 / gal_to_ft3
-    mass_lb = gallons * density_lb_gal
-    C_btu_f = mass_lb * cp_btu_lb_f
-    
-    def dT_dt(t, T):
-        T = T[0]
-        Q_loss_top = heat_loss_per_sqft_top(T, T_air, RH, wind_mph, covered)
-        Q_loss_sb = heat_loss_per_sqft_sides_bottom(T, T_air, insulation_thickness_in)
-        Q_loss_total = Q_loss_top * A_top_ft2 + Q_loss_sb * A_sides_bottom_ft2
-        return [(P_btu_hr - Q_loss_total) / C_btu_f]
-    
-    def event_reach_final(t, T):
-        return T[0] - T_final
-    event_reach_final.terminal = True
-    event_reach_final.direction = 1
-    
-    sol = solve_ivp(dT_dt, [0, 100], [T_initial], events=event_reach_final, rtol=1e-5, atol=1e-5)
-    if sol.success:
-        return sol.t[-1]
-    return None
-
-# Run calculations with default dimensions and insulation thickness
-for P_watts in [5500, 11000]:
-    for covered in [False, True]:
-        time_hours = calculate_heating_time(P_watts, length_ft, width_ft, depth_ft, insulation_thickness_in, covered)
-        if time_hours:
-            status = "Covered" if covered else "Uncovered"
-            print(f"Air/Initial Temp: {T_initial}F, Desired Temp: {T_final}F, Heater: {P_watts} W, {status}, Insulation: {max(insulation_thickness_in, 0.1875):.2f} in, Gallons: {length_ft * width_ft * depth_ft / gal_to_ft3:.1f}, Time to heat: {time_hours:.2f} hours")
+# Heat-loss tables cover liquid water, 0.1°F apart
+TABLE_T_MIN = 32.0
+TABLE_T_MAX = 212.0
+TABLE_STEP = 0.1
+
+@lru_cache(maxsize=64)
+def heat_loss_table_top(T_air, RH, wind_mph, covered=False):
+    """Uncovered/covered top loss per sqft at every TABLE_STEP from TABLE_T_MIN to TABLE_T_MAX, memoized per ambient."""
+    T_w = np.linspace(TABLE_T_MIN, TABLE_T_MAX, int(round((TABLE_T_MAX - TABLE_T_MIN) / TABLE_STEP)) + 1)
+    return heat_loss_per_sqft_top(T_w, T_air, RH, wind_mph, covered).tolist()
+
+def heat_loss_per_sqft_top_interp(T_w, T_air, RH, wind_mph, covered=False):
+    """heat_loss_per_sqft_top by linear interpolation in the memoized table, direct outside the table range."""
+    if covered or not TABLE_T_MIN <= T_w < TABLE_T_MAX:
+        return heat_loss_per_sqft_top(T_w, T_air, RH, wind_mph, covered)
+    table = heat_loss_table_top(T_air, RH, wind_mph)
+    position = (T_w - TABLE_T_MIN) / TABLE_STEP
+    i = int(position)
+    return table[i] + (table[i + 1] - table[i]) * (position - i)
+
+class TubModel:
+    """One tub, its insulation and cover, and the air around it."""
+
+    def __init__(self, length_ft=length_ft, width_ft=width_ft, depth_ft=depth_ft,
+                 insulation_thickness_in=insulation_thickness_in, covered=False, T_air=T_air, RH=RH, wind_mph=wind_mph):
+        if insulation_thickness_in < 0.1875:
+            warnings.warn(f"Insulation thickness {insulation_thickness_in:.4f} in is below minimum 0.1875 in; using 0.1875 in.")
+        self.length_ft = length_ft
+        self.width_ft = width_ft
+        self.depth_ft = depth_ft
+        self.insulation_thickness_in = insulation_thickness_in
+        self.covered = covered
+        self.T_air = T_air
+        self.RH = RH
+        self.wind_mph = wind_mph
+        self.A_top_ft2 = length_ft * width_ft
+        self.A_sides_bottom_ft2 = 2 * length_ft * depth_ft + 2 * width_ft * depth_ft + length_ft * width_ft
+        self.gallons = length_ft * width_ft * depth_ft / gal_to_ft3
+        self.C_btu_f = self.gallons * density_lb_gal * cp_btu_lb_f
+        # Sides and bottom are pure conduction, Btu/hr per °F above air
+        self.UA_sides_bottom = heat_loss_per_sqft_sides_bottom(1.0, 0.0, insulation_thickness_in) * self.A_sides_bottom_ft2
+
+    def heat_loss(self, T_w):
+        """Total heat loss in Btu/hr at water temperature T_w."""
+        Q_loss_top = heat_loss_per_sqft_top_interp(T_w, self.T_air, self.RH, self.wind_mph, self.covered)
+        return Q_loss_top * self.A_top_ft2 + self.UA_sides_bottom * (T_w - self.T_air)
+
+    def dT_dt(self, T_w, P_watts):
+        """Rate of temperature change in °F/hr."""
+        return (P_watts * btu_per_hr_per_w - self.heat_loss(T_w)) / self.C_btu_f
+
+    def steady_state_temperature(self, P_watts):
+        """Water temperature where heater power equals the heat loss, the most the heater can ever reach."""
+        P_btu_hr = P_watts * btu_per_hr_per_w
+        if self.covered:
+            # Both losses are conduction, linear in T_w - T_air
+            return self.T_air + P_btu_hr / (0.02 / 0.25 * self.A_top_ft2 + self.UA_sides_bottom)
+
+        # Uncovered loss increases with T_w, so the balance has one root; bisect on the exact loss
+        def balance(T):
+            return (P_btu_hr - heat_loss_per_sqft_top(T, self.T_air, self.RH, self.wind_mph) * self.A_top_ft2
+                    - self.UA_sides_bottom * (T - self.T_air))
+        low, high = self.T_air - 100.0, self.T_air + 100.0
+        while balance(low) < 0:
+            low -= 100.0
+        while balance(high) > 0:
+            high += 100.0
+        while high - low > 1e-6:
+            middle = 0.5 * (low + high)
+            if balance(middle) > 0:
+                low = middle
+            else:
+                high = middle
+        return 0.5 * (low + high)
+
+    def heating_time(self, P_watts, T_final=T_final, T_initial=None, max_hours=100):
+        """Hours to heat from T_initial (default the air temperature) to T_final, None when it is never reached."""
+        if T_initial is None:
+            T_initial = self.T_air
+        if T_initial >= T_final:
+            return 0.0
+        # Cases that can never reach T_final would otherwise integrate out the whole window
+        if self.steady_state_temperature(P_watts) <= T_final:
+            return None
+        from scipy.integrate import solve_ivp
+
+        def event_reach_final(t, T):
+            return T[0] - T_final
+        event_reach_final.terminal = True
+        event_reach_final.direction = 1
+
+        sol = solve_ivp(lambda t, T: [self.dT_dt(T[0], P_watts)], [0, max_hours], [T_initial],
+                        events=event_reach_final, rtol=1e-5, atol=1e-5)
+        if sol.success and sol.t_events[0].size:
+            return sol.t_events[0][0]
+        return None
+
+def steady_state_temperature(P_watts, length_ft, width_ft, depth_ft, insulation_thickness_in, covered=False,
+                             T_air=T_air, RH=RH, wind_mph=wind_mph):
+    """Water temperature where heater power equals the heat loss, the most the heater can ever reach."""
+    return TubModel(length_ft, width_ft, depth_ft, insulation_thickness_in, covered, T_air, RH, wind_mph).steady_state_temperature(P_watts)
+
+def calculate_heating_time(P_watts, length_ft, width_ft, depth_ft, insulation_thickness_in, covered=False,
+                           T_air=T_air, RH=RH, wind_mph=wind_mph, T_initial=None, T_final=T_final):
+    """Hours to heat from T_initial (default T_air) to T_final, None when the heater levels off below T_final."""
+    model = TubModel(length_ft, width_ft, depth_ft, insulation_thickness_in, covered, T_air, RH, wind_mph)
+    return model.heating_time(P_watts, T_final, T_initial)
+
+# Scenario fields read by the CLI and their types, P_watts is required
+SCENARIO_FIELDS = {
+    'P_watts': float, 'length_ft': float, 'width_ft': float, 'depth_ft': float, 'insulation_thickness_in': float,
+    'covered': bool, 'T_air': float, 'RH': float, 'wind_mph': float, 'T_initial': float, 'T_final': float,
+    'max_hours': float,
+}
+RESULT_FIELDS = list(SCENARIO_FIELDS) + ['gallons', 'steady_state_f', 'reached', 'time_hours']
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y', 'covered')
+    return bool(value)
+
+def read_scenarios(path):
+    """Read scenarios from a JSON list/object or a CSV file with a header row ('-' is stdin)."""
+    import csv
+    import io
+    import json
+    import sys
+    if path == '-':
+        text = sys.stdin.read()
+    else:
+        with open(path, newline='') as file:
+            text = file.read()
+    if text.lstrip().startswith(('[', '{')):
+        rows = json.loads(text)
+        rows = [rows] if isinstance(rows, dict) else rows
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+    scenarios = []
+    for number, row in enumerate(rows, 1):
+        unknown = set(row) - set(SCENARIO_FIELDS)
+        if unknown:
+            raise ValueError(f"{path} scenario {number}: unknown fields {', '.join(sorted(unknown))}")
+        if row.get('P_watts') in (None, ''):
+            raise ValueError(f"{path} scenario {number}: P_watts is required")
+        scenarios.append({name: (parse_bool(value) if SCENARIO_FIELDS[name] is bool else float(value))
+                          for name, value in row.items() if value not in (None, '')})
+    return scenarios
+
+def run_scenario(scenario, steady_state_only=False):
+    """Heating time, steady state and gallons of one scenario dict, filled in with the default inputs."""
+    inputs = {'length_ft': length_ft, 'width_ft': width_ft, 'depth_ft': depth_ft,
+              'insulation_thickness_in': insulation_thickness_in, 'covered': False, 'T_air': T_air, 'RH': RH,
+              'wind_mph': wind_mph, 'T_final': T_final, 'max_hours': 100.0}
+    inputs.update(scenario)
+    inputs.setdefault('T_initial', inputs['T_air'])
+    model = TubModel(inputs['length_ft'], inputs['width_ft'], inputs['depth_ft'], inputs['insulation_thickness_in'],
+                     inputs['covered'], inputs['T_air'], inputs['RH'], inputs['wind_mph'])
+    steady_state_f = model.steady_state_temperature(inputs['P_watts'])
+    if steady_state_only:
+        return dict(inputs, gallons=model.gallons, steady_state_f=steady_state_f,
+                    reached=steady_state_f > inputs['T_final'] or inputs['T_initial'] >= inputs['T_final'], time_hours=None)
+    time_hours = model.heating_time(inputs['P_watts'], inputs['T_final'], inputs['T_initial'], inputs['max_hours'])
+    return dict(inputs, gallons=model.gallons, steady_state_f=steady_state_f,
+                reached=time_hours is not None, time_hours=time_hours)
+
+def main(argv=None):
+    import argparse
+    import csv
+    import json
+    import sys
+
+    parser = argparse.ArgumentParser(description='Tub heating time and steady-state temperature for batches of scenarios.')
+    parser.add_argument('scenarios', nargs='*',
+                        help='JSON or CSV files of scenarios ("-" for stdin), fields: ' + ', '.join(SCENARIO_FIELDS)
+                             + '. Without files the default scenarios are printed.')
+    parser.add_argument('--output', default='-', help='Where to write the results (default stdout).')
+    parser.add_argument('--format', choices=['csv', 'json'], default=None,
+                        help='Output format (default from the --output extension, else csv).')
+    parser.add_argument('--steady-state-only', action='store_true',
+                        help='Only compute the steady-state temperature (no ODE solve, SciPy is never imported).')
+    args = parser.parse_args(argv)
+
+    if not args.scenarios:
+        # Run calculations with default dimensions and insulation thickness
+        for P_watts in [5500, 11000]:
+            for covered in [False, True]:
+                status = "Covered" if covered else "Uncovered"
+                time_hours = calculate_heating_time(P_watts, length_ft, width_ft, depth_ft, insulation_thickness_in, covered)
+                if time_hours is not None:
+                    print(f"Air/Initial Temp: {T_initial}F, Desired Temp: {T_final}F, Heater: {P_watts} W, {status}, Insulation: {max(insulation_thickness_in, 0.1875):.2f} in, Gallons: {length_ft * width_ft * depth_ft / gal_to_ft3:.1f}, Time to heat: {time_hours:.2f} hours")
+                else:
+                    T_steady = steady_state_temperature(P_watts, length_ft, width_ft, depth_ft, insulation_thickness_in, covered)
+                    print(f"Air/Initial Temp: {T_initial}F, Desired Temp: {T_final}F, Heater: {P_watts} W, {status}, Insulation: {max(insulation_thickness_in, 0.1875):.2f} in, Gallons: {length_ft * width_ft * depth_ft / gal_to_ft3:.1f}, Failed to reach {T_final}F, levels off at {T_steady:.1f}F.")
+        return 0
+
+    try:
+        scenarios = [scenario for path in args.scenarios for scenario in read_scenarios(path)]
+    except (OSError, ValueError) as e:
+        print(f"Error reading scenarios: {e}", file=sys.stderr)
+        return 1
+    results = [run_scenario(scenario, args.steady_state_only) for scenario in scenarios]
+
+    output_format = args.format or ('json' if args.output.endswith('.json') else 'csv')
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        if output_format == 'json':
+            json.dump(results, out, indent=2)
+            out.write('\n')
         else:
-            print(f"Air/Initial Temp: {T_initial}F, Desired Temp: {T_final}F, Heater: {P_watts} W, {status}, Insulation: {max(insulation_thickness_in, 0.1875):.2f} in, Gallons: {length_ft * width_ft * depth_ft / gal_to_ft3:.1f}, Failed to reach 98°F.")
\ No newline at end of file
+            writer = csv.DictWriter(out, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
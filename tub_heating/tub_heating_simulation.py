@@ -0,0 +1,297 @@
+"""
+Tub heating simulation over recorded ambient conditions with a heater control policy.
+
+The constant T_air / RH / wind of tub_heating_calculations is replaced by an ambient time series,
+for example greenhouse temperatures exported from aquaponics_db, and the heater is switched by a
+HeaterPolicy: a thermostat with a switching band, optionally limited to time-of-use hours. The run
+is solved in chunks: one solve_ivp call per ambient sample interval (and per hour when time-of-use
+hours apply), ending early at the thermostat switching points, which are found as terminal events.
+Inside a chunk the ambient is interpolated linearly and the heater state is fixed, so the solver
+never steps across a discontinuity. Results are energy (kWh), duty cycle, peak hourly load and the
+water temperature range; --trace writes the water temperature from the dense output of every chunk.
+
+    python -m tub_heating_simulation greenhouse.csv --P-watts 5500 --setpoint 101 --band 1
+"""
+import csv
+import math
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from tub_heating_calculations import (
+    TubModel, heat_loss_per_sqft_top, btu_per_hr_per_w, length_ft, width_ft, depth_ft, insulation_thickness_in, RH,
+    wind_mph,
+)
+
+# Ambient series: hours since start (a local time), with T_air (°F), RH (0-1) and wind_mph at each sample
+AmbientSeries = namedtuple('AmbientSeries', ['start', 'hours', 'T_air', 'RH', 'wind_mph'])
+
+SimulationResult = namedtuple('SimulationResult', [
+    'hours', 'heater_kw', 'kwh', 'duty_cycle', 'peak_hourly_kw', 'min_temp_f', 'max_temp_f',
+    'final_temp_f', 'switches', 'chunks', 'trace',
+])
+
+def c_to_f(T_c):
+    return T_c * 9 / 5 + 32
+
+def local_time(start, hours):
+    """The local time hours after start, counted in elapsed hours across DST changes."""
+    return (start.astimezone(timezone.utc) + timedelta(hours=hours)).astimezone(start.tzinfo)
+
+def read_ambient_csv(path, celsius=False, scale_factor=1.0, default_RH=RH, default_wind_mph=wind_mph, tz=None):
+    """
+    Read an ambient series from a CSV with a time column and a T_air (or value) column.
+
+    value columns as exported from sensor_datum are divided by scale_factor; celsius converts the
+    temperature to °F. Optional RH and wind_mph columns override the defaults per sample. Times with
+    an offset (sensor_datum exports are UTC) are converted to tz (a tzinfo, default the system time
+    zone) and naive times are taken as local to it, so the series starts at a local clock time.
+    """
+    samples = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            moment = datetime.fromisoformat(row['time'].strip().replace('Z', '+00:00'))
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=tz) if tz is not None else moment.astimezone()
+            moment = moment.astimezone(tz)
+            temperature = float(row['T_air'] if row.get('T_air') not in (None, '') else row['value']) / scale_factor
+            samples[moment] = (
+                c_to_f(temperature) if celsius else temperature,
+                float(row['RH']) if row.get('RH') not in (None, '') else default_RH,
+                float(row['wind_mph']) if row.get('wind_mph') not in (None, '') else default_wind_mph,
+            )
+    if len(samples) < 2:
+        raise ValueError(f"{path} needs at least two ambient samples")
+    times = sorted(samples)
+    start = times[0]
+    values = np.array([samples[moment] for moment in times])
+    # Aware datetimes that share a tzinfo subtract as wall clock times, so go through UTC
+    start_utc = start.astimezone(timezone.utc)
+    hours = np.array([(moment.astimezone(timezone.utc) - start_utc).total_seconds() / 3600 for moment in times])
+    return AmbientSeries(start, hours, values[:, 0], values[:, 1], values[:, 2])
+
+def parse_allowed_hours(text):
+    """Parse time-of-use windows like "22-6,12-14" (local clock hours, end exclusive) into a set of hours."""
+    hours = set()
+    for window in text.split(','):
+        first, _, last = window.strip().partition('-')
+        first = int(first)
+        last = int(last) if last else first + 1
+        hour = first
+        while True:
+            hours.add(hour % 24)
+            hour = (hour + 1) % 24
+            if hour == last % 24:
+                break
+    return hours
+
+class HeaterPolicy:
+    """Thermostat with a switching band, optionally restricted to time-of-use hours."""
+
+    def __init__(self, setpoint_f=None, band_f=1.0, allowed_hours=None):
+        # setpoint_f None means the heater runs whenever it is allowed to
+        self.setpoint_f = setpoint_f
+        self.band_f = band_f
+        self.allowed_hours = allowed_hours
+
+    @property
+    def on_below_f(self):
+        return self.setpoint_f - self.band_f
+
+    def allowed(self, moment):
+        return self.allowed_hours is None or moment.hour in self.allowed_hours
+
+def simulate(model, P_watts, ambient, policy, T_initial=None, trace_minutes=None):
+    """
+    Integrate the water temperature of model over the ambient series under the heater policy.
+
+    model supplies the tub geometry, insulation and cover; the ambient T_air, RH and wind_mph replace
+    the model's own. Returns a SimulationResult; trace is a list of (time, water °F, heater on)
+    every trace_minutes when trace_minutes is given, else empty.
+    """
+    from scipy.integrate import solve_ivp
+
+    P_btu_hr = P_watts * btu_per_hr_per_w
+    T_air_series, RH_series, wind_series, sample_hours = ambient.T_air, ambient.RH, ambient.wind_mph, ambient.hours
+    A_top_ft2, UA_sides_bottom, C_btu_f, covered = model.A_top_ft2, model.UA_sides_bottom, model.C_btu_f, model.covered
+
+    # Chunk edges: every ambient sample, plus every clock hour when time-of-use hours apply
+    edges = set(sample_hours.tolist())
+    if policy.allowed_hours is not None:
+        first_hour = 1 - (ambient.start.minute * 60 + ambient.start.second) / 3600
+        edges.update(np.arange(first_hour, sample_hours[-1], 1.0).tolist())
+    edges = sorted(edges)
+
+    T = T_initial if T_initial is not None else (policy.setpoint_f if policy.setpoint_f is not None else T_air_series[0])
+    on = False
+    on_hours = 0.0
+    hourly_on = defaultdict(float)
+    start_offset = ambient.start.minute / 60 + ambient.start.second / 3600
+    switches = 0
+    chunks = 0
+    min_temp = max_temp = T
+    trace = []
+    trace_step = trace_minutes / 60 if trace_minutes else None
+    next_trace = 0.0
+
+    def record_on(a, b):
+        # Spread heater time over the clock hours it falls in, for the peak hourly load
+        while a < b:
+            bin_index = math.floor(a + start_offset)
+            bin_end = bin_index + 1 - start_offset
+            hourly_on[bin_index] += min(b, bin_end) - a
+            a = min(b, bin_end)
+
+    for chunk_start, chunk_end in zip(edges[:-1], edges[1:]):
+        i = min(np.searchsorted(sample_hours, chunk_start, side='right') - 1, len(sample_hours) - 2)
+        t0, t1 = sample_hours[i], sample_hours[i + 1]
+
+        def ambient_at(t):
+            w = (t - t0) / (t1 - t0)
+            return (T_air_series[i] + (T_air_series[i + 1] - T_air_series[i]) * w,
+                    RH_series[i] + (RH_series[i + 1] - RH_series[i]) * w,
+                    wind_series[i] + (wind_series[i + 1] - wind_series[i]) * w)
+
+        allowed = policy.allowed(local_time(ambient.start, (chunk_start + chunk_end) / 2))
+        t = chunk_start
+        while t < chunk_end:
+            was_on = on
+            if not allowed:
+                on = False
+            elif policy.setpoint_f is None:
+                on = True
+            elif on and T >= policy.setpoint_f:
+                on = False
+            elif not on and T <= policy.on_below_f:
+                on = True
+            switches += on != was_on
+            heat = P_btu_hr if on else 0.0
+
+            def dT_dt(t, y):
+                T_air, rh, wind = ambient_at(t)
+                Q_loss = (heat_loss_per_sqft_top(y[0], T_air, rh, wind, covered) * A_top_ft2
+                          + UA_sides_bottom * (y[0] - T_air))
+                return [(heat - Q_loss) / C_btu_f]
+
+            events = []
+            if policy.setpoint_f is not None and allowed:
+                if on:
+                    def reach_setpoint(t, y):
+                        return y[0] - policy.setpoint_f
+                    reach_setpoint.terminal, reach_setpoint.direction = True, 1
+                    events.append(reach_setpoint)
+                else:
+                    def fall_below_band(t, y):
+                        return y[0] - policy.on_below_f
+                    fall_below_band.terminal, fall_below_band.direction = True, -1
+                    events.append(fall_below_band)
+
+            sol = solve_ivp(dT_dt, [t, chunk_end], [T], events=events or None, dense_output=trace_step is not None,
+                            rtol=1e-6, atol=1e-6)
+            chunks += 1
+            t_stop = sol.t[-1]
+            if trace_step is not None:
+                while next_trace <= t_stop:
+                    trace.append((local_time(ambient.start, next_trace), float(sol.sol(next_trace)[0]), on))
+                    next_trace += trace_step
+            if on:
+                on_hours += t_stop - t
+                record_on(t, t_stop)
+            min_temp = min(min_temp, float(sol.y[0].min()))
+            max_temp = max(max_temp, float(sol.y[0].max()))
+            T = float(sol.y[0, -1])
+            if sol.status == 1:
+                # Land exactly on the threshold so the next chunk starts in the switched state
+                T = policy.setpoint_f if on else policy.on_below_f
+                on = not on
+                switches += 1
+            elif t_stop <= t:
+                break
+            t = t_stop
+
+    total_hours = float(sample_hours[-1])
+    heater_kw = P_watts / 1000
+    bin_lengths = {}
+    for bin_index in hourly_on:
+        bin_start = max(0.0, bin_index - start_offset)
+        bin_lengths[bin_index] = min(total_hours, bin_index + 1 - start_offset) - bin_start
+    peak_hourly_kw = max((hourly_on[b] / bin_lengths[b] * heater_kw for b in hourly_on if bin_lengths[b] > 0), default=0.0)
+    return SimulationResult(
+        hours=total_hours,
+        heater_kw=heater_kw,
+        kwh=on_hours * heater_kw,
+        duty_cycle=on_hours / total_hours if total_hours else 0.0,
+        peak_hourly_kw=peak_hourly_kw,
+        min_temp_f=min_temp,
+        max_temp_f=max_temp,
+        final_temp_f=T,
+        switches=switches,
+        chunks=chunks,
+        trace=trace,
+    )
+
+def main(argv=None):
+    import argparse
+    import json
+    import sys
+    import time
+
+    parser = argparse.ArgumentParser(description='Simulate tub heating energy use over a recorded ambient series.')
+    parser.add_argument('ambient', help='CSV with time and T_air (or value) columns, optional RH and wind_mph.')
+    parser.add_argument('--celsius', action='store_true', help='The ambient temperatures are in °C.')
+    parser.add_argument('--scale-factor', type=float, default=1.0,
+                        help='Divide the temperature column by this, for raw sensor_datum values (default 1).')
+    parser.add_argument('--P-watts', type=float, default=5500, help='Heater power in watts (default 5500).')
+    parser.add_argument('--setpoint', type=float, default=101, help='Thermostat setpoint in °F (default 101).')
+    parser.add_argument('--band', type=float, default=1.0,
+                        help='The heater turns on this many °F below the setpoint and off at the setpoint (default 1).')
+    parser.add_argument('--always-on', action='store_true', help='No thermostat, the heater runs whenever it is allowed.')
+    parser.add_argument('--allowed-hours', default=None,
+                        help='Time-of-use windows the heater may run in, local clock hours like "22-6,12-14".')
+    parser.add_argument('--tz', default=None,
+                        help='Time zone of the local clock hours, like America/New_York (default the system time zone).')
+    parser.add_argument('--initial-temp', type=float, default=None, help='Starting water temperature (default the setpoint).')
+    parser.add_argument('--length-ft', type=float, default=length_ft)
+    parser.add_argument('--width-ft', type=float, default=width_ft)
+    parser.add_argument('--depth-ft', type=float, default=depth_ft)
+    parser.add_argument('--insulation-in', type=float, default=insulation_thickness_in)
+    parser.add_argument('--covered', action='store_true')
+    parser.add_argument('--trace', default=None, help='Write the water temperature every --trace-minutes to this CSV.')
+    parser.add_argument('--trace-minutes', type=float, default=15.0)
+    parser.add_argument('--json', action='store_true', help='Print the summary as JSON.')
+    args = parser.parse_args(argv)
+
+    try:
+        ambient = read_ambient_csv(args.ambient, args.celsius, args.scale_factor, tz=ZoneInfo(args.tz) if args.tz else None)
+        allowed_hours = parse_allowed_hours(args.allowed_hours) if args.allowed_hours else None
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Error reading ambient series: {e}", file=sys.stderr)
+        return 1
+    model = TubModel(args.length_ft, args.width_ft, args.depth_ft, args.insulation_in, args.covered)
+    policy = HeaterPolicy(None if args.always_on else args.setpoint, args.band, allowed_hours)
+
+    started = time.perf_counter()
+    result = simulate(model, args.P_watts, ambient, policy, args.initial_temp,
+                      trace_minutes=args.trace_minutes if args.trace else None)
+    elapsed = time.perf_counter() - started
+
+    if args.trace:
+        with open(args.trace, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['time', 'water_temp_f', 'heater_on'])
+            writer.writerows((moment.isoformat(), f'{temp:.3f}', int(on)) for moment, temp, on in result.trace)
+    summary = {name: value for name, value in result._asdict().items() if name != 'trace'}
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"{result.hours:.1f} hours simulated in {elapsed:.2f}s ({result.chunks} chunks)")
+        print(f"Energy: {result.kwh:.1f} kWh, duty cycle {result.duty_cycle:.1%}, peak hourly load {result.peak_hourly_kw:.2f} kW "
+              f"of {result.heater_kw:.2f} kW, {result.switches} heater switches")
+        print(f"Water temperature: {result.min_temp_f:.1f}F to {result.max_temp_f:.1f}F, final {result.final_temp_f:.1f}F")
+    return 0
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+Vectorized parameter sweeps of the tub heating model in tub_heating_calculations.py.
+
+Every case (heater wattage, tub dimensions, insulation, air temperature, wind, humidity and cover
+state) is one element of a set of broadcast NumPy arrays, and all cases are integrated together
+with a fixed-step RK4 integrator whose right hand side is evaluated on whole arrays. The time a
+case reaches T_final is located inside the step where it crosses, by bisection on the cubic Hermite
+interpolant of that step, so the event time does not depend on the step size the way a plain
+"first step past T_final" would. Cases whose steady-state temperature is at or below T_final are
+found up front by a vectorized bisection and are never integrated. Results come back as a NumPy
+structured array, one record per case (pandas.DataFrame(result) turns it into a DataFrame).
+"""
+import numpy as np
+
+from tub_heating_calculations import (
+    heat_loss_per_sqft_covered, heat_loss_per_sqft_uncovered, K_FOAM, MIN_INSULATION_IN,
+    btu_per_hr_per_w, gal_to_ft3, density_lb_gal, cp_btu_lb_f,
+)
+
+# Input fields of a sweep, in the order they appear in the result
+INPUT_FIELDS = ['P_watts', 'length_ft', 'width_ft', 'depth_ft', 'insulation_thickness_in',
+                'T_air', 'wind_mph', 'RH', 'covered', 'T_initial', 'T_final']
+
+RESULT_DTYPE = np.dtype([(name, np.bool_ if name == 'covered' else np.float64) for name in INPUT_FIELDS] + [
+    ('gallons', np.float64),
+    ('reached', np.bool_),
+    ('time_hours', np.float64),
+    ('final_temp_f', np.float64),
+    ('steady_state_f', np.float64),
+])
+
+def heat_loss_per_sqft_top_array(T_w, T_air, RH, wind_mph, covered):
+    """heat_loss_per_sqft_top for arrays of cases, covered is a boolean array."""
+    return np.where(covered, heat_loss_per_sqft_covered(T_w, T_air), heat_loss_per_sqft_uncovered(T_w, T_air, RH, wind_mph))
+
+def heat_loss_per_sqft_sides_bottom_array(T_w, T_air, insulation_thickness_in):
+    """heat_loss_per_sqft_sides_bottom for arrays of cases."""
+    return K_FOAM * (T_w - T_air) / (np.maximum(insulation_thickness_in, MIN_INSULATION_IN) / 12)
+
+def sweep_grid(**values):
+    """Cartesian product of the given input lists, as flat arrays ready for sweep_heating_time."""
+    names = list(values)
+    grids = np.meshgrid(*[np.atleast_1d(values[name]) for name in names], indexing='ij')
+    return {name: grid.ravel() for name, grid in zip(names, grids)}
+
+def sweep_heating_time(P_watts, length_ft, width_ft, depth_ft, insulation_thickness_in, T_air,
+                       wind_mph=0.0, covered=False, RH=0.5, T_initial=None, T_final=101.0,
+                       max_hours=100.0, step_hours=0.1):
+    """
+    Time to heat every case from T_initial (default T_air) to T_final, all inputs broadcast together.
+
+    Returns a structured array with the inputs, gallons, reached, time_hours (NaN when T_final is not
+    reached within max_hours), final_temp_f (T_final for cases that reached it, else the temperature
+    at max_hours) and steady_state_f. Cases whose steady state is at or below T_final are not
+    integrated at all; their final_temp_f is the steady state they level off at.
+    """
+    if T_initial is None:
+        T_initial = T_air
+    inputs = np.broadcast_arrays(*[np.asarray(value, dtype=np.float64) for value in (
+        P_watts, length_ft, width_ft, depth_ft, insulation_thickness_in, T_air, wind_mph, RH, covered, T_initial, T_final)])
+    P_watts, length_ft, width_ft, depth_ft, insulation_thickness_in, T_air, wind_mph, RH, covered, T_initial, T_final = \
+        [value.ravel() for value in inputs]
+    covered = covered.astype(bool)
+
+    P_btu_hr = P_watts * btu_per_hr_per_w
+    A_top_ft2 = length_ft * width_ft
+    A_sides_bottom_ft2 = 2 * length_ft * depth_ft + 2 * width_ft * depth_ft + length_ft * width_ft
+    gallons = length_ft * width_ft * depth_ft / gal_to_ft3
+    C_btu_f = gallons * density_lb_gal * cp_btu_lb_f
+
+    # Per-case constants are computed once; dT_dt only works on the cases still being integrated
+    def dT_dt(T, idx):
+        Q_loss = (heat_loss_per_sqft_top_array(T, T_air[idx], RH[idx], wind_mph[idx], covered[idx]) * A_top_ft2[idx]
+                  + heat_loss_per_sqft_sides_bottom_array(T, T_air[idx], insulation_thickness_in[idx]) * A_sides_bottom_ft2[idx])
+        return (P_btu_hr[idx] - Q_loss) / C_btu_f[idx]
+
+    n = len(P_watts)
+    time_hours = np.full(n, np.nan)
+    final_temp = T_initial.copy()
+    reached = T_initial >= T_final
+    time_hours[reached] = 0.0
+    steady_state = steady_state_temperature_array(dT_dt, np.arange(n), T_air)
+    unreachable = ~reached & (steady_state <= T_final)
+    final_temp[unreachable] = steady_state[unreachable]
+
+    active = np.flatnonzero(~reached & ~unreachable)
+    T = T_initial[active].copy()
+    f = dT_dt(T, active)
+    t = 0.0
+    while active.size and t < max_hours:
+        h = min(step_hours, max_hours - t)
+        k2 = dT_dt(T + 0.5 * h * f, active)
+        k3 = dT_dt(T + 0.5 * h * k2, active)
+        k4 = dT_dt(T + h * k3, active)
+        T_next = T + h / 6 * (f + 2 * k2 + 2 * k3 + k4)
+        f_next = dT_dt(T_next, active)
+
+        crossed = T_next >= T_final[active]
+        if crossed.any():
+            target = T_final[active][crossed]
+            time_hours[active[crossed]] = t + h * hermite_root(T[crossed], T_next[crossed], f[crossed] * h,
+                                                               f_next[crossed] * h, target)
+            final_temp[active[crossed]] = target
+            keep = ~crossed
+            active, T_next, f_next = active[keep], T_next[keep], f_next[keep]
+        T, f = T_next, f_next
+        t += h
+    final_temp[active] = T
+
+    result = np.empty(n, dtype=RESULT_DTYPE)
+    for name, value in zip(INPUT_FIELDS, (P_watts, length_ft, width_ft, depth_ft, insulation_thickness_in,
+                                          T_air, wind_mph, RH, covered, T_initial, T_final)):
+        result[name] = value
+    result['gallons'] = gallons
+    result['reached'] = ~np.isnan(time_hours)
+    result['time_hours'] = time_hours
+    result['final_temp_f'] = final_temp
+    result['steady_state_f'] = steady_state
+    return result
+
+def steady_state_temperature_array(dT_dt, idx, T_air, iterations=60):
+    """Temperature where dT_dt is zero for every case, by bisection (the heat loss increases with T)."""
+    low = T_air[idx] - 100.0
+    high = T_air[idx] + 100.0
+    # Widen the bracket of cases whose root lies outside it
+    for _ in range(20):
+        outside = dT_dt(low, idx) < 0
+        if not outside.any():
+            break
+        low = np.where(outside, low - 100.0, low)
+    for _ in range(20):
+        outside = dT_dt(high, idx) > 0
+        if not outside.any():
+            break
+        high = np.where(outside, high + 100.0, high)
+    for _ in range(iterations):
+        middle = 0.5 * (low + high)
+        rising = dT_dt(middle, idx) > 0
+        low = np.where(rising, middle, low)
+        high = np.where(rising, high, middle)
+    return 0.5 * (low + high)
+
+def hermite_root(y0, y1, m0, m1, target, iterations=40):
+    """Fraction of the step where the cubic Hermite interpolant (ends y0, y1, scaled slopes m0, m1) meets target."""
+    low = np.zeros_like(y0)
+    high = np.ones_like(y0)
+    for _ in range(iterations):
+        s = 0.5 * (low + high)
+        s2 = s * s
+        s3 = s2 * s
+        y = (2 * s3 - 3 * s2 + 1) * y0 + (s3 - 2 * s2 + s) * m0 + (-2 * s3 + 3 * s2) * y1 + (s3 - s2) * m1
+        below = y < target
+        low = np.where(below, s, low)
+        high = np.where(below, high, s)
+    return 0.5 * (low + high)
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Sweep tub heating time over heater sizes, insulation, air temperature and cover.')
+    parser.add_argument('--output', default='tub_heating_sweep.csv', help='CSV file for the results.')
+    parser.add_argument('--step-hours', type=float, default=0.1, help='Integrator step in hours (default 0.1).')
+    args = parser.parse_args()
+
+    cases = sweep_grid(
+        P_watts=[1500, 3000, 4500, 5500, 8000, 11000],
+        length_ft=[7], width_ft=[3.8], depth_ft=[2.5, 3.0, 3.5],
+        insulation_thickness_in=[0.19, 0.5, 1.0, 2.0],
+        T_air=[40, 55, 68, 80],
+        wind_mph=[0, 5],
+        covered=[False, True],
+    )
+    started = time.perf_counter()
+    result = sweep_heating_time(**cases, step_hours=args.step_hours)
+    elapsed = time.perf_counter() - started
+    np.savetxt(args.output, np.array(result.tolist(), dtype=np.float64), delimiter=',',
+               header=','.join(result.dtype.names), comments='', fmt='%.6g')
+    print(f'{len(result)} cases in {elapsed:.2f}s, {result["reached"].sum()} reached {result["T_final"][0]}F, results in {args.output}')